@@ -24,7 +24,7 @@ import argparse
 import logging as pylog
 import sys
 
-from artman.conductors import cloudtasks_conductor
+from artman.conductors import cloudtasks_conductor, metrics
 from artman.utils.logger import logger, setup_logging
 
 def start(*args):
@@ -33,14 +33,23 @@ def start(*args):
     flags = _parse_args(*args)
     if flags.log_local:
         pylog.basicConfig()
-    cloudtasks_conductor.run(flags.queue_name)
+    if flags.metrics_port is not None:
+        metrics.start_http_server(flags.metrics_port)
+    cloudtasks_conductor.run(
+        flags.queue or flags.queue_name,
+        workers=flags.workers,
+        lease_seconds=flags.lease_seconds,
+        renew_seconds=flags.renew_seconds,
+        log_sink=flags.log_sink,
+        tasks_per_worker=flags.tasks_per_worker,
+        prefetch=flags.prefetch)
 
 def _parse_args(*args):
     parser = _CreateArgumentParser()
     flags = parser.parse_args(args=args)
-    if not flags.queue_name:
+    if not flags.queue_name and not flags.queue:
         setup_logging(INFO)
-        logger.critical('Required --queue-name flag not specified')
+        logger.critical('Required --queue-name or --queue flag not specified')
         sys.exit(1)
     return flags
 
@@ -55,4 +64,53 @@ def _CreateArgumentParser():
         type=str,
         default=None,
         help="The name of task queue.")
+    parser.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        help="The task queue, either the name of a Cloud Tasks queue or "
+             "sqlite:///path/to/queue.db for a local queue. Takes precedence "
+             "over --queue-name.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The maximum number of tasks executed at once, each by its own "
+             "worker process.")
+    parser.add_argument(
+        "--tasks-per-worker",
+        type=int,
+        default=cloudtasks_conductor.TASKS_PER_WORKER,
+        help="How many tasks a worker process executes before being "
+             "replaced by a fresh one.")
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=None,
+        help="How many tasks are pulled ahead of free workers, to start the "
+             "next task by priority and tenant among them. Defaults to the "
+             "number of workers.")
+    parser.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=cloudtasks_conductor.LEASE_SECONDS,
+        help="How long pulled tasks are leased for.")
+    parser.add_argument(
+        "--renew-seconds",
+        type=int,
+        default=cloudtasks_conductor.RENEW_SECONDS,
+        help="How often the leases of running tasks are renewed.")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve metrics in the Prometheus text format on /metrics on "
+             "this port. Metrics are not served by default.")
+    parser.add_argument(
+        "--log-sink",
+        type=str,
+        default=cloudtasks_conductor.LOG_SINK,
+        help="Where the logs of tasks are shipped to while they run: `cloud` "
+             "for Cloud Logging, a file:// URL whose path may contain "
+             "{log_id}, or an http:// URL to POST them to.")
     return parser
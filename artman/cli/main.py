@@ -14,6 +14,7 @@
 """The new artman CLI with the following syntax.
 
     artman [Options] generate|publish <artifact_name>
+    artman [Options] resume <run_id>
 
 .. note::
     Only local execution is supported at this moment. The CLI syntax is
@@ -33,14 +34,15 @@ import traceback
 
 import pkg_resources
 from ruamel import yaml
-from taskflow import engines
 
 from artman.config import converter, loader
 from artman.config.proto.config_pb2 import Artifact, Config
 from artman.config.proto.user_config_pb2 import UserConfig
 from artman.cli import support
-from artman.pipelines import pipeline_factory
+from artman.utils import backend_helper
 from artman.utils import config_util
+from artman.utils import file_util
+from artman.utils import run_util
 from artman.utils.logger import logger, setup_logging
 
 VERSION = pkg_resources.get_distribution('googleapis-artman').version
@@ -58,17 +60,21 @@ def main(*args):
     # Get to a normalized set of arguments.
     flags = parse_args(*args)
     user_config = loader.read_user_config(flags.user_config)
-    _adjust_root_dir(flags.root_dir)
-    pipeline_name, pipeline_kwargs = normalize_flags(flags, user_config)
+    if flags.subcommand == 'resume':
+        pipeline_name, pipeline_kwargs = normalize_resume_flags(
+            flags, user_config)
+    else:
+        _adjust_root_dir(flags.root_dir)
+        pipeline_name, pipeline_kwargs = normalize_flags(flags, user_config)
 
     if flags.local:
         try:
-            pipeline = pipeline_factory.make_pipeline(pipeline_name, False,
-                                                      **pipeline_kwargs)
             # Hardcoded to run pipeline in serial engine, though not necessarily.
-            engine = engines.load(
-                pipeline.flow, engine='serial', store=pipeline.kwargs)
-            engine.run()
+            if flags.subcommand == 'resume':
+                _, credentials = run_util.split_credentials(pipeline_kwargs)
+                run_util.resume_pipeline(flags.run_id, credentials)
+            else:
+                run_util.run_pipeline(pipeline_name, pipeline_kwargs)
         except:
             logger.error(traceback.format_exc())
             sys.exit(32)
@@ -236,8 +242,52 @@ def parse_args(*args):
         'publishing configuration in ~/.artman.config.yaml, nor clone a new '
         'github repo. Instead, it will use the specified directory to stage '
         'generated result. This only works under --dry-run mode.', )
+    parser_publish.add_argument(
+        '--staging-strategy',
+        choices=file_util.STAGING_STRATEGIES,
+        default=None,
+        help='[Optional] How generated code is staged into the local repo '
+        'under --dry-run mode. `hardlink` and `reflink` avoid copying the '
+        'bytes, and `move` renames the generated code into place. They fall '
+        'back to copying across filesystems. Defaults to `copy`.', )
+    parser_publish.add_argument(
+        '--without-checkout',
+        dest='publish_without_checkout',
+        action='store_true',
+        help='[Optional] When specified, artman commits the generated code '
+        'to GitHub with `git fast-import` from its local mirror of the '
+        'repository, without checking out the base branch.', )
+    parser_publish.add_argument(
+        '--batch-publish',
+        dest='batch_publish',
+        action='store_true',
+        help='[Optional] When publishing a batch of APIs to GitHub, artman '
+        'commits all of them to a single branch and opens one pull request, '
+        'rather than one per API. All the APIs must target the same '
+        'repository and branch.', )
     parser_publish.set_defaults(dry_run=False)
 
+    # `resume` sub-command.
+    parser_resume = subparsers.add_parser(
+        'resume', help='Resume a failed run')
+    parser_resume.add_argument(
+        'run_id',
+        type=str,
+        help='[Required] The id of the run to resume, as logged when it '
+        'started. Tasks which completed in previous attempts are skipped.')
+    parser_resume.add_argument(
+        '--github-username',
+        default=None,
+        help='[Optional] The GitHub username. Credentials are not saved with '
+        'runs, so it must be set again to resume a run publishing to github, '
+        'but can come from the user config file.', )
+    parser_resume.add_argument(
+        '--github-token',
+        default=None,
+        help='[Optional] The GitHub personal access token. Credentials are '
+        'not saved with runs, so it must be set again to resume a run '
+        'publishing to github, but can come from the user config file.', )
+
     return parser.parse_args(args=args)
 
 
@@ -284,6 +334,14 @@ def normalize_flags(flags, user_config):
         flags.local_repo_dir = os.path.abspath(flags.local_repo_dir)
         pipeline_args['local_repo_dir'] = flags.local_repo_dir
 
+    if flags.subcommand == 'publish' and getattr(
+            flags, 'staging_strategy', None):
+        pipeline_args['staging_strategy'] = flags.staging_strategy
+
+    if flags.subcommand == 'publish' and getattr(
+            flags, 'publish_without_checkout', False):
+        pipeline_args['publish_without_checkout'] = True
+
     artman_config_path = flags.config
     if not os.path.isfile(artman_config_path):
         logger.error(
@@ -367,27 +425,7 @@ def normalize_flags(flags, user_config):
         pipeline_args.update(config_args)
 
     # Setup publishing related config if needed.
-    if flags.subcommand == 'generate':
-        pipeline_args['publish'] = 'noop'
-    elif flags.subcommand == 'publish':
-        publishing_config = _get_publishing_config(artifact_config,
-                                                   flags.target)
-        if publishing_config.type == Artifact.PublishTarget.GITHUB:
-            if flags.dry_run:
-                pipeline_args['publish'] = 'local'
-            else:
-                pipeline_args['publish'] = 'github'
-                pipeline_args['github'] = support.parse_github_credentials(
-                    argv_flags=flags,
-                    github_config=user_config.github)
-            repos = pipeline_args.pop('git_repos')
-            pipeline_args['git_repo'] = support.select_git_repo(
-                repos, publishing_config.name)
-        else:
-            logger.error(
-                'Publishing type `%s` is not supported yet.' %
-                Artifact.PublishTarget.Type.Name(publishing_config.type))
-            sys.exit(96)
+    _set_publishing_args(flags, user_config, artifact_config, pipeline_args)
 
     # Print out the final arguments to stdout, to help the user with
     # possible debugging.
@@ -410,6 +448,66 @@ def normalize_flags(flags, user_config):
     return pipeline_name, pipeline_args
 
 
+def _set_publishing_args(flags, user_config, artifact_config, pipeline_args):
+    """Add the publishing related pipeline arguments of a subcommand."""
+    if flags.subcommand == 'generate':
+        pipeline_args['publish'] = 'noop'
+        return
+    if flags.subcommand != 'publish':
+        return
+    publishing_config = _get_publishing_config(artifact_config, flags.target)
+    if publishing_config.type != Artifact.PublishTarget.GITHUB:
+        logger.error(
+            'Publishing type `%s` is not supported yet.' %
+            Artifact.PublishTarget.Type.Name(publishing_config.type))
+        sys.exit(96)
+    if flags.dry_run:
+        pipeline_args['publish'] = 'local'
+    else:
+        pipeline_args['publish'] = 'github'
+        pipeline_args['github'] = support.parse_github_credentials(
+            argv_flags=flags,
+            github_config=user_config.github)
+        if getattr(flags, 'batch_publish', False):
+            pipeline_args['batch_publish'] = True
+    repos = pipeline_args.pop('git_repos')
+    pipeline_args['git_repo'] = support.select_git_repo(
+        repos, publishing_config.name)
+
+
+def normalize_resume_flags(flags, user_config):
+    """Restore the flags of a run being resumed from its pipeline arguments.
+
+    The credentials, which are not saved with runs, are taken from the
+    flags and the user configuration again.
+
+    Args:
+        flags (argparse.Namespace): The flags parsed from sys.argv
+        user_config (dict): The user configuration taken from
+                            ~/.artman/config.yaml.
+
+    Returns:
+        tuple (str, dict): 2-tuple containing:
+            - pipeline name
+            - pipeline arguments
+    """
+    setup_logging(getattr(flags, 'verbosity', None) or INFO)
+    try:
+        pipeline_name, pipeline_args = run_util.load_run(flags.run_id)
+    except ValueError as ve:
+        logger.error('Run loading failed with `%s`' % ve)
+        sys.exit(96)
+    flags.root_dir = pipeline_args['root_dir']
+    flags.config = os.path.join(flags.root_dir, flags.config)
+    flags.output_dir = pipeline_args.get(
+        'output_dir', os.path.abspath(flags.output_dir))
+    flags.local_repo_dir = pipeline_args.get('local_repo_dir')
+    if pipeline_args.get('publish') == 'github':
+        pipeline_args['github'] = support.parse_github_credentials(
+            argv_flags=flags, github_config=user_config.github)
+    return pipeline_name, pipeline_args
+
+
 def _get_publishing_config(artifact_config_pb, publish_target):
     valid_options = []
     for target in artifact_config_pb.publish_targets:
@@ -456,8 +554,15 @@ def _run_artman_in_docker(flags):
         '-v', '%s:%s' % (artman_config_dirname, artman_config_dirname),
         '-w', root_dir
     ]
-    if flags.subcommand == 'publish' and flags.local_repo_dir:
+    if flags.subcommand in ('publish', 'resume') and flags.local_repo_dir:
         base_cmd.extend(['-v', '%s:%s' % (flags.local_repo_dir, flags.local_repo_dir)])
+    # Runs persist their progress on the host, so that they can be resumed.
+    runs_dir = backend_helper.local_persistence_dir()
+    if runs_dir:
+        if not os.path.isdir(runs_dir):
+            os.makedirs(runs_dir, 0o700)
+        base_cmd.extend(['-v', '%s:%s' % (runs_dir, runs_dir),
+                         '-e', 'ARTMAN_PERSISTENCE=%s' % runs_dir])
     base_cmd.extend([docker_image, '/bin/bash', '-c'])
 
     inner_artman_debug_cmd_str = inner_artman_cmd_str
@@ -500,6 +605,11 @@ def _change_owner(flags, pipeline_name, pipeline_kwargs):
     if os.path.exists(flags.output_dir):
         _change_directory_owner(flags.output_dir, user_host_id, group_host_id)
 
+    # Change ownership of the persisted runs.
+    runs_dir = backend_helper.local_persistence_dir()
+    if runs_dir and os.path.exists(runs_dir):
+        _change_directory_owner(runs_dir, user_host_id, group_host_id)
+
     # Change the local repo directory if specified.
     if 'local_repo_dir' in pipeline_kwargs:
         local_repo_dir = pipeline_kwargs['local_repo_dir']
@@ -16,126 +16,592 @@
 
 from __future__ import absolute_import
 import base64
+import calendar
+import collections
+import contextlib
 import io
+import json
 import logging
+import multiprocessing
 import os
+import random
+import signal
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import uuid
 
-from oauth2client.client import GoogleCredentials
-from gcloud import logging as cloud_logging
-from googleapiclient.discovery import build_from_document
-
 from artman.cli import main
+from artman.conductors import metrics, queues
+from artman.utils import file_util, git_util, log_util, protoc_utils
 from artman.utils.logger import logger, output_logger
 
 
 MAX_ATTEMPTS = 3
-CLOUD_LOGGING_CLIENT = None
-
 
-def run(queue_name):
-    task_client = _create_tasks_client()
+# Where the logs of tasks are shipped to by default. See log_util.make_sink.
+LOG_SINK = 'cloud'
+
+# How long to wait before pulling again when the queue is empty. The wait
+# doubles, with jitter, every time the queue is found empty again, and goes
+# back to zero as soon as tasks are pulled.
+MIN_IDLE_SLEEP_SECONDS = 1
+MAX_IDLE_SLEEP_SECONDS = 30
+
+# How long a pulled task is leased for, and how often the lease of a running
+# task is renewed. The renewal interval must leave enough margin for a slow
+# renewal request to complete before the lease expires.
+LEASE_SECONDS = 300
+RENEW_SECONDS = 120
+
+# How many tasks a worker process executes before being replaced by a fresh
+# one, which bounds the state a worker can accumulate (memory, caches,
+# leaked file descriptors).
+TASKS_PER_WORKER = 20
+
+# How long a task may run. Past that, its worker kills itself along with
+# the commands it runs, and is replaced by the pool. The conductor gives up
+# on the task KILL_GRACE_SECONDS later, once the worker is gone, and cancels
+# its lease so that it is redelivered.
+MAX_TASK_SECONDS = 4 * 60 * 60
+KILL_GRACE_SECONDS = 60
+
+# The priorities a task can be given by a `--priority` argument of its
+# payload, from the most to the least urgent. Tasks waiting for a worker are
+# started by priority, then fairly across the tenants given by a `--tenant`
+# argument.
+PRIORITIES = ('interactive', 'batch')
+DEFAULT_PRIORITY = 'interactive'
+
+# Metrics about the tasks, labeled with their pipeline and language, see
+# _task_labels. They are served by metrics.start_http_server.
+_LABELS = ('pipeline', 'language')
+TASKS_PULLED = metrics.Counter(
+    'artman_conductor_tasks_pulled_total',
+    'Tasks pulled from the queue.', _LABELS)
+TASKS_REDELIVERED = metrics.Counter(
+    'artman_conductor_tasks_redelivered_total',
+    'Tasks pulled again after a previous attempt.', _LABELS)
+TASKS_ACKED = metrics.Counter(
+    'artman_conductor_tasks_acked_total',
+    'Tasks which succeeded.', _LABELS)
+TASKS_FAILED = metrics.Counter(
+    'artman_conductor_tasks_failed_total',
+    'Tasks which failed or were lost, and are left to be redelivered.',
+    _LABELS)
+TASKS_COALESCED = metrics.Counter(
+    'artman_conductor_tasks_coalesced_total',
+    'Tasks which shared the execution of a running duplicate.', _LABELS)
+LEASE_RENEWALS = metrics.Counter(
+    'artman_conductor_lease_renewals_total',
+    'Leases of running or waiting tasks renewed.', _LABELS)
+LEASE_RENEWAL_FAILURES = metrics.Counter(
+    'artman_conductor_lease_renewal_failures_total',
+    'Leases of running or waiting tasks which could not be renewed.',
+    _LABELS)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    'artman_conductor_queue_wait_seconds',
+    'Time from the creation of a task to its start.',
+    _LABELS + ('priority', 'tenant'))
+CLONE_SECONDS = metrics.Histogram(
+    'artman_conductor_clone_seconds',
+    'Time to check out googleapis and prepare the directory of a task.',
+    _LABELS)
+GENERATION_SECONDS = metrics.Histogram(
+    'artman_conductor_generation_seconds',
+    'Time to execute artman for a task.', _LABELS)
+LOG_UPLOAD_SECONDS = metrics.Histogram(
+    'artman_conductor_log_upload_seconds',
+    'Time spent shipping the logs of a task.', _LABELS)
+
+# How often running tasks are checked for completion.
+_POLL_INTERVAL_SECONDS = 0.5
+
+# Set to cut an idle wait short and pull right away.
+_wake_event = threading.Event()
+
+# The payload arguments consumed by the conductor rather than passed to
+# artman, with their default values.
+_CONDUCTOR_ARGS = {
+    '--googleapis-revision': 'master',
+    '--priority': DEFAULT_PRIORITY,
+    '--tenant': '',
+}
+
+
+class _Execution(object):
+    """A task being executed by a worker process.
+
+    Followers are the tasks pulled while it runs which are duplicates of it.
+    They are not executed, but share its outcome.
+    """
+
+    def __init__(self, task, result, key=None):
+        self.task = task
+        self.result = result
+        self.key = key
+        self.followers = []
+        self.started_at = self.lease_renewed_at = time.time()
+        self.renewals = 0
+
+    @property
+    def tasks(self):
+        return [self.task] + self.followers
+
+
+class _Backlog(object):
+    """Tasks pulled ahead of free workers, waiting for one.
+
+    The next task to start is one of the most urgent priority. Among those,
+    it is the oldest task of the tenant with the fewest running tasks, and
+    ties go to the tenant which started a task least recently, so that
+    tenants take turns rather than a large batch of one of them starving
+    the others.
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self._lease_renewed_at = {}
+        self._last_turns = {}
+        self._turns = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, task):
+        self.tasks.append(task)
+        self._lease_renewed_at[task['name']] = time.time()
+
+    def pop(self, running):
+        """Remove and return the next task to start.
+
+        Args:
+            running (dict): The _Execution of the tasks being executed.
+        """
+        tenants = collections.Counter(
+            _scheduling_class(execution.task)[1]
+            for execution in running.values())
+
+        def rank(item):
+            index, task = item
+            priority, tenant = _scheduling_class(task)
+            return (PRIORITIES.index(priority), tenants[tenant],
+                    self._last_turns.get(tenant, 0), index)
+
+        index, task = min(enumerate(self.tasks), key=rank)
+        del self.tasks[index]
+        del self._lease_renewed_at[task['name']]
+        self._turns += 1
+        self._last_turns[_scheduling_class(task)[1]] = self._turns
+        return task
+
+    def renew_leases(self, queue, lease_seconds, renew_seconds):
+        """Renew the leases which were not renewed for renew_seconds.
+
+        A task whose lease cannot be renewed is dropped, and left to be
+        redelivered once its lease expires.
+        """
+        now = time.time()
+        for task in list(self.tasks):
+            if now - self._lease_renewed_at[task['name']] < renew_seconds:
+                continue
+            try:
+                queue.renew_lease(task, lease_seconds)
+            except Exception:
+                LEASE_RENEWAL_FAILURES.inc(**_task_labels(task))
+                logger.error('Failed to renew the lease of waiting task '
+                             '%s:\n%s'
+                             % (task['name'], traceback.format_exc()))
+                self.tasks.remove(task)
+                del self._lease_renewed_at[task['name']]
+                continue
+            LEASE_RENEWALS.inc(**_task_labels(task))
+            self._lease_renewed_at[task['name']] = now
+
+
+def wake():
+    """Pull tasks right away if the conductor is waiting for some.
+
+    This is meant to be called by a local notification channel when tasks
+    are enqueued. The conductor also calls it on SIGUSR1.
+    """
+    _wake_event.set()
+
+
+def run(queue_spec, workers=1, lease_seconds=LEASE_SECONDS,
+        renew_seconds=RENEW_SECONDS, log_sink=LOG_SINK,
+        tasks_per_worker=TASKS_PER_WORKER, prefetch=None):
+    """Pull and execute tasks forever, running up to `workers` at a time.
+
+    Tasks are pulled from the queue described by `queue_spec`, either a Cloud
+    Tasks queue name or a `sqlite:///path` URL, see queues.open_queue.
+
+    Tasks run in a pool of `workers` pre-forked worker processes, which
+    import artman and resolve the toolchain once, then execute one task at a
+    time, and are replaced after `tasks_per_worker` tasks. A failing or
+    exiting task thus does not bring down the conductor nor the tasks
+    running next to it. The lease of every running task is renewed every
+    `renew_seconds`, so that tasks running longer than `lease_seconds` are
+    not redelivered. The logs of every task are shipped to `log_sink` as it
+    runs.
+
+    Up to `prefetch` tasks, as many as `workers` by default, are pulled
+    ahead of free workers and kept leased, so that the next task to start
+    can be chosen by priority and tenant among them, see _Backlog.
+    """
+    if prefetch is None:
+        prefetch = workers
+    if renew_seconds >= lease_seconds:
+        raise ValueError('Leases must be renewed more often than every %d '
+                         'seconds.' % lease_seconds)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: wake())
+    # Start the workers first, so that they do not inherit the connections
+    # of the queue. The workers replacing those which executed
+    # tasks_per_worker tasks are forked later, from a fork server where
+    # available.
+    pool = _pool_context().Pool(workers, initializer=_init_worker,
+                                maxtasksperchild=tasks_per_worker)
+    queue = queues.open_queue(queue_spec)
+    running = {}
+    backlog = _Backlog()
+    idle_sleep = 0
     while True:
-        _pull_and_execute_tasks(task_client, queue_name)
-
-
-def _pull_and_execute_tasks(task_client, queue_name):
-    pull_task_response = _pull_task(task_client, queue_name)
-    tasks = pull_task_response.get('tasks', [])
-    if not tasks:
-        # Sleep for 30 seconds if there is no tasks returned.
-        logger.debug('There is no pending task. Sleep for 10 seconds.')
-        time.sleep(10)
-    for task in tasks:
-        task_id, tmp_root, artman_user_config, log_file_path = _prepare_dir()
-        log_file_handler = None
-        try:
-            log_file_handler = _setup_logger(log_file_path)
-            logger.info('Starting to execute task %s' % task)
-            if int(task['taskStatus']['attemptDispatchCount']) > MAX_ATTEMPTS:
-                logger.info('Delete task which exceeds max attempts.')
-                _delete_task(task_client, task)
+        idle_sleep = _pull_and_execute_tasks(
+            queue, running, pool, workers, lease_seconds, renew_seconds,
+            idle_sleep, log_sink, backlog, prefetch)
+
+
+def _pool_context():
+    """Return the multiprocessing context to start the workers with.
+
+    The fork server, started when the pool is created, forks every worker
+    from a process which never opens the queue. Python 2 has no fork server,
+    and forks the workers from the conductor.
+    """
+    if (hasattr(multiprocessing, 'get_context') and
+            'forkserver' in multiprocessing.get_all_start_methods()):
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing
+
+
+def _pull_and_execute_tasks(queue, running, pool, workers=1,
+                            lease_seconds=LEASE_SECONDS,
+                            renew_seconds=RENEW_SECONDS, idle_sleep=0,
+                            log_sink=LOG_SINK, backlog=None, prefetch=0):
+    """Pull as many tasks as there are free workers, and start them.
+
+    Up to prefetch more tasks are pulled and kept in the backlog, from
+    which the tasks to start are picked by priority and tenant.
+
+    Returns once a running task finished, or right away if more tasks may be
+    pending and there is free capacity. If the queue is empty, returns after
+    an idle wait backing off exponentially from the previous one, or as soon
+    as wake() is called.
+
+    Args:
+        queue: The queue to pull from, see queues.open_queue.
+        running (dict): The _Execution of the tasks being executed, by task
+            name. Updated in place.
+        pool (multiprocessing.Pool): The worker processes executing tasks.
+        workers (int): The maximum number of tasks executed at once, which
+            is the number of processes of the pool.
+        lease_seconds (int): How long pulled tasks are leased for.
+        renew_seconds (int): How often the leases of running tasks are
+            renewed.
+        idle_sleep (float): The previous idle wait, without jitter.
+        log_sink (str): Where the logs of the tasks are shipped to.
+        backlog (_Backlog): The tasks pulled ahead of free workers. Updated
+            in place.
+        prefetch (int): The maximum number of tasks in the backlog.
+
+    Returns:
+        float: The idle wait to back off from on the next call.
+    """
+    if backlog is None:
+        backlog = _Backlog()
+    tasks = []
+    wanted = workers - len(running) + prefetch - len(backlog)
+    if wanted > 0:
+        _wake_event.clear()
+        tasks = queue.pull(wanted, lease_seconds)
+        for task in tasks:
+            labels = _task_labels(task)
+            TASKS_PULLED.inc(**labels)
+            if int(task['taskStatus']['attemptDispatchCount']) > 0:
+                TASKS_REDELIVERED.inc(**labels)
+            backlog.add(task)
+    while len(running) < workers and backlog:
+        _start_task(queue, backlog.pop(running), running, pool, log_sink)
+    if len(running) >= workers:
+        timeout = None
+    elif tasks:
+        idle_sleep = timeout = 0
+    else:
+        idle_sleep = min(max(idle_sleep * 2, MIN_IDLE_SLEEP_SECONDS),
+                         MAX_IDLE_SLEEP_SECONDS)
+        timeout = random.uniform(idle_sleep / 2.0, idle_sleep)
+        logger.debug('There is no pending task. Sleep for %.1f seconds.'
+                     % timeout)
+    _reap_tasks(queue, running, timeout, lease_seconds, renew_seconds,
+                backlog)
+    return idle_sleep
+
+
+def _start_task(queue, task, running, pool, log_sink=LOG_SINK):
+    """Start executing a task in a worker, unless it is given up on."""
+    if int(task['taskStatus']['attemptDispatchCount']) > MAX_ATTEMPTS:
+        logger.info('Delete task %s which exceeds max attempts.'
+                    % task['name'])
+        queue.delete(task)
+        return
+    queue_wait = _queue_wait_seconds(task)
+    if queue_wait is not None:
+        priority, tenant = _scheduling_class(task)
+        logger.info('Task %s of priority %s waited %.1f seconds in the '
+                    'queue.' % (task['name'], priority, queue_wait))
+        QUEUE_WAIT_SECONDS.observe(queue_wait, priority=priority,
+                                   tenant=tenant, **_task_labels(task))
+    key = _coalescing_key(task)
+    for execution in running.values():
+        if execution.key == key:
+            logger.info('Task %s is a duplicate of running task %s, and '
+                        'shares its execution and logs.'
+                        % (task['name'], execution.task['name']))
+            execution.followers.append(task)
+            TASKS_COALESCED.inc(**_task_labels(task))
+            return
+    result = pool.apply_async(_run_task, (task, log_sink))
+    logger.info('Started task %s.' % task['name'])
+    running[task['name']] = _Execution(task, result, key)
+
+
+def _reap_tasks(queue, running, timeout=None,
+                lease_seconds=LEASE_SECONDS, renew_seconds=RENEW_SECONDS,
+                backlog=None):
+    """Acknowledge or cancel the lease of the tasks which finished.
+
+    Waits until at least one task finished, or until timeout seconds
+    elapsed or wake() is called if a timeout is given, renewing the leases
+    of the running tasks and of the backlog meanwhile.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        now = time.time()
+        finished = [name for name, execution in running.items()
+                    if execution.result.ready()
+                    or now - execution.started_at >
+                    MAX_TASK_SECONDS + KILL_GRACE_SECONDS]
+        for name in finished:
+            _finish_task(queue, running.pop(name))
+        _renew_leases(queue, running.values(), lease_seconds,
+                      renew_seconds)
+        if backlog is not None:
+            backlog.renew_leases(queue, lease_seconds, renew_seconds)
+        remaining = None if deadline is None else deadline - time.time()
+        if finished or (remaining is not None and remaining <= 0):
+            return
+        if remaining is None:
+            time.sleep(_POLL_INTERVAL_SECONDS)
+        elif _wake_event.wait(min(_POLL_INTERVAL_SECONDS, remaining)):
+            logger.debug('Woken up to pull tasks.')
+            return
+
+
+def _finish_task(queue, execution):
+    """Acknowledge or cancel the lease of a finished task and of its
+    duplicates."""
+    succeeded = _task_outcome(execution)
+    for task in execution.tasks:
+        _settle_task(queue, task, succeeded)
+    if execution.renewals:
+        logger.info('The lease of task %s was renewed %d times.'
+                    % (execution.task['name'], execution.renewals))
+
+
+def _task_outcome(execution):
+    """Return whether a finished task succeeded, and record its timings."""
+    task, result = execution.task, execution.result
+    if not result.ready():
+        logger.error('Task %s did not finish within %d seconds.'
+                     % (task['name'], MAX_TASK_SECONDS))
+        return False
+    if not result.successful():
+        logger.error('Task %s failed.' % task['name'])
+        return False
+    succeeded, timings = result.get()
+    if not succeeded:
+        logger.error('Task %s failed.' % task['name'])
+    _observe_timings(task, timings)
+    return succeeded
+
+
+def _settle_task(queue, task, succeeded):
+    """Count a finished task, and acknowledge it or cancel its lease."""
+    (TASKS_ACKED if succeeded else TASKS_FAILED).inc(**_task_labels(task))
+    try:
+        if succeeded:
+            queue.ack(task)
+        else:
+            queue.cancel_lease(task)
+    except Exception:
+        # The task is redelivered once its lease expires.
+        logger.error('\n'.join(traceback.format_tb(sys.exc_info()[2])))
+
+
+def _renew_leases(queue, executions, lease_seconds, renew_seconds):
+    """Renew the leases which were not renewed for renew_seconds."""
+    now = time.time()
+    for execution in executions:
+        if now - execution.lease_renewed_at < renew_seconds:
+            continue
+        renewed = True
+        for task in execution.tasks:
+            try:
+                # Later requests about the task carry the new schedule time.
+                queue.renew_lease(task, lease_seconds)
+            except Exception:
+                LEASE_RENEWAL_FAILURES.inc(**_task_labels(task))
+                logger.error('Failed to renew the lease of task %s:\n%s'
+                             % (task['name'], traceback.format_exc()))
+                if task is execution.task:
+                    # Retried on the next check.
+                    renewed = False
+                else:
+                    # The duplicate may now be executed by someone else.
+                    execution.followers.remove(task)
                 continue
+            LEASE_RENEWALS.inc(**_task_labels(task))
+        if renewed:
+            execution.lease_renewed_at = now
+            execution.renewals += 1
+
+
+def _observe_timings(task, timings):
+    """Record the durations of the steps of a task in the histograms."""
+    labels = _task_labels(task)
+    for name, histogram in (('clone', CLONE_SECONDS),
+                            ('generation', GENERATION_SECONDS),
+                            ('log_upload', LOG_UPLOAD_SECONDS)):
+        if name in timings:
+            histogram.observe(timings[name], **labels)
+
+
+def _queue_wait_seconds(task):
+    """Return how long a task waited in the queue before being pulled."""
+    create_time = task.get('createTime')
+    if not create_time:
+        return None
+    created = calendar.timegm(
+        time.strptime(create_time[:19], '%Y-%m-%dT%H:%M:%S'))
+    return max(time.time() - created, 0)
+
+
+def _init_worker():
+    """Warm up a worker process before it executes any task.
+
+    The modules needed by every task are imported, and the protobuf source
+    path is looked up once in the toolkit, so that tasks do not pay for it.
+    """
+    # Workers are interrupted through the pool, not by the signals meant for
+    # the conductor. Each worker leads its own process group, which the
+    # commands of its tasks join, so that it can kill them along with itself
+    # when a task exceeds MAX_TASK_SECONDS.
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    if hasattr(signal, 'SIGALRM'):
+        os.setpgrp()
+        signal.signal(signal.SIGALRM, _kill_worker)
+    from taskflow import engines  # noqa
+    from artman.pipelines import pipeline_factory  # noqa
+    from artman import tasks  # noqa
+    toolkit = os.environ.get('TOOLKIT_HOME')
+    if toolkit:
+        try:
+            protoc_utils.find_protobuf_path(toolkit)
+        except Exception:
+            # Left to the tasks needing it, which report the error.
+            logger.warning('Failed to find the protobuf source in %s.'
+                           % toolkit)
+
+
+def _kill_worker(signum, frame):
+    """Kill the worker and the commands it runs, as its task timed out.
+
+    The pool replaces the worker, so the capacity of the conductor is kept,
+    and the task can no longer publish anything once redelivered.
+    """
+    os.killpg(os.getpgrp(), signal.SIGKILL)
+
+
+def _run_task(task, log_sink=LOG_SINK):
+    """Execute a task in its own temporary root and working directory.
+
+    The logs of the task are shipped to log_sink while it runs, under the
+    task id as log name. In a worker, the task is killed along with the
+    worker if it runs for more than MAX_TASK_SECONDS, see _init_worker.
+
+    Returns:
+        tuple: Whether the task succeeded, and the durations in seconds of
+            its `clone`, `generation` and `log_upload` steps, by name, for
+            the steps which were reached.
+    """
+    task_id = str(uuid.uuid4())[0:8]
+    log_handler = _setup_logger(task_id, log_sink)
+    tmp_root = None
+    timings = {}
+    succeeded = False
+    if hasattr(signal, 'SIGALRM'):
+        signal.alarm(int(MAX_TASK_SECONDS))
+    try:
+        logger.info('-------- Beginning of %s -----------' % task_id)
+        _, revision = _task_args(task)
+        with _timed(timings, 'clone'):
+            tmp_root, artman_user_config = _prepare_dir(
+                task_id, revision=revision)
+        os.chdir(tmp_root)
+        logger.info('Starting to execute task %s' % task)
+        with _timed(timings, 'generation'):
             _execute_task(artman_user_config, task)
-            _ack_task(task_client, task)
-            logger.info('Task execution finished')
-        except Exception as e:
-            logger.error('\n'.join(traceback.format_tb(sys.exc_info()[2])))
-            _cancel_task_lease(task_client, task)
-        finally:
-            logger.info('Cleanup tmp directory %s' % tmp_root)
-            # Use task id as log name
-            _write_to_cloud_logging(task_id, log_file_path)
-            _cleanup(tmp_root, log_file_handler)
-
-
-def _create_tasks_client():
-    credentials = GoogleCredentials.get_application_default()
-    with open(
-        os.path.join(os.path.dirname(__file__), 'cloudtasks.json'), 'r') as f:
-            return build_from_document(f.read(), credentials=credentials)
-
-
-def _pull_task(task_client, queue_name):
-    body = {
-      "maxTasks": 1,
-      "leaseDuration": {"seconds": 300, "nanos": 0},  # Expire after 300 secs.
-      "responseView": "FULL",
-      "name": "%s" % queue_name
-    }
-    tasks = task_client.projects().locations().queues().tasks().pull(
-        name=queue_name, body=body).execute()
-    logger.info('Pulling tasks request returned %s' % tasks)
-    return tasks
-
-
-def _ack_task(task_client, task):
-    body = {'scheduleTime': task['scheduleTime']}
-    response = task_client.projects().locations().queues().tasks().acknowledge(
-        name=task['name'],
-        body=body).execute()
-    logger.info('Acknowledge task request returned %s' % response)
-    return response
-
-
-def _cancel_task_lease(task_client, task):
-    body = {'scheduleTime': task['scheduleTime'], 'responseView': 'FULL'}
-    response = task_client.projects().locations().queues().tasks().cancelLease(
-        name=task['name'],
-        body=body).execute()
-    logger.info('Cancel task request returned %s' % response)
-    return response
-
-
-def _delete_task(task_client, task):
-    response = task_client.projects().locations().queues().tasks().delete(
-        name=task['name']).execute()
-    logger.info('Delete task request returned %s' % response)
-    return response
-
-
-def _setup_logger(log_path):
-    """Setup logger with one-time logging FileHandler."""
-    log_file_handler = logging.FileHandler(log_path)
-    logger.addHandler(log_file_handler)
-    return log_file_handler
-
-
-def _write_to_cloud_logging(log_id, log_file_path):
-    """Write log file content to cloud logging"""
-    # TODO(ethanbao): Turn conductor into a python object so that the logging
-    # client can be instance variable not global variable.
-    global CLOUD_LOGGING_CLIENT
-    if not CLOUD_LOGGING_CLIENT:
-        CLOUD_LOGGING_CLIENT = cloud_logging.Client()
-    cloud_logger = CLOUD_LOGGING_CLIENT.logger(log_id)
-    if log_file_path:
-        with open(log_file_path, 'r') as log_file:
-            cloud_logger.log_text(log_file.read())
+        logger.info('Task execution finished')
+        succeeded = True
+    except SystemExit as e:
+        # artman exits with a non-zero code on failure, which must not end
+        # the worker.
+        logger.info('Task exited with code %s' % e.code)
+        succeeded = not e.code
+    except Exception:
+        logger.error('\n'.join(traceback.format_tb(sys.exc_info()[2])))
+    finally:
+        if hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+        logger.info('Cleanup tmp directory %s' % tmp_root)
+        _cleanup(tmp_root, log_handler)
+    timings['log_upload'] = log_handler.ship_seconds
+    return succeeded, timings
+
+
+@contextlib.contextmanager
+def _timed(timings, name):
+    """Record how long the block takes in timings, even if it fails."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = time.time() - start
+
+
+def _setup_logger(log_id, log_sink):
+    """Setup logger with a one-time handler shipping logs to log_sink."""
+    # The task runs in its own process, which has not set up logging yet.
+    if logger.getEffectiveLevel() > logging.INFO:
+        logger.setLevel(logging.INFO)
+    log_handler = log_util.ShippingHandler(
+        log_util.make_sink(log_sink, log_id))
+    logger.addHandler(log_handler)
+    return log_handler
 
 
 def _execute_task(artman_user_config, task):
@@ -143,35 +609,107 @@ def _execute_task(artman_user_config, task):
 
     It execute the artman command with a customized artman user config and
     additional pipeline arguments."""
-    task_payload = base64.b64decode(task['pullTaskTarget']['payload'])
-    artman_args = task_payload.decode("utf-8").split(' ')
+    artman_args, _ = _task_args(task)
     artman_args.append('--user-config')
     artman_args.append(artman_user_config)
     main.main(*artman_args)
 
 
-def _prepare_dir(source_repo="https://github.com/googleapis/googleapis.git"):
+def _task_args(task):
+    """Return the artman arguments of a task and its googleapis revision.
+
+    The revision is given by an optional `--googleapis-revision` argument of
+    the payload, which is consumed by the conductor rather than passed to
+    artman, and defaults to master.
+    """
+    artman_args, conductor_args = _parse_payload(task)
+    return artman_args, conductor_args['--googleapis-revision']
+
+
+def _task_labels(task):
+    """Return the metric labels of a task.
+
+    The pipeline and the language are told by the name of the artifact the
+    task generates or publishes, which is `<language>_<pipeline>` by
+    convention, such as `python_gapic`. They are empty if unknown.
+    """
+    artman_args, _ = _task_args(task)
+    artifact = ''
+    for command in ('generate', 'publish'):
+        if command in artman_args[:-1]:
+            artifact = artman_args[artman_args.index(command) + 1]
+            break
+    language, _, pipeline = artifact.partition('_')
+    return {'pipeline': pipeline, 'language': language}
+
+
+def _scheduling_class(task):
+    """Return the priority and the tenant of a task.
+
+    They are given by optional `--priority` and `--tenant` arguments of the
+    payload. An unknown priority is treated as the least urgent one.
+    """
+    _, conductor_args = _parse_payload(task)
+    priority = conductor_args['--priority']
+    if priority not in PRIORITIES:
+        priority = PRIORITIES[-1]
+    return priority, conductor_args['--tenant']
+
+
+def _parse_payload(task):
+    """Split the payload of a task into the artman arguments and the
+    arguments consumed by the conductor, see _CONDUCTOR_ARGS."""
+    task_payload = base64.b64decode(task['pullTaskTarget']['payload'])
+    artman_args = task_payload.decode("utf-8").split(' ')
+    conductor_args = dict(_CONDUCTOR_ARGS)
+    for name in _CONDUCTOR_ARGS:
+        if name in artman_args:
+            index = artman_args.index(name)
+            conductor_args[name] = artman_args[index + 1]
+            del artman_args[index:index + 2]
+    return artman_args, conductor_args
+
+
+def _coalescing_key(task):
+    """Return a key identifying the tasks which produce the same result.
+
+    The key is made of the googleapis revision and the artman arguments,
+    whose flags are sorted so that their order does not matter. The
+    priority and the tenant do not matter either. Arguments
+    before the first flag are positional and keep their order.
+    """
+    artman_args, revision = _task_args(task)
+    positional, groups = [], []
+    for arg in artman_args:
+        if not arg:
+            continue
+        if arg.startswith('-'):
+            groups.append([arg])
+        elif groups:
+            groups[-1].append(arg)
+        else:
+            positional.append(arg)
+    return json.dumps([revision, positional, sorted(groups)])
+
+
+def _prepare_dir(task_id,
+                 source_repo="https://github.com/googleapis/googleapis.git",
+                 revision='master'):
     """Prepare the temporary folder to task execution.
 
-    It downloads the googleapis repo and adds a one-time artman config yaml.
+    It checks out the googleapis repo at the given revision and adds a
+    one-time artman config yaml.
     TODO(ethanbao): support loading more input files from heterogeneous data
     sources"""
 
-    task_id = str(uuid.uuid4())[0:8]
     repo_root = '/tmp/artman/%s' % task_id
     logger.info('Prepare a temporary root repo: %s' % repo_root)
     try:
         os.makedirs(repo_root)
     except OSError as e:
         raise e
-    logger.info('Checking out fresh clone of %s.' % source_repo)
-    googleapis_dir = os.path.join(repo_root, "googleapis")
-    subprocess.check_output(['rm', '-f', '.git/config'])
-    git_clone_args = ['git', 'clone', source_repo, googleapis_dir]
-    output = subprocess.check_output(git_clone_args)
-    if output:
-        output = output.decode('utf8')
-        output_logger.success(output)
+    _checkout_googleapis(
+        source_repo, revision, os.path.join(repo_root, "googleapis"))
 
     artman_user_config = os.path.join(repo_root, 'artman-config.yaml')
     with io.open(artman_user_config, 'w+') as file_:
@@ -181,21 +719,64 @@ def _prepare_dir(source_repo="https://github.com/googleapis/googleapis.git"):
             toolkit_home = os.environ.get('TOOLKIT_HOME')
             file_.write(u'  toolkit: %s \n' % toolkit_home)
         file_.write(u'publish: noop \n')
+    return repo_root, artman_user_config
+
+
+def _checkout_googleapis(source_repo, revision, dest):
+    """Check out a revision of the source repo to dest.
+
+    The repo is kept as a persistent bare mirror, which is only fetched
+    incrementally, and only when the revision is a branch or a commit it
+    does not have yet. dest is then a clone sharing the objects of the
+    mirror, so creating it does not download nor copy any object.
+    """
+    mirror = git_util.mirror_dir(source_repo)
+    if not os.path.isdir(git_util.git_cache_dir()):
+        os.makedirs(git_util.git_cache_dir())
+    # Tasks running next to each other share the mirror.
+    with file_util.locked(mirror + '.lock'):
+        commit = _resolve_commit(mirror, revision)
+        if not commit or commit != revision:
+            logger.info('Fetching %s into %s.' % (source_repo, mirror))
+            for command in git_util.update_mirror_commands(
+                    mirror, source_repo):
+                _check_output(command)
+            commit = _resolve_commit(mirror, revision)
+    if not commit:
+        raise ValueError('Revision %s does not exist in %s.'
+                         % (revision, source_repo))
+    logger.info('Checking out %s of %s.' % (commit, source_repo))
+    for command in git_util.shared_checkout_commands(mirror, dest, commit):
+        _check_output(command)
+
+
+def _resolve_commit(mirror, revision):
+    """Return the commit of a revision in the mirror, or None if missing."""
+    if not os.path.isdir(mirror):
+        return None
+    try:
+        return subprocess.check_output(
+            ['git', '--git-dir=' + mirror, 'rev-parse', '--verify',
+             '--quiet', revision + '^{commit}']).decode('utf8').strip()
+    except subprocess.CalledProcessError:
+        return None
 
-    log_path = os.path.join(repo_root, 'artman.log')
-    with io.open(log_path, 'w+') as file_:
-        file_.write(u'-------- Beginning of %s -----------\n' % task_id)
-    return task_id, repo_root, artman_user_config, log_path
+
+def _check_output(command):
+    output = subprocess.check_output(command)
+    if output:
+        output_logger.success(output.decode('utf8'))
 
 
-def _cleanup(tmp_dir, log_file_handler):
-    # Close the one-time logging FileHandler
-    if log_file_handler:
-        log_file_handler.close()
-        logger.removeHandler(log_file_handler)
+def _cleanup(tmp_dir, log_handler):
+    # Close the one-time logging handler, which ships the remaining logs.
+    if log_handler:
+        logger.removeHandler(log_handler)
+        log_handler.close()
 
     # Remove tmp directory.
-    subprocess.check_call(['rm', '-rf', tmp_dir])
+    if tmp_dir:
+        subprocess.check_call(['rm', '-rf', tmp_dir])
 
     # Change working directory to the root tmp directory, as the current one
     # has been removed.
@@ -0,0 +1,202 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Metrics of the conductor, exported in the Prometheus text format.
+
+Metrics are counters and histograms with labels, registered in a module
+level registry when created. `start_http_server` serves all of them on
+`/metrics` from a background thread, for Prometheus or a compatible agent
+to scrape.
+'''
+
+from __future__ import absolute_import
+import bisect
+import threading
+
+from six.moves import BaseHTTPServer
+
+# The upper bounds of the buckets of histograms by default, in seconds,
+# suited to the steps of a task, which take from seconds to an hour.
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200,
+                    1800, 3600)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class Counter(object):
+    """A counter, with a value per combination of label values.
+
+    Args:
+        name (str): The name of the metric, ending in `_total`.
+        documentation (str): What the metric counts.
+        labels (tuple): The names of the labels of the metric.
+    """
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_values(self, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_values(self, labels), 0)
+
+    def render(self):
+        lines = _header(self, 'counter')
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(_sample(self.name, self.labels, key, value))
+        return lines
+
+
+class Histogram(object):
+    """A histogram of observed values, per combination of label values.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): What the metric observes.
+        labels (tuple): The names of the labels of the metric.
+        buckets (tuple): The sorted upper bounds of the buckets. A bucket
+            without upper bound is always added.
+    """
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, **labels):
+        key = _label_values(self, labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """Return the number of observed values."""
+        with self._lock:
+            counts, _ = self._values.get(_label_values(self, labels),
+                                         ([], 0))
+            return sum(counts)
+
+    def render(self):
+        lines = _header(self, 'histogram')
+        label_names = self.labels + ('le',)
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(_sample(
+                        self.name + '_bucket', label_names,
+                        key + (_format_value(bound),), cumulative))
+                lines.append(_sample(self.name + '_sum', self.labels, key,
+                                     total))
+                lines.append(_sample(self.name + '_count', self.labels, key,
+                                     cumulative))
+        return lines
+
+
+def render():
+    """Return every registered metric in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def start_http_server(port, address=''):
+    """Serve the metrics on `/metrics` from a daemon thread.
+
+    Args:
+        port (int): The port to listen on, or 0 for any free port.
+        address (str): The address to listen on, all of them by default.
+
+    Returns:
+        HTTPServer: The server, whose `server_port` is the port it listens
+            on.
+    """
+    server = BaseHTTPServer.HTTPServer((address, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Scrapes are too frequent to be logged.
+        pass
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+
+
+def _label_values(metric, labels):
+    if set(labels) != set(metric.labels):
+        raise ValueError('%s takes the labels %s, not %s.'
+                         % (metric.name, ', '.join(metric.labels),
+                            ', '.join(sorted(labels))))
+    return tuple(str(labels[name]) for name in metric.labels)
+
+
+def _header(metric, metric_type):
+    return ['# HELP %s %s' % (metric.name, metric.documentation),
+            '# TYPE %s %s' % (metric.name, metric_type)]
+
+
+def _sample(name, label_names, label_values, value):
+    if not label_names:
+        return '%s %s' % (name, _format_value(value))
+    labels = ','.join(
+        '%s="%s"' % (label, value.replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for label, value in zip(label_names, label_values))
+    return '%s{%s} %s' % (name, labels, _format_value(value))
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value))
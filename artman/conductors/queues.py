@@ -0,0 +1,248 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Task queues the conductor pulls tasks from.
+
+Every queue hands out tasks as dicts in the format of Cloud Tasks pull
+tasks, with `name`, `createTime`, `scheduleTime` (the expiry of the lease),
+`taskStatus.attemptDispatchCount` and the base64 encoded artman arguments in
+`pullTaskTarget.payload`. A task stays leased by the conductor which pulled
+it until its lease expires, is cancelled, or it is acknowledged or deleted.
+'''
+
+from __future__ import absolute_import
+import base64
+import os
+import sqlite3
+import threading
+import time
+
+from oauth2client.client import GoogleCredentials
+from googleapiclient.discovery import build_from_document
+
+from artman.utils.logger import logger
+
+
+class LeaseError(Exception):
+    """Raised when a task is not leased by the caller anymore."""
+
+
+def open_queue(spec):
+    """Open the queue described by spec.
+
+    Args:
+        spec (str): `sqlite:///path/to/queue.db` for a local SQLite queue,
+            or the name of a Cloud Tasks queue, such as
+            `projects/<project>/locations/<location>/queues/<queue>`.
+    """
+    if spec.startswith('sqlite://'):
+        return SqliteQueue(spec[len('sqlite://'):])
+    return CloudTasksQueue(spec)
+
+
+class CloudTasksQueue(object):
+    """A Cloud Tasks pull queue."""
+
+    def __init__(self, queue_name, client=None):
+        self.queue_name = queue_name
+        self._client = client or _create_tasks_client()
+
+    def pull(self, max_tasks, lease_seconds):
+        body = {
+          "maxTasks": max_tasks,
+          "leaseDuration": "%ds" % lease_seconds,
+          "responseView": "FULL",
+          "name": "%s" % self.queue_name
+        }
+        tasks = self._tasks().pull(
+            name=self.queue_name, body=body).execute()
+        logger.info('Pulling tasks request returned %s' % tasks)
+        return tasks.get('tasks', [])
+
+    def ack(self, task):
+        body = {'scheduleTime': task['scheduleTime']}
+        response = self._tasks().acknowledge(
+            name=task['name'], body=body).execute()
+        logger.info('Acknowledge task request returned %s' % response)
+        return response
+
+    def renew_lease(self, task, lease_seconds):
+        """Extend the lease of a task, updating its schedule time."""
+        body = {'scheduleTime': task['scheduleTime'],
+                'newLeaseDuration': '%ds' % lease_seconds}
+        response = self._tasks().renewLease(
+            name=task['name'], body=body).execute()
+        logger.debug('Renew task lease request returned %s' % response)
+        task['scheduleTime'] = response['scheduleTime']
+        return response
+
+    def cancel_lease(self, task):
+        body = {'scheduleTime': task['scheduleTime'], 'responseView': 'FULL'}
+        response = self._tasks().cancelLease(
+            name=task['name'], body=body).execute()
+        logger.info('Cancel task request returned %s' % response)
+        return response
+
+    def delete(self, task):
+        response = self._tasks().delete(name=task['name']).execute()
+        logger.info('Delete task request returned %s' % response)
+        return response
+
+    def _tasks(self):
+        return self._client.projects().locations().queues().tasks()
+
+
+class SqliteQueue(object):
+    """A queue stored in a local SQLite database.
+
+    It implements the same leases and attempt counts as Cloud Tasks, so that
+    the conductor can be run and measured on a single machine, including
+    with several conductors sharing the same database file.
+    """
+
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            create_time REAL NOT NULL,
+            schedule_time REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute(self._SCHEMA)
+        self._db.execute('CREATE INDEX IF NOT EXISTS tasks_schedule_time '
+                         'ON tasks (schedule_time)')
+
+    def create_task(self, artman_args):
+        """Enqueue a task executing artman with the given arguments.
+
+        Args:
+            artman_args (str): The arguments, separated by spaces.
+
+        Returns:
+            dict: The task.
+        """
+        payload = base64.b64encode(artman_args.encode('utf8')).decode('ascii')
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO tasks (payload, create_time, schedule_time) '
+                'VALUES (?, ?, ?)', (payload, now, now))
+        return self._task(cursor.lastrowid, payload, now, now, 0)
+
+    def pull(self, max_tasks, lease_seconds):
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                'SELECT id, payload, create_time, attempts FROM tasks '
+                'WHERE schedule_time <= ? ORDER BY schedule_time, id '
+                'LIMIT ?', (now, max_tasks)).fetchall()
+            schedule_time = now + lease_seconds
+            db.executemany(
+                'UPDATE tasks SET schedule_time = ?, attempts = attempts + 1 '
+                'WHERE id = ?', [(schedule_time, row[0]) for row in rows])
+        # Like Cloud Tasks, the dispatch count does not include the current
+        # attempt.
+        return [self._task(task_id, payload, create_time, schedule_time,
+                           attempts)
+                for task_id, payload, create_time, attempts in rows]
+
+    def ack(self, task):
+        self.delete(task, check_lease=True)
+
+    def renew_lease(self, task, lease_seconds):
+        """Extend the lease of a task, updating its schedule time."""
+        schedule_time = time.time() + lease_seconds
+        self._update_lease(task, schedule_time)
+        task['scheduleTime'] = _format_time(schedule_time)
+
+    def cancel_lease(self, task):
+        self._update_lease(task, time.time())
+
+    def delete(self, task, check_lease=False):
+        with self._transaction() as db:
+            if check_lease:
+                self._check_lease(db, task)
+            db.execute('DELETE FROM tasks WHERE id = ?', (_task_id(task),))
+
+    def _update_lease(self, task, schedule_time):
+        with self._transaction() as db:
+            self._check_lease(db, task)
+            db.execute('UPDATE tasks SET schedule_time = ? WHERE id = ?',
+                       (schedule_time, _task_id(task)))
+
+    def _check_lease(self, db, task):
+        row = db.execute('SELECT schedule_time FROM tasks WHERE id = ?',
+                         (_task_id(task),)).fetchone()
+        if (not row or row[0] <= time.time()
+                or _format_time(row[0]) != task['scheduleTime']):
+            raise LeaseError('Task %s is not leased anymore.' % task['name'])
+
+    def _transaction(self):
+        return _SqliteTransaction(self._db, self._lock)
+
+    def _task(self, task_id, payload, create_time, schedule_time, attempts):
+        return {
+            'name': '%s/tasks/%d' % (os.path.abspath(self.path), task_id),
+            'createTime': _format_time(create_time),
+            'scheduleTime': _format_time(schedule_time),
+            'taskStatus': {'attemptDispatchCount': str(attempts)},
+            'pullTaskTarget': {'payload': payload},
+            'view': 'FULL',
+        }
+
+
+class _SqliteTransaction(object):
+    """An immediate transaction, which holds the database write lock from
+    its start so that concurrent conductors do not lease the same tasks."""
+
+    def __init__(self, db, lock):
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._lock.release()
+
+
+def _create_tasks_client():
+    credentials = GoogleCredentials.get_application_default()
+    discovery_doc = os.path.join(os.path.dirname(__file__), 'cloudtasks.json')
+    with open(discovery_doc, 'r') as f:
+        return build_from_document(f.read(), credentials=credentials)
+
+
+def _task_id(task):
+    return int(task['name'].rsplit('/', 1)[1])
+
+
+def _format_time(timestamp):
+    """Format a timestamp like Cloud Tasks, in RFC 3339 with microseconds."""
+    micros = int(timestamp * 1000000)
+    return '%s.%06dZ' % (time.strftime('%Y-%m-%dT%H:%M:%S',
+                                       time.gmtime(micros // 1000000)),
+                         micros % 1000000)
@@ -20,7 +20,9 @@ import os
 
 from artman.pipelines import code_generation as code_gen
 from taskflow.patterns import linear_flow
+from artman.tasks.publish import github_batch
 from artman.utils import config_util
+from artman.utils import task_utils
 from artman.cli.support import select_git_repo
 
 
@@ -40,13 +42,53 @@ class BatchTaskFactory(code_gen.TaskFactoryBase):
 
     def get_tasks(self, **kwargs):
         batch_flow = linear_flow.Flow('BatchFlow')
+        if kwargs.get('publish') == 'github' and kwargs.get('batch_publish'):
+            batch_flow.add(*self._get_batch_publish_tasks(**kwargs))
+            return [batch_flow]
         for single_flow in self.get_language_api_flows(**kwargs):
             batch_flow.add(single_flow)
         return [batch_flow]
 
-    def get_language_api_flows(self, batch_apis, exclude_apis, language,
-                               api_config_patterns, artman_language_yaml,
-                               toolkit, root_dir, **kwargs):
+    def _get_batch_publish_tasks(self, **kwargs):
+        """Return the tasks publishing all APIs as a single pull request.
+
+        Every API is committed to one branch of a single working tree, which
+        is pushed once at the end of the batch.
+        """
+        api_kwargs_list = list(self.get_language_api_kwargs(**kwargs))
+        if not api_kwargs_list:
+            return []
+        git_repo = api_kwargs_list[0]['git_repo']
+        for api_kwargs in api_kwargs_list:
+            api_git_repo = api_kwargs['git_repo']
+            if (api_git_repo['location'] != git_repo['location'] or
+                    api_git_repo.get('branch') != git_repo.get('branch')):
+                raise ValueError(
+                    'Batch publishing requires all APIs to target the same '
+                    'repository and branch, but %s targets %s.' % (
+                        api_kwargs['api_name'], api_git_repo['location']))
+            api_kwargs['publish'] = 'github_batch'
+
+        batch_kwargs = {
+            'git_repo': git_repo,
+            'github': kwargs['github'],
+            'language': kwargs['language'],
+        }
+        tasks = task_utils.instantiate_tasks(
+            github_batch.SETUP_TASKS, batch_kwargs)
+        tasks += [self.make_single_language_flow(**api_kwargs)
+                  for api_kwargs in api_kwargs_list]
+        tasks += task_utils.instantiate_tasks(
+            github_batch.FINISH_TASKS, batch_kwargs)
+        return tasks
+
+    def get_language_api_flows(self, **kwargs):
+        for api_kwargs in self.get_language_api_kwargs(**kwargs):
+            yield self.make_single_language_flow(**api_kwargs)
+
+    def get_language_api_kwargs(self, batch_apis, exclude_apis, language,
+                                api_config_patterns, artman_language_yaml,
+                                toolkit, root_dir, **kwargs):
 
         artman_config_yamls = _get_artman_config_filenames(
             api_config_patterns, batch_apis, exclude_apis)
@@ -67,7 +109,7 @@ class BatchTaskFactory(code_gen.TaskFactoryBase):
                 repos = api_kwargs.pop('git_repos')
                 api_kwargs['git_repo'] = select_git_repo(repos, None)
 
-            yield self.make_single_language_flow(**api_kwargs)
+            yield api_kwargs
 
     def make_single_language_flow(self, **kwargs):
         single_flow = linear_flow.Flow('SingleLanguageApiFlow')
@@ -15,11 +15,12 @@
 
 """Base class for code generation pipelines."""
 
+import os
 import time
 import uuid
 import importlib
 
-from artman.utils import pipeline_util, task_utils
+from artman.utils import file_util, pipeline_util, task_utils
 from artman.pipelines import pipeline_base
 from artman.tasks import io_tasks
 from taskflow.patterns import linear_flow
@@ -36,7 +37,10 @@ COMMON_DISCO_REQUIRED = ['discovery_doc', 'toolkit', 'root_dir', 'output_dir', '
 
 def _load_remote_parameters(kwargs):
     tmp_id = str(uuid.uuid4())
-    filename = tmp_id + '.tar.gz'
+    # The codec of the uploaded tarball; one of file_util.TARBALL_CODECS.
+    kwargs['upload_codec'] = (kwargs.get('upload_codec') or
+                              os.environ.get('ARTMAN_UPLOAD_CODEC', 'gzip'))
+    filename = tmp_id + file_util.TARBALL_EXTENSIONS[kwargs['upload_codec']]
     kwargs['tarfile'] = filename
     kwargs['bucket_name'] = 'pipeline'
     kwargs['src_path'] = filename
@@ -14,12 +14,15 @@
 """Tasks related to generation of GAPIC wrappers"""
 
 import os
-import glob
+import shutil
+import tempfile
 from ruamel import yaml
 
 from artman.tasks import packman_tasks
 from artman.tasks import task_base
+from artman.utils import file_util
 from artman.utils import task_utils
+from artman.utils.logger import logger
 from artman.tasks.requirements import gapic_requirements
 
 
@@ -109,29 +112,58 @@ class GapicConfigMoveTask(task_base.TaskBase):
         return []
 
 
-class GapicCodeGenTask(task_base.TaskBase):
+class _GapicCodeGenTaskBase(task_base.TaskBase):
+    """Base class for tasks which run the toolkit code generator.
+
+    The generator writes into a scratch directory next to gapic_code_dir,
+    which is then synced into gapic_code_dir. Files whose content did not
+    change are left untouched, so downstream incremental builds and file
+    watchers only see the files which actually changed.
+    """
+
+    def _make_scratch_dir(self, gapic_code_dir):
+        # Keep the scratch directory on the same file system as the
+        # destination, so that changed files can be renamed into place.
+        parent_dir = os.path.dirname(os.path.abspath(gapic_code_dir))
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+        return tempfile.mkdtemp(
+            prefix='.%s-' % os.path.basename(os.path.abspath(gapic_code_dir)),
+            dir=parent_dir)
+
+    def _sync_output(self, scratch_dir, gapic_code_dir):
+        result = file_util.sync_tree(scratch_dir, gapic_code_dir)
+        logger.info('Synced generated code into %s: %d written, %d unchanged, '
+                    '%d removed.' % (os.path.abspath(gapic_code_dir),
+                                     result.written, result.unchanged,
+                                     result.removed))
+
+
+class GapicCodeGenTask(_GapicCodeGenTaskBase):
     """Generates GAPIC wrappers"""
     default_provides = 'gapic_code_dir'
 
     def execute(self, language, toolkit_path, descriptor_set, service_yaml,
                 gapic_api_yaml, gapic_language_yaml, package_metadata_yaml,
                 gapic_code_dir, api_name, api_version, organization_name):
-        existing = glob.glob('%s/*' % gapic_code_dir)
-        if existing:
-            self.exec_command(['rm', '-r'] + existing)
-        gapic_yaml = gapic_api_yaml + gapic_language_yaml
-        gapic_args = ['--gapic_yaml=' + os.path.abspath(yaml)
-                      for yaml in gapic_yaml]
-        service_args = ['--service_yaml=' + os.path.abspath(yaml)
-                        for yaml in service_yaml]
-        args = [
-            '--descriptor_set=' + os.path.abspath(descriptor_set),
-            '--package_yaml2=' + os.path.abspath(package_metadata_yaml),
-            '--output=' + os.path.abspath(gapic_code_dir),
-        ] + service_args + gapic_args
-
-        self.exec_command(
-            task_utils.gradle_task(toolkit_path, 'runCodeGen', args))
+        scratch_dir = self._make_scratch_dir(gapic_code_dir)
+        try:
+            gapic_yaml = gapic_api_yaml + gapic_language_yaml
+            gapic_args = ['--gapic_yaml=' + os.path.abspath(yaml)
+                          for yaml in gapic_yaml]
+            service_args = ['--service_yaml=' + os.path.abspath(yaml)
+                            for yaml in service_yaml]
+            args = [
+                '--descriptor_set=' + os.path.abspath(descriptor_set),
+                '--package_yaml2=' + os.path.abspath(package_metadata_yaml),
+                '--output=' + scratch_dir,
+            ] + service_args + gapic_args
+
+            self.exec_command(
+                task_utils.gradle_task(toolkit_path, 'runCodeGen', args))
+            self._sync_output(scratch_dir, gapic_code_dir)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
         return gapic_code_dir
 
@@ -139,28 +171,30 @@ class GapicCodeGenTask(task_base.TaskBase):
         return [gapic_requirements.GapicRequirements]
 
 
-class DiscoGapicCodeGenTask(task_base.TaskBase):
+class DiscoGapicCodeGenTask(_GapicCodeGenTaskBase):
     """Generates GAPIC wrappers from a Discovery document"""
     default_provides = 'gapic_code_dir'
 
     def execute(self, language, toolkit_path, discovery_doc,
         gapic_api_yaml, discogapic_language_yaml, package_metadata_yaml,
         gapic_code_dir, api_name, api_version, organization_name):
-        existing = glob.glob('%s/*' % gapic_code_dir)
-        if existing:
-            self.exec_command(['rm', '-r'] + existing)
-        gapic_yaml = gapic_api_yaml + discogapic_language_yaml
-        gapic_args = ['--gapic_yaml=' + os.path.abspath(yaml)
-                      for yaml in gapic_yaml]
-        args = [
-            # TODO(andrealin): Get right absolute path for discovery_doc
-                   '--discovery_doc=' + os.path.abspath(discovery_doc),
-                   '--package_yaml2=' + os.path.abspath(package_metadata_yaml),
-                   '--output=' + os.path.abspath(gapic_code_dir),
-                   ] + gapic_args
-
-        self.exec_command(
-            task_utils.gradle_task(toolkit_path, 'runDiscoCodeGen', args))
+        scratch_dir = self._make_scratch_dir(gapic_code_dir)
+        try:
+            gapic_yaml = gapic_api_yaml + discogapic_language_yaml
+            gapic_args = ['--gapic_yaml=' + os.path.abspath(yaml)
+                          for yaml in gapic_yaml]
+            args = [
+                # TODO(andrealin): Get right absolute path for discovery_doc
+                '--discovery_doc=' + os.path.abspath(discovery_doc),
+                '--package_yaml2=' + os.path.abspath(package_metadata_yaml),
+                '--output=' + scratch_dir,
+            ] + gapic_args
+
+            self.exec_command(
+                task_utils.gradle_task(toolkit_path, 'runDiscoCodeGen', args))
+            self._sync_output(scratch_dir, gapic_code_dir)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
         return gapic_code_dir
 
@@ -18,13 +18,11 @@ import base64
 import io
 import os
 import shutil
-import zipfile
-
-from six.moves import urllib
-
-from gcloud import storage
 
 from artman.tasks import task_base
+from artman.utils import file_util
+from artman.utils import gcs_util
+from artman.utils import googleapis_util
 from artman.utils.logger import logger
 
 
@@ -36,7 +34,8 @@ _ZOOKEEPER_NODE_DATA_SIZE_LIMIT = 2 ** 20
 class BlobUploadTask(task_base.TaskBase):
     """A task which uploads file to Google Cloud Storage.
 
-    It requires authentication be properly configured."""
+    It requires authentication be properly configured. The file is streamed
+    in binary mode and its checksums are verified after the upload."""
 
     default_provides = ('bucket', 'path', 'public_url')
 
@@ -45,37 +44,25 @@ class BlobUploadTask(task_base.TaskBase):
                 src_path,
                 dest_path):
         logger.info('Start blob upload')
-        client = storage.Client()
-        bucket = client.get_bucket(bucket_name)
-        blob = bucket.blob(dest_path)
-        with io.open(src_path, 'r', encoding='UTF-8') as f:
-            blob.upload_from_file(f)
-        logger.info('Uploaded to %s' % blob.public_url)
+        public_url = gcs_util.upload_file(bucket_name, src_path, dest_path)
+        logger.info('Uploaded to %s' % public_url)
 
-        return bucket_name, dest_path, blob.public_url
+        return bucket_name, dest_path, public_url
 
 
 class BlobDownloadTask(task_base.TaskBase):
     """A task which downloads file to Google Cloud Storage.
 
-    It requires authentication be properly configured.
+    It requires authentication be properly configured. Downloads are cached
+    by blob generation, so downloading an unchanged blob again is free.
     """
-    def execute(self, bucket_name, path, output_dir):
-        client = storage.Client()
-        bucket = client.get_bucket(bucket_name)
-        blob = bucket.get_blob(path)
-        if not blob:
+    def execute(self, bucket_name, path, output_dir, extract_dir=None):
+        filename = os.path.join(output_dir, path)
+        if not gcs_util.download_file(bucket_name, path, filename,
+                                      extract_dir=extract_dir):
             logger.error('Cannot find the output from GCS.')
             return
-        filename = os.path.join(output_dir, path)
-        if not os.path.exists(os.path.dirname(filename)):
-            try:
-                os.makedirs(os.path.dirname(filename))
-            except:
-                raise
-        with io.open(filename, "w", encoding='UTF-8') as f:
-            blob.download_to_file(f)
-            logger.info('File downloaded to %s.' % f.name)
+        logger.info('File downloaded to %s.' % filename)
 
 
 def _validate_upload_size(size, limit):
@@ -92,10 +79,23 @@ class PrepareUploadDirTask(task_base.TaskBase):
     Normally be used as the final step for pipeline job to return generated
     content to its poster."""
 
-    def execute(self, repo_root, tarfile):
-        self.exec_command(['tar', '-C', repo_root, '-zcvf', tarfile, '.'])
-        _validate_upload_size(
-            os.path.getsize(tarfile), _ZOOKEEPER_NODE_DATA_SIZE_LIMIT)
+    def execute(self, repo_root, tarfile, upload_codec=None):
+        """Archive repo_root into tarfile.
+
+        Args:
+            repo_root (str): The directory to archive.
+            tarfile (str): The tarball to write.
+            upload_codec (str): The compression codec, one of
+                `file_util.TARBALL_CODECS`. Defaults to gzip.
+        """
+        codec = upload_codec or 'gzip'
+        result = file_util.write_tarball(
+            repo_root, tarfile, codec=codec,
+            size_limit=_ZOOKEEPER_NODE_DATA_SIZE_LIMIT)
+        logger.info('Archived %d files (%d bytes) into %s (%s, %d bytes).'
+                    % (result.files, result.raw_size, tarfile, codec,
+                       result.size))
+        _validate_upload_size(result.size, _ZOOKEEPER_NODE_DATA_SIZE_LIMIT)
 
 
 class CleanupTempDirsTask(task_base.TaskBase):
@@ -110,7 +110,24 @@ class PrepareGoogleapisDirTask(task_base.TaskBase):
 
     default_provides = ('remote_repo_dir')
 
-    def execute(self, root_dir, files_dict={}):
+    def execute(self, root_dir, files_dict={}, src_proto_path=None,
+                desc_proto_path=None, service_yaml=None, gapic_api_yaml=None):
+        """Make googleapis available next to root_dir in remote mode.
+
+        Only the parts of googleapis the API needs are made available: its
+        protos and configuration files, and what the protos import.
+
+        Args:
+            root_dir (str): The googleapis directory expected by the
+                pipeline.
+            files_dict (dict): Base64-encoded content of additional files,
+                keyed by their path relative to googleapis.
+            src_proto_path (list): The proto directories of the API.
+                Everything is made available if None.
+            desc_proto_path (list): Additional proto directories.
+            service_yaml (list): The service configuration files.
+            gapic_api_yaml (list): The GAPIC configuration files.
+        """
         repo_root = os.path.abspath(os.path.join(root_dir, os.pardir))
         if os.path.exists(os.path.realpath(os.path.expanduser(repo_root))):
             # Do nothing if the repo_root exists. The repo_root exists if
@@ -121,26 +138,25 @@ class PrepareGoogleapisDirTask(task_base.TaskBase):
             os.makedirs(repo_root)
         except OSError as e:
             raise e
-        testfile = urllib.request.FancyURLopener()
-        tmp_repo_file = os.path.join(repo_root, "file.zip")
-        testfile.retrieve(
-            "https://github.com/googleapis/googleapis/archive/master.zip",
-            tmp_repo_file)
-        zip_ref = zipfile.ZipFile(tmp_repo_file, 'r')
-        zip_ref.extractall(repo_root)
-        zip_ref.close()
-        os.remove(tmp_repo_file)
-        shutil.move(os.path.join(repo_root, "googleapis-master"),
-                    os.path.join(repo_root, "googleapis"))
-        remote_repo_dir = os.path.join(repo_root, "googleapis")
+        googleapis_paths = None
+        if src_proto_path:
+            googleapis_paths = googleapis_util.api_paths(
+                root_dir, src_proto_path + (desc_proto_path or []) +
+                (service_yaml or []) + (gapic_api_yaml or []))
+        remote_repo_dir = googleapis_util.materialize(
+            os.path.join(repo_root, "googleapis"), googleapis_paths)
         # Write/overwrite the additonal files into the remote_repo_dir so that
         # user can include additional files which are not in the public repo.
         for f, content in files_dict.items():
             filename = os.path.join(remote_repo_dir, f)
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
-            with io.open(filename, "w+", encoding='UTF-8') as text_file:
-                text_file.write(base64.b64decode(content))
+            # The file may be a link to the cached snapshot; replace it
+            # rather than writing through it.
+            if os.path.lexists(filename):
+                os.remove(filename)
+            with io.open(filename, "wb") as data_file:
+                data_file.write(base64.b64decode(content))
         return remote_repo_dir
 
 
@@ -20,8 +20,9 @@ This module provides all tasks from its submodules.
 from __future__ import absolute_import
 
 from artman.tasks.publish import github
+from artman.tasks.publish import github_batch
 from artman.tasks.publish import local
 from artman.tasks.publish import maven
 from artman.tasks.publish import noop
 
-__all__ = ('github', 'local', 'maven', 'noop')
+__all__ = ('github', 'github_batch', 'local', 'maven', 'noop')
@@ -14,18 +14,126 @@
 
 from __future__ import absolute_import, unicode_literals
 import functools
+import logging
 import os
+import subprocess
 import uuid
 
-import github3
-
 import six
 
 from artman.tasks import task_base
-from artman.utils.logger import logger
+from artman.utils import git_util
+from artman.utils import github_util
+from artman.utils.logger import logger, output_logger
+
+
+class GitHubPublishTaskBase(task_base.TaskBase):
+    """Base class for tasks which commit generated code to a GitHub repo."""
+
+    def _repo_url(self, git_repo, github):
+        """Return the url used to fetch from and push to the repository."""
+        repo = git_repo['location']
+        if repo.startswith('git@github.com:'):
+            repo = 'https://%s:%s@github.com/%s' % (
+                github['username'], github['token'], repo[15:])
+        return repo
+
+    def _make_repo_temp_dir(self):
+        """Return a new temporary location to check out the repository."""
+        tmp = os.environ.get('ARTMAN_TEMP_DIR', '%stmp' % os.path.sep)
+        return os.path.join(tmp, str(uuid.uuid4())[0:8])
+
+    def _checkout_base_branch(self, git_repo, repo_url, repo_temp_dir):
+        """Check out the base branch of the repository to repo_temp_dir.
+
+        The persistent local mirror of the repository is refreshed first,
+        so only the objects which changed since the last publish are
+        downloaded. The checkout's origin points to the actual repository.
+        """
+        # This naively assumes that the default branch is named "master",
+        # which is not a guarantee, but this is good enough for now.
+        baseline = git_repo.get('branch', 'master')
+        mirror = git_util.mirror_dir(git_repo['location'])
+        logger.info('Updating the local mirror of %s at %s.'
+                    % (git_repo['location'], mirror))
+        for command in git_util.update_mirror_commands(mirror, repo_url):
+            self.exec_command(command)
+        logger.info('Checking out the {0} branch to {1}.'.format(
+            baseline, repo_temp_dir))
+        self.exec_command(git_util.shared_clone_command(
+            mirror, repo_temp_dir, baseline))
+        self.exec_command(['git', '-C', repo_temp_dir, 'remote', 'set-url',
+                           'origin', repo_url])
+
+    def _code_mappings(self, git_repo, code_dirs):
+        """Return where each generated directory goes in the repository.
+
+        Args:
+            git_repo (dict): Information about the git repository.
+            code_dirs (dict): The absolute location of each generated
+                artifact, keyed by artifact name.
+
+        Returns:
+            list: (src, dest) tuples, where src is the absolute location of
+                the generated code and dest the path it replaces, relative
+                to the root of the repository.
+        """
+        mappings = []
+        for path in git_repo.get('paths', ['.']):
+            # Piece together where we are copying code from and to.
+            if isinstance(path, (six.text_type, six.binary_type)):
+                path = {'dest': path}
+            src = path.get('src', '.')
+            dest = path.get('dest', '.')
+            artifact = path.get('artifact', 'gapic')
+
+            # We need a full absolute path for the source, based on
+            # the code's original output location.
+            src = os.path.abspath(os.path.join(code_dirs[artifact], src))
+            mappings.append((src, dest))
+        return mappings
+
+    def _copy_code(self, git_repo, code_dirs):
+        """Copy the generated code into the current git working tree.
 
+        Args:
+            git_repo (dict): Information about the git repository.
+            code_dirs (dict): The absolute location of each generated
+                artifact, keyed by artifact name.
+        """
+        for src, dest in self._code_mappings(git_repo, code_dirs):
+            if not src.endswith('.'):
+                src = os.path.join(src, '.')
+
+            # Actually copy the code.
+            self.exec_command(['git', 'rm', '-r', '--force',
+                               '--ignore-unmatch', dest])
+            if not os.path.exists(dest):
+                os.makedirs(dest)
+            self.exec_command(['cp', '-rf', src, dest])
+            self.exec_command(['git', 'add', dest])
+
+    def _has_staged_changes(self):
+        """Return whether the index of the current git working tree differs
+        from the HEAD commit.
+
+        The trees are compared by hash, which git computes from the index
+        without scanning the content of the working tree again.
+        """
+        staged_tree = self.exec_command(['git', 'write-tree']).strip()
+        head_tree = self.exec_command(
+            ['git', 'rev-parse', 'HEAD^{tree}']).strip()
+        return staged_tree != head_tree
 
-class CreateGitHubBranch(task_base.TaskBase):
+    def _commit_message(self, api_name, api_version, language):
+        return '{language} GAPIC: {api_name} {api_version}'.format(
+            api_name=api_name.capitalize(),
+            api_version=api_version,
+            language=language.capitalize(),
+        )
+
+
+class CreateGitHubBranch(GitHubPublishTaskBase):
     """Create a new branch on GitHub with the appropriate GAPIC.
 
     This task requires WRITE access to the applicable repository.
@@ -33,7 +141,8 @@ class CreateGitHubBranch(task_base.TaskBase):
     default_provides = 'branch_name'
 
     def execute(self, git_repo, api_name, api_version, language, github,
-                output_dir, gapic_code_dir, grpc_code_dir=None):
+                output_dir, gapic_code_dir, grpc_code_dir=None,
+                publish_without_checkout=False):
         """Clone a repository from GitHub into a temporary location.
 
         Args:
@@ -46,13 +155,22 @@ class CreateGitHubBranch(task_base.TaskBase):
                 This directory is removed entirely.
             gapic_code_dir (str): The location of the GAPIC code.
             grpc_code_dir (str): The location of the GRPC code, if any.
+            publish_without_checkout (bool): Build the commit straight into
+                the local mirror of the repository with `git fast-import`,
+                instead of checking out the base branch and copying the
+                code into it.
 
         Returns:
-            str: The name of the branch.
+            str: The name of the branch, or None if the generated code is
+                identical to the base branch and nothing was pushed.
         """
+        if publish_without_checkout:
+            return self._publish_without_checkout(
+                git_repo, api_name, api_version, language, github,
+                output_dir, gapic_code_dir, grpc_code_dir)
+
         # Determine where the repository should go.
-        tmp = os.environ.get('ARTMAN_TEMP_DIR', '%stmp' % os.path.sep)
-        repo_temp_dir = os.path.join(tmp, str(uuid.uuid4())[0:8])
+        repo_temp_dir = self._make_repo_temp_dir()
 
         # Ensure we know where we are, so we can make this task not
         # ultimately mutate the working directory.
@@ -65,14 +183,9 @@ class CreateGitHubBranch(task_base.TaskBase):
             code_dirs['grpc'] = os.path.abspath(grpc_code_dir)
 
         # Check out the code from GitHub.
-        repo = git_repo['location']
         try:
-            if repo.startswith('git@github.com:'):
-                repo = 'https://%s:%s@github.com/%s' % (
-                    github['username'], github['token'], repo[15:])
-            logger.info('Checking out fresh clone of %s to %s.'
-                        % (repo, repo_temp_dir))
-            self.exec_command(['git', 'clone', repo, repo_temp_dir])
+            repo = self._repo_url(git_repo, github)
+            self._checkout_base_branch(git_repo, repo, repo_temp_dir)
 
             # Create a new branch for this API.
             branch_name = '{api_name}-{language}-{api_version}-{salt}'.format(
@@ -83,59 +196,33 @@ class CreateGitHubBranch(task_base.TaskBase):
             )
             os.chdir(repo_temp_dir)
 
-            # If there is a base branch, switch to it.
-            #
-            # This command naively assumes that the default branch is named
-            # "master", which is not a guarantee, but this is good enough
-            # for now.
-            if git_repo.get('branch', 'master') != 'master':
-                baseline = git_repo['branch']
-                logger.info('Checking out the {0} branch to use as a '
-                            'baseline.'.format(baseline))
-                self.exec_command(['git', 'checkout', '--track', '-b',
-                                   baseline, 'origin/%s' % baseline])
-
             # Create the new branch off of the base branch.
             logger.info('Creating the {0} branch.'.format(branch_name))
             self.exec_command(['git', 'checkout', '-b', branch_name])
 
             # Copy the previously-generated GAPIC into the temporary
             # repository.
-            for path in git_repo.get('paths', ['.']):
-                # Piece together where we are copying code from and to.
-                if isinstance(path, (six.text_type, six.binary_type)):
-                    path = {'dest': path}
-                src = path.get('src', '.')
-                dest = path.get('dest', '.')
-                artifact = path.get('artifact', 'gapic')
-
-                # We need a full absolute path for the source, based on
-                # the code's original output location.
-                src = os.path.abspath(os.path.join(code_dirs[artifact], src))
-
-                if not src.endswith('.'):
-                    src = os.path.join(src, '.')
-
-                # Actually copy the code.
-                self.exec_command(['git', 'rm', '-r', '--force',
-                                   '--ignore-unmatch', dest])
-                if not os.path.exists(dest):
-                    os.makedirs(dest)
-                self.exec_command(['cp', '-rf', src, dest])
-                self.exec_command(['git', 'add', dest])
-
-            # Commit the GAPIC.
-            self.exec_command(['git', 'commit', '--allow-empty', '-m',
-                '{language} GAPIC: {api_name} {api_version}'.format(
-                    api_name=api_name.capitalize(),
-                    api_version=api_version,
-                    language=language.capitalize(),
-                ),
-            ])
-
-            # Push the branch to GitHub.
-            self.exec_command(['git', 'push', 'origin', branch_name])
-            logger.info('Code pushed to GitHub as `%s` branch.' % branch_name)
+            self._copy_code(git_repo, code_dirs)
+
+            if self._has_staged_changes():
+                # Commit the GAPIC.
+                self.exec_command([
+                    'git', 'commit', '-m',
+                    self._commit_message(api_name, api_version, language),
+                ])
+
+                # Push the branch to GitHub.
+                self.exec_command(['git', 'push', 'origin', branch_name])
+                logger.info(
+                    'Code pushed to GitHub as `%s` branch.' % branch_name)
+            else:
+                # There is nothing to publish; do not push an empty branch.
+                logger.success(
+                    'Generated code is identical to the `%s` branch of %s; '
+                    'skipping push (no-op).' % (
+                        git_repo.get('branch', 'master'),
+                        git_repo['location']))
+                branch_name = None
 
             # Remove the original output directory.
             if not os.getenv('RUNNING_IN_ARTMAN_DOCKER'):
@@ -152,6 +239,88 @@ class CreateGitHubBranch(task_base.TaskBase):
             # Change the working directory back to where we started.
             os.chdir(original_directory)
 
+    def _publish_without_checkout(self, git_repo, api_name, api_version,
+                                  language, github, output_dir,
+                                  gapic_code_dir, grpc_code_dir=None):
+        """Commit the generated code and push it, without any working tree.
+
+        The commit is streamed into the local mirror of the repository by a
+        single `git fast-import` process, which hashes the generated files
+        only, then pushed from the mirror.
+        """
+        code_dirs = {'gapic': os.path.abspath(gapic_code_dir)}
+        if grpc_code_dir:
+            code_dirs['grpc'] = os.path.abspath(grpc_code_dir)
+
+        repo = self._repo_url(git_repo, github)
+        baseline = git_repo.get('branch', 'master')
+        mirror = git_util.mirror_dir(git_repo['location'])
+        logger.info('Updating the local mirror of %s at %s.'
+                    % (git_repo['location'], mirror))
+        for command in git_util.update_mirror_commands(mirror, repo):
+            self.exec_command(command)
+
+        branch_name = '{api_name}-{language}-{api_version}-{salt}'.format(
+            api_name=api_name.lower(),
+            api_version=api_version.lower(),
+            language=language.lower(),
+            salt=str(uuid.uuid4())[0:8],
+        )
+        # Keep the new commit out of refs/heads, which mirrors the remote.
+        ref = 'refs/artman/%s' % branch_name
+        git = ['git', '--git-dir=' + mirror]
+        committer = self.exec_command(
+            git + ['var', 'GIT_COMMITTER_IDENT']).strip()
+        logger.info('Committing the generated code as {0}.'.format(ref))
+        self._fast_import(mirror, git_util.fast_import_stream(
+            ref, 'refs/heads/%s' % baseline, committer,
+            self._commit_message(api_name, api_version, language),
+            self._code_mappings(git_repo, code_dirs)))
+        try:
+            new_tree = self.exec_command(
+                git + ['rev-parse', ref + '^{tree}']).strip()
+            base_tree = self.exec_command(
+                git + ['rev-parse', 'refs/heads/%s^{tree}' % baseline]).strip()
+            if new_tree != base_tree:
+                self.exec_command(git + [
+                    'push', repo, '%s:refs/heads/%s' % (ref, branch_name)])
+                logger.info(
+                    'Code pushed to GitHub as `%s` branch.' % branch_name)
+            else:
+                # There is nothing to publish; do not push an empty branch.
+                logger.success(
+                    'Generated code is identical to the `%s` branch of %s; '
+                    'skipping push (no-op).' % (
+                        baseline, git_repo['location']))
+                branch_name = None
+        finally:
+            self.exec_command(git + ['update-ref', '-d', ref])
+
+        # Remove the original output directory.
+        if not os.getenv('RUNNING_IN_ARTMAN_DOCKER'):
+            self.exec_command(['rm', '-rf', output_dir])
+        return branch_name
+
+    def _fast_import(self, git_dir, stream):
+        """Feed a fast-import stream to `git fast-import` in git_dir."""
+        args = ['git', '--git-dir=' + git_dir, 'fast-import', '--quiet']
+        self.log(' '.join(args), level=logging.DEBUG)
+        process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        try:
+            for chunk in stream:
+                process.stdin.write(chunk)
+        except (IOError, OSError):
+            # fast-import exited early; its output tells why.
+            pass
+        output, _ = process.communicate()
+        if process.returncode:
+            self.log(output.decode('utf8'), logger=output_logger,
+                     level=logging.ERROR)
+            raise subprocess.CalledProcessError(
+                process.returncode, args, output=output)
+
 
 class CreateGitHubPullRequest(task_base.TaskBase):
     """Create a pull request on GitHub to merge the branch.
@@ -169,14 +338,36 @@ class CreateGitHubPullRequest(task_base.TaskBase):
                 the pull request.
             language (str): The name of the language. Used in the title
                 of the pull request.
+
+        Returns:
+            str: The URL of the pull request, or None if there was no branch
+                to open a pull request for.
         """
+        if not branch_name:
+            logger.success('No changes were pushed; skipping pull request '
+                           'creation (no-op).')
+            return None
+
         # Determine the pull request title.
         pr_title = '{language} GAPIC: {api_name} {api_version}'.format(
             api_name=api_name.capitalize(),
             api_version=api_version,
             language=language.capitalize(),
         )
+        return self._create_pull_request(
+            git_repo, github, branch_name, pr_title,
+            'This pull request was generated by artman. '
+            'Please review it thoroughly before merging.')
+
+    def _create_pull_request(self, git_repo, github, branch_name, title,
+                             body):
+        """Create a pull request from branch_name to the base branch.
 
+        Returns:
+            str: The URL of the created pull request. The pull request
+                itself is not returned, as task results must be primitives
+                to be persisted.
+        """
         # Determine the repo owner and name from the location, which is how
         # this API expects to receive this data.
         repo_loc = git_repo['location'].rstrip('/')
@@ -184,17 +375,18 @@ class CreateGitHubPullRequest(task_base.TaskBase):
         if repo_name.endswith('.git'):
             repo_name = repo_name[:-4]
 
-        # Instantiate the repo object.
-        gh = github3.login(github['username'], github['token'])
-        repo = gh.repository(repo_owner, repo_name)
+        # Get the repo object, shared with the other publishing tasks of
+        # this process.
+        repo = github_util.repository(
+            github['username'], github['token'], repo_owner, repo_name)
 
         # Create the pull request.
-        pr = repo.create_pull(
+        pr = github_util.create_pull(
+            repo,
             base=git_repo.get('branch', 'master'),
-            body='This pull request was generated by artman. '
-                 'Please review it thoroughly before merging.',
+            body=body,
             head=branch_name,
-            title=pr_title,
+            title=title,
         )
 
         # If we did not successfully create a pull request, this is an
@@ -209,8 +401,7 @@ class CreateGitHubPullRequest(task_base.TaskBase):
             url=pr.html_url,
         ))
 
-        # Return back the pull request object.
-        return pr
+        return pr.html_url
 
 
 TASKS = (
@@ -0,0 +1,189 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tasks publishing the GAPICs of a whole batch as a single pull request.
+
+A batch publish checks out the target repository once, commits each API on
+its own commit of a single branch, pushes once and opens one pull request
+listing every API. The batch pipeline runs PrepareGitHubBatchBranch first,
+then CommitGitHubBatchApi as the publishing task of every API, and finally
+PushGitHubBatchBranch and CreateGitHubBatchPullRequest.
+"""
+
+from __future__ import absolute_import, unicode_literals
+import os
+import uuid
+
+from taskflow.types import failure
+
+from artman.tasks.publish import github
+from artman.utils.logger import logger
+
+
+class PrepareGitHubBatchBranch(github.GitHubPublishTaskBase):
+    """Check out the target repository and create the batch branch."""
+    default_provides = ('batch_repo_dir', 'branch_name')
+
+    def execute(self, git_repo, github, language):
+        """Check out the base branch and create the batch branch off of it.
+
+        Args:
+            git_repo (dict): Information about the git repository.
+            github (dict): github config including username and token.
+            language (str): The name of the language.
+
+        Returns:
+            tuple (str, str): The location of the working tree and the name
+                of the batch branch.
+        """
+        repo_temp_dir = self._make_repo_temp_dir()
+        repo = self._repo_url(git_repo, github)
+        self._checkout_base_branch(git_repo, repo, repo_temp_dir)
+
+        branch_name = '{language}-batch-{salt}'.format(
+            language=language.lower(),
+            salt=str(uuid.uuid4())[0:8],
+        )
+        logger.info('Creating the {0} branch.'.format(branch_name))
+        self.exec_command(
+            ['git', '-C', repo_temp_dir, 'checkout', '-b', branch_name])
+        return repo_temp_dir, branch_name
+
+    def revert(self, result, **kwargs):
+        # Remove the working tree if the batch failed before being pushed.
+        if not isinstance(result, failure.Failure):
+            self.exec_command(['rm', '-rf', result[0]])
+
+
+class CommitGitHubBatchApi(github.GitHubPublishTaskBase):
+    """Commit the GAPIC of one API to the batch branch."""
+
+    def execute(self, git_repo, api_name, api_version, language,
+                batch_repo_dir, gapic_code_dir, grpc_code_dir=None):
+        """Copy the generated code into the batch working tree and commit it.
+
+        Args:
+            git_repo (dict): Information about the git repository.
+            api_name (str): The name of the API.
+            api_version (str): The version of the API.
+            language (str): The name of the language.
+            batch_repo_dir (str): The location of the batch working tree.
+            gapic_code_dir (str): The location of the GAPIC code.
+            grpc_code_dir (str): The location of the GRPC code, if any.
+        """
+        original_directory = os.path.abspath(os.curdir)
+        code_dirs = {'gapic': os.path.abspath(gapic_code_dir)}
+        if grpc_code_dir:
+            code_dirs['grpc'] = os.path.abspath(grpc_code_dir)
+        try:
+            os.chdir(batch_repo_dir)
+            self._copy_code(git_repo, code_dirs)
+            if self._has_staged_changes():
+                self.exec_command([
+                    'git', 'commit', '-m',
+                    self._commit_message(api_name, api_version, language),
+                ])
+            else:
+                logger.success('Generated code of %s %s is unchanged; '
+                               'nothing to commit (no-op).'
+                               % (api_name, api_version))
+        finally:
+            os.chdir(original_directory)
+
+
+class PushGitHubBatchBranch(github.GitHubPublishTaskBase):
+    """Push the batch branch to GitHub in a single push."""
+    default_provides = 'batch_commits'
+
+    def execute(self, git_repo, batch_repo_dir, branch_name):
+        """Push the batch branch, then remove the working tree.
+
+        Returns:
+            list: The subject of every commit on the batch branch.
+        """
+        try:
+            output = self.exec_command([
+                'git', '-C', batch_repo_dir, 'log', '--reverse',
+                '--format=%s',
+                'origin/%s..%s' % (git_repo.get('branch', 'master'),
+                                   branch_name),
+            ])
+            batch_commits = (output or '').splitlines()
+            if not batch_commits:
+                logger.success('Generated code of the whole batch is '
+                               'unchanged; skipping push (no-op).')
+                return batch_commits
+            self.exec_command(
+                ['git', '-C', batch_repo_dir, 'push', 'origin', branch_name])
+            logger.info('%d commits pushed to GitHub as `%s` branch.'
+                        % (len(batch_commits), branch_name))
+            return batch_commits
+        finally:
+            self.exec_command(['rm', '-rf', batch_repo_dir])
+
+
+class CreateGitHubBatchPullRequest(github.CreateGitHubPullRequest):
+    """Create a single pull request for the whole batch.
+
+    This task requires WRITE access to the repository.
+    """
+    default_provides = 'pull_request'
+
+    def execute(self, git_repo, github, branch_name, language,
+                batch_commits):
+        """Create a pull request listing every API of the batch.
+
+        Args:
+            git_repo (dict): Information about the git repository.
+            github (dict): github config including username and token.
+            branch_name (str): The name of the batch branch.
+            language (str): The name of the language.
+            batch_commits (list): The subject of every commit on the batch
+                branch.
+
+        Returns:
+            str: The URL of the pull request, or None if nothing was
+                pushed.
+        """
+        if not batch_commits:
+            logger.success('No changes were pushed; skipping pull request '
+                           'creation (no-op).')
+            return None
+        pr_title = '{language} GAPIC: {count} APIs'.format(
+            language=language.capitalize(),
+            count=len(batch_commits),
+        )
+        body = '\n'.join(
+            ['This pull request was generated by artman. '
+             'Please review it thoroughly before merging.', '',
+             'It regenerates the following APIs, one commit each:', ''] +
+            ['* %s' % commit for commit in batch_commits])
+        return self._create_pull_request(
+            git_repo, github, branch_name, pr_title, body)
+
+
+# The publishing tasks of every single API of a batch publish. The other
+# tasks are added to the batch flow by the batch pipeline.
+TASKS = (
+    CommitGitHubBatchApi,
+)
+
+SETUP_TASKS = (
+    PrepareGitHubBatchBranch,
+)
+
+FINISH_TASKS = (
+    PushGitHubBatchBranch,
+    CreateGitHubBatchPullRequest,
+)
@@ -22,6 +22,8 @@ import github3
 import six
 
 from artman.tasks import task_base
+from artman.utils import file_util
+from artman.utils import git_util
 from artman.utils.logger import logger
 
 
@@ -32,7 +34,7 @@ class LocalStagingTask(task_base.TaskBase):
     """
     def execute(self, git_repo, output_dir,
         gapic_code_dir=None, grpc_code_dir=None, proto_code_dir=None,
-        local_repo_dir=None):
+        local_repo_dir=None, staging_strategy=None):
         """Copy the code to the correct local staging location.
 
         Args:
@@ -42,33 +44,21 @@ class LocalStagingTask(task_base.TaskBase):
                 is removed after proper local code staging unless removing
                 it would remove the final destination directories.
             grpc_code_dir (str): The location of the GRPC code, if any.
+            staging_strategy (str): How the code is staged into the local
+                repo; one of `file_util.STAGING_STRATEGIES`. Defaults to
+                `copy`.
         """
+        staging_strategy = staging_strategy or 'copy'
         # Determine the actual repository name.
         # We can use this to derive the probable OS system path.
         repo_name = git_repo['location'].rstrip('/').split('/')[-1]
         if repo_name.endswith('.git'):
             repo_name = repo_name[:-4]
 
-        # Artman will find the local repo dir via the following steps:
-        # 1. Check whether an explicit `--local_repo_dir` flag is passed. Is so,
-        #    use that value.
-        # 2. Clones the repo to output_dir, and use the cloned repo dir.
-        repo_name_underscore = repo_name.replace('-', '_')
-        if local_repo_dir:
-            api_repo = local_repo_dir
-        else:
-            api_repo = os.path.join(output_dir, repo_name)
-            if os.path.exists(api_repo):
-                logger.fatal(
-                    'Local repo folder `%s` exists. Please manually remove the '
-                    'folder, or point to another folder through artman user '
-                    'config or `artman --output-dir` flag.' % api_repo)
-            repo = git_repo['location']
-            # This only works for public repo for now.
-            if repo.startswith('git@github.com:'):
-                repo = 'https://github.com/%s' % repo[15:]
-            logger.info('Checking out fresh clone of %s.' % repo)
-            self.exec_command(['git', 'clone', repo, api_repo])
+        # Use the `--local_repo_dir` flag if it is passed, otherwise a clone
+        # in output_dir.
+        api_repo = local_repo_dir or self._refresh_clone(
+            git_repo, output_dir, repo_name)
 
         # Track our code directories, and use absolute paths, since we will
         # be moving around.
@@ -83,39 +73,22 @@ class LocalStagingTask(task_base.TaskBase):
         if not code_dirs:
             raise RuntimeError('No code path is defined.')
 
-        # Keep track of all destinations so we are not too eager on wiping
-        # out code from the original output area.
-        #
-        # This also allows useful output to the user in the success message.
-        dests = []
-
         # Sanity check: The git repository must explicitly define the paths
         # where the generated code goes. If that is missing, fail now.
         if not git_repo.get('paths'):
             raise RuntimeError('This git repository entry in the artman YAML '
                                'does not define module paths.')
 
-        # Determine where the code belongs and stage it there.
-        for path in git_repo['paths']:
-            # Piece together where we are copying code from and to.
-            if isinstance(path, (six.text_type, six.binary_type)):
-                path = {'dest': path}
-            artifact = path.get('artifact', 'gapic')
-
-            if artifact in code_dirs:
-                # Convert everything to an absolute path.
-                src = os.path.abspath(os.path.join(code_dirs[artifact], path.get('src', '.')))
-                dest = os.path.abspath(os.path.join(api_repo, path.get('dest', '.')))
-
-                # All src path does not necessarily exist. For example, gapic src directory will
-                # not be created for ProtoClientPipeline
-                if os.path.isdir(src):
-                    # Keep track of all code destinations, for output later.
-                    dests.append(dest)
-
-                    # Actually copy the code.
-                    self.exec_command(['rm', '-rf', dest])
-                    self.exec_command(['cp', '-rf', src, dest])
+        # Keep track of all destinations so we are not too eager on wiping
+        # out code from the original output area.
+        #
+        # This also allows useful output to the user in the success message.
+        mappings = _code_mappings(git_repo['paths'], code_dirs, api_repo)
+        dests = [dest for _, dest in mappings]
+        strategies = _staging_strategies(
+            [src for src, _ in mappings], staging_strategy)
+        for (src, dest), strategy in zip(mappings, strategies):
+            self._stage(src, dest, strategy)
 
         # Remove the original paths.
         if gapic_code_dir and os.path.isdir(gapic_code_dir):
@@ -132,6 +105,98 @@ class LocalStagingTask(task_base.TaskBase):
             location = d.replace(userhome, '~')
             logger.success('Code generated: {0}'.format(location))
 
+    def _refresh_clone(self, git_repo, output_dir, repo_name):
+        """Return the local repo dir, in output_dir, cloning it if needed.
+
+        The clone is found via the following steps:
+        1. Reuse the clone left in output_dir by a previous run, after
+           resetting it to the target branch.
+        2. Clones the repo to output_dir, and use the cloned repo dir.
+        """
+        api_repo = os.path.join(output_dir, repo_name)
+        repo = git_repo['location']
+        # This only works for public repo for now.
+        if repo.startswith('git@github.com:'):
+            repo = 'https://github.com/%s' % repo[15:]
+        branch = git_repo.get('branch', 'master')
+        if os.path.exists(os.path.join(api_repo, '.git')):
+            logger.info('Updating existing clone of %s in %s.'
+                        % (repo, api_repo))
+            for command in git_util.refresh_clone_commands(api_repo, branch):
+                self.exec_command(command)
+        elif os.path.exists(api_repo):
+            logger.fatal(
+                'Local repo folder `%s` exists and is not a git clone. '
+                'Please manually remove the folder, or point to another '
+                'folder through artman user config or `artman '
+                '--output-dir` flag.' % api_repo)
+        else:
+            logger.info('Checking out fresh clone of %s.' % repo)
+            self.exec_command(['git', 'clone', repo, api_repo])
+            if branch != 'master':
+                self.exec_command(
+                    ['git', '-C', api_repo, 'checkout', branch])
+        return api_repo
+
+    def _stage(self, src, dest, staging_strategy):
+        """Replace dest with the code of src."""
+        self.exec_command(['rm', '-rf', dest])
+        if staging_strategy == 'copy':
+            written = file_util.tree_size(src)
+            self.exec_command(['cp', '-rf', src, dest])
+        else:
+            written = file_util.stage_tree(src, dest, staging_strategy)
+        logger.info('Staged %s (%s, %d bytes written).'
+                    % (dest, staging_strategy, written))
+
+
+def _code_mappings(paths, code_dirs, api_repo):
+    """Return the (src, dest) absolute paths of the code to stage.
+
+    Args:
+        paths (list): The paths of the git repo entry of the artman YAML,
+            either a destination or a dict with `artifact`, `src` and
+            `dest` keys.
+        code_dirs (dict): The absolute code directories, by artifact.
+        api_repo (str): The local repo dir.
+    """
+    mappings = []
+    for path in paths:
+        # Piece together where we are copying code from and to.
+        if isinstance(path, (six.text_type, six.binary_type)):
+            path = {'dest': path}
+        artifact = path.get('artifact', 'gapic')
+        if artifact not in code_dirs:
+            continue
+        # Convert everything to an absolute path.
+        src = os.path.abspath(
+            os.path.join(code_dirs[artifact], path.get('src', '.')))
+        dest = os.path.abspath(os.path.join(api_repo, path.get('dest', '.')))
+        # All src path does not necessarily exist. For example, gapic src
+        # directory will not be created for ProtoClientPipeline
+        if os.path.isdir(src):
+            mappings.append((src, dest))
+    return mappings
+
+
+def _staging_strategies(srcs, staging_strategy):
+    """Return the staging strategy of each source.
+
+    Moving a source removes it, so with the `move` strategy every source
+    which is the same as, inside, or around a later source is copied
+    instead, and only the last mapping using the code moves it.
+    """
+    if staging_strategy != 'move':
+        return [staging_strategy] * len(srcs)
+    return ['copy' if any(_overlap(src, later) for later in srcs[i + 1:])
+            else 'move'
+            for i, src in enumerate(srcs)]
+
+
+def _overlap(path, other):
+    return (path == other or other.startswith(path + os.sep) or
+            path.startswith(other + os.sep))
+
 
 TASKS = (
     LocalStagingTask,
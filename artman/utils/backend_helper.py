@@ -12,15 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""One-line documentation for backend_helper module.
+"""Taskflow persistence and job board backends.
 
+Remote pipelines go through ZooKeeper, at `ARTMAN_ZOOKEEPER_HOSTS`. Local
+runs persist their progress to `ARTMAN_PERSISTENCE`, a directory
+(`~/.artman/runs` by default) or a taskflow persistence URL such as
+`sqlite:////path/to/runs.db`, which requires SQLAlchemy.
 """
 
+import os
+
 from taskflow.jobs import backends as job_backends
 from taskflow.persistence import backends as persistence_backends
 
 # Default host/port of ZooKeeper service.
-ZK_HOST = '104.197.10.180:2181'
+ZK_HOST = os.environ.get('ARTMAN_ZOOKEEPER_HOSTS', '104.197.10.180:2181')
 
 # Default persistence configuration.
 PERSISTENCE_CONF = {
@@ -34,6 +40,28 @@ def default_persistence_backend():
     return persistence_backends.fetch(PERSISTENCE_CONF)
 
 
+def local_persistence_dir():
+    """Return the directory local runs persist to, or None if they persist
+    to a database."""
+    spec = os.environ.get('ARTMAN_PERSISTENCE',
+                          os.path.join('~', '.artman', 'runs'))
+    if '://' in spec:
+        return None
+    return os.path.abspath(os.path.expanduser(spec))
+
+
+def local_persistence_backend():
+    """Return the persistence backend of local runs."""
+    path = local_persistence_dir()
+    if path is None:
+        return persistence_backends.fetch(
+            {'connection': os.environ['ARTMAN_PERSISTENCE']})
+    if not os.path.isdir(path):
+        # Runs persist their arguments, including credentials.
+        os.makedirs(path, 0o700)
+    return persistence_backends.fetch({'connection': 'dir', 'path': path})
+
+
 def get_jobboard(name, jobboard_name):
     config = {
         'hosts': ZK_HOST,
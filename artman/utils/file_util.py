@@ -0,0 +1,513 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils related to file system operations"""
+
+import collections
+import contextlib
+import errno
+import gzip
+import hashlib
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# The ioctl request cloning a whole file on Linux (copy-on-write filesystems
+# such as btrfs or XFS).
+_FICLONE = 0x40049409
+
+# The ways generated code can be staged into its destination.
+#   copy: copy every byte.
+#   hardlink: link every file to its source. Only suitable when the source is
+#       discarded or left untouched afterwards.
+#   reflink: clone every file as a copy-on-write copy.
+#   move: rename the source into place.
+# Every strategy but `copy` falls back to copying when source and destination
+# are not on the same filesystem, or when the filesystem does not support it.
+STAGING_STRATEGIES = ('copy', 'hardlink', 'reflink', 'move')
+
+# The codecs write_tarball can compress with. `zstd` requires the optional
+# `zstandard` package.
+TARBALL_CODECS = ('gzip', 'zstd')
+TARBALL_EXTENSIONS = {'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# gzip compresses blocks of this size in parallel, as independent members of
+# a multi-member gzip file.
+_GZIP_BLOCK_SIZE = 1024 * 1024
+
+ArchiveResult = collections.namedtuple(
+    'ArchiveResult', ['files', 'raw_size', 'size'])
+
+SyncResult = collections.namedtuple(
+    'SyncResult', ['written', 'unchanged', 'removed'])
+
+
+def sync_tree(src_dir, dest_dir):
+    """Make dest_dir mirror src_dir, only writing files which changed.
+
+    Files with identical content and mode are left untouched, so they keep
+    their inode and mtime. New or changed files are copied next to their
+    destination and atomically renamed into place. Files and directories
+    which no longer exist in src_dir are removed from dest_dir.
+
+    Args:
+        src_dir (str): The directory holding the new content.
+        dest_dir (str): The directory to update. Created if missing.
+
+    Returns:
+        SyncResult: The number of files written, left unchanged and removed.
+    """
+    written, unchanged, removed = _copy_changed(src_dir, dest_dir)
+    removed += _remove_stale(src_dir, dest_dir)
+    return SyncResult(written, unchanged, removed)
+
+
+def stage_tree(src, dest, strategy='copy'):
+    """Stage a file or a directory tree from src to dest.
+
+    Files already present in dest are replaced, other entries of dest are
+    left in place.
+
+    Args:
+        src (str): The file or directory to stage.
+        dest (str): The destination path of src.
+        strategy (str): One of STAGING_STRATEGIES.
+
+    Returns:
+        int: The number of bytes actually written to disk; files which were
+            linked, cloned or renamed into place do not count.
+    """
+    if strategy not in STAGING_STRATEGIES:
+        raise ValueError('Unknown staging strategy `%s`; expected one of %s.'
+                         % (strategy, ', '.join(STAGING_STRATEGIES)))
+    if strategy == 'move' and not os.path.lexists(dest):
+        parent = os.path.dirname(dest)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        if _try_rename(src, dest):
+            return 0
+
+    if not _is_real_dir(src):
+        written = _stage_file(src, dest, strategy)
+    else:
+        written = _stage_dir(src, dest, strategy)
+    if strategy == 'move' and os.path.lexists(src):
+        if _is_real_dir(src):
+            shutil.rmtree(src)
+        else:
+            os.remove(src)
+    return written
+
+
+def tree_size(path):
+    """Return the total size in bytes of the regular files under path."""
+    if not _is_real_dir(path):
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+def write_tarball(src_dir, dest, codec='gzip', size_limit=None):
+    """Archive the content of src_dir into a compressed tarball.
+
+    Members are added in sorted order, so the same tree always yields the
+    same archive. Writing stops as soon as the compressed output exceeds
+    size_limit, instead of after the whole tree was compressed.
+
+    Args:
+        src_dir (str): The directory to archive. Members are relative to it,
+            as with `tar -C src_dir .`.
+        dest (str): The tarball to write.
+        codec (str): One of TARBALL_CODECS.
+        size_limit (int): The maximum size in bytes of the tarball, if any.
+
+    Returns:
+        ArchiveResult: The number of files archived, their total size and
+            the size of the tarball.
+
+    Raises:
+        ValueError: if the tarball exceeds size_limit. The partial tarball
+            is removed.
+    """
+    if codec not in TARBALL_CODECS:
+        raise ValueError('Unknown codec `%s`; expected one of %s.'
+                         % (codec, ', '.join(TARBALL_CODECS)))
+    files = raw_size = 0
+    try:
+        with open(dest, 'wb') as f:
+            out = _LimitedWriter(f, size_limit)
+            with _compressor(out, codec) as compressed:
+                with tarfile.open(fileobj=compressed, mode='w|',
+                                  format=tarfile.PAX_FORMAT) as tar:
+                    tar.add(src_dir, arcname='.', recursive=False)
+                    for path in _sorted_walk(src_dir):
+                        tar.add(path, recursive=False, arcname='./' +
+                                os.path.relpath(path, src_dir).replace(
+                                    os.path.sep, '/'))
+                        if os.path.isfile(path) and not os.path.islink(path):
+                            files += 1
+                            raw_size += os.path.getsize(path)
+    except Exception:
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+    return ArchiveResult(files, raw_size, os.path.getsize(dest))
+
+
+@contextlib.contextmanager
+def open_tarball_stream(path):
+    """Open a tarball written by write_tarball (or any tar.gz) for reading.
+
+    Members must be read in order, as the tarball is decompressed as a
+    stream.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_ZSTD_MAGIC)) == _ZSTD_MAGIC:
+            f.seek(0)
+            reader = _import_zstandard().ZstdDecompressor().stream_reader(f)
+            tar = tarfile.open(fileobj=reader, mode='r|')
+        else:
+            f.seek(0)
+            tar = tarfile.open(fileobj=f, mode='r|*')
+        try:
+            yield tar
+        finally:
+            tar.close()
+
+
+def file_digest(path):
+    """Return the hex SHA-256 digest of the file content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on path, so that a single process at a time
+    updates a shared cache. The lock is advisory, and a no-op where fcntl is
+    not available."""
+    with open(path, 'a') as f:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _copy_changed(src_dir, dest_dir):
+    """Copy the files of src_dir which differ from those of dest_dir.
+
+    Returns:
+        tuple: The number of files written, left unchanged, and of files in
+            the way of a directory which were removed.
+    """
+    written = unchanged = removed = 0
+    for root, dirs, files in os.walk(src_dir):
+        dest_root = os.path.normpath(
+            os.path.join(dest_dir, os.path.relpath(root, src_dir)))
+        if os.path.lexists(dest_root) and not _is_real_dir(dest_root):
+            os.remove(dest_root)
+            removed += 1
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        # Symlinks to directories are listed in `dirs` but not walked into.
+        for name in files + [d for d in dirs
+                             if os.path.islink(os.path.join(root, d))]:
+            src = os.path.join(root, name)
+            dest = os.path.join(dest_root, name)
+            if _same_content(src, dest):
+                unchanged += 1
+            else:
+                _atomic_copy(src, dest)
+                written += 1
+    return written, unchanged, removed
+
+
+def _remove_stale(src_dir, dest_dir):
+    """Remove the entries of dest_dir which do not exist in src_dir.
+
+    Returns:
+        int: The number of files and directories removed.
+    """
+    removed = 0
+    for root, dirs, files in os.walk(dest_dir):
+        src_root = os.path.join(src_dir, os.path.relpath(root, dest_dir))
+        for name in list(dirs):
+            if _remove_stale_dir(os.path.join(src_root, name),
+                                 os.path.join(root, name)):
+                dirs.remove(name)
+                removed += 1
+        for name in files:
+            if not os.path.lexists(os.path.join(src_root, name)):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+def _remove_stale_dir(src, path):
+    """Remove the directory (or symlink to one) at path if src is not a
+    directory anymore, and return whether it was removed."""
+    if _is_real_dir(src):
+        return False
+    if not os.path.islink(path):
+        shutil.rmtree(path)
+    elif not os.path.lexists(src):
+        os.remove(path)
+    else:
+        # A symlink in both trees, synced as a file.
+        return False
+    return True
+
+
+def _is_real_dir(path):
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def _same_content(src, dest):
+    if os.path.islink(src) or os.path.islink(dest):
+        return (os.path.islink(src) and os.path.islink(dest) and
+                os.readlink(src) == os.readlink(dest))
+    if not os.path.isfile(dest):
+        return False
+    src_stat, dest_stat = os.stat(src), os.stat(dest)
+    if (src_stat.st_size != dest_stat.st_size or
+            stat.S_IMODE(src_stat.st_mode) != stat.S_IMODE(dest_stat.st_mode)):
+        return False
+    return file_digest(src) == file_digest(dest)
+
+
+def _atomic_copy(src, dest):
+    """Copy src to a temporary file next to dest, then rename it over dest."""
+    if _is_real_dir(dest):
+        shutil.rmtree(dest)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(dest),
+        dir=os.path.dirname(dest))
+    os.close(fd)
+    try:
+        if os.path.islink(src):
+            os.remove(tmp_path)
+            os.symlink(os.readlink(src), tmp_path)
+        else:
+            shutil.copy2(src, tmp_path)
+        os.rename(tmp_path, dest)
+    except Exception:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _stage_dir(src, dest, strategy):
+    """Stage the files of a directory tree, and return the bytes written."""
+    written = 0
+    for root, dirs, files in os.walk(src):
+        dest_root = os.path.normpath(
+            os.path.join(dest, os.path.relpath(root, src)))
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        # Symlinks to directories are listed in `dirs` but not walked into.
+        for name in files + [d for d in dirs
+                             if os.path.islink(os.path.join(root, d))]:
+            written += _stage_file(os.path.join(root, name),
+                                   os.path.join(dest_root, name),
+                                   strategy)
+    return written
+
+
+def _stage_file(src, dest, strategy):
+    """Stage a single file or symlink, and return the bytes written."""
+    if _is_real_dir(dest):
+        shutil.rmtree(dest)
+    elif os.path.lexists(dest):
+        os.remove(dest)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dest)
+        return 0
+    if strategy == 'move' and _try_rename(src, dest):
+        return 0
+    if strategy == 'hardlink' and _try_link(src, dest):
+        return 0
+    if strategy == 'reflink' and _try_reflink(src, dest):
+        return 0
+    shutil.copy2(src, dest)
+    return os.path.getsize(dest)
+
+
+def _try_rename(src, dest):
+    try:
+        os.rename(src, dest)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOTEMPTY, errno.EEXIST):
+            raise
+        return False
+
+
+def _try_link(src, dest):
+    try:
+        os.link(src, dest)
+        return True
+    except (AttributeError, OSError):
+        # Cross-device link, or not supported by the platform/filesystem.
+        return False
+
+
+def _try_reflink(src, dest):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), _FICLONE, src_file.fileno())
+    except (IOError, OSError):
+        if os.path.lexists(dest):
+            os.remove(dest)
+        return False
+    shutil.copystat(src, dest)
+    return True
+
+
+def _sorted_walk(root):
+    """Yield every path under root, in a deterministic order."""
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        yield path
+        if _is_real_dir(path):
+            for sub_path in _sorted_walk(path):
+                yield sub_path
+
+
+class _LimitedWriter(object):
+    """A write-only file object failing once size_limit bytes were written."""
+
+    def __init__(self, f, size_limit):
+        self._file = f
+        self._size_limit = size_limit
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self._size_limit is not None and self.size > self._size_limit:
+            raise ValueError(
+                'Compressed size exceeds the limit of {} bytes; reduce the '
+                'size of the archived directory'.format(self._size_limit))
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        # The underlying file is closed by its owner.
+        pass
+
+
+class _ParallelGzipWriter(object):
+    """Compress blocks on a thread pool, as members of a gzip file.
+
+    zlib releases the GIL while compressing, so blocks are compressed on
+    several cores. Any gzip reader decompresses multi-member files.
+    """
+
+    def __init__(self, f, threads=None):
+        self._file = f
+        self._buffer = []
+        self._buffered = 0
+        self._pool = ThreadPool(threads or _cpu_count())
+        self._pending = []
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= _GZIP_BLOCK_SIZE:
+            self._submit()
+
+    def close(self):
+        try:
+            self._submit()
+            self._drain(0)
+        finally:
+            self._pool.close()
+            self._pool.join()
+
+    def _submit(self):
+        if self._buffered:
+            self._pending.append(self._pool.apply_async(
+                _gzip_member, (b''.join(self._buffer),)))
+            self._buffer = []
+            self._buffered = 0
+        # Bound the memory used by blocks waiting to be written.
+        self._drain(2 * _cpu_count())
+
+    def _drain(self, keep):
+        while len(self._pending) > keep:
+            self._file.write(self._pending.pop(0).get())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+
+
+def _gzip_member(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compressor(f, codec):
+    if codec == 'zstd':
+        zstandard = _import_zstandard()
+        return zstandard.ZstdCompressor(threads=-1).stream_writer(f)
+    if _cpu_count() > 1:
+        return _ParallelGzipWriter(f)
+    return gzip.GzipFile(fileobj=f, mode='wb', mtime=0)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('The zstd codec requires the `zstandard` package.')
+    return zstandard
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
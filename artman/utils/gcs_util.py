@@ -0,0 +1,397 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils related to Google Cloud Storage.
+
+Downloaded blobs are cached by generation under `ARTMAN_GCS_CACHE_DIR`
+(`~/.artman/gcs-cache` by default), so fetching a blob which did not change
+does not download it again.
+
+Setting the `ARTMAN_GCS_LOCAL_DIR` environment variable replaces Google Cloud
+Storage with a local directory, where the blob `path` of bucket `bucket` is
+stored as `$ARTMAN_GCS_LOCAL_DIR/bucket/path`. This is meant for tests and
+local development.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from six.moves import urllib
+
+from gcloud import storage
+import httplib2
+
+from artman.utils import file_util
+from artman.utils.logger import logger
+
+# Uploads are streamed in chunks of this size, through resumable uploads
+# which survive transient errors. Must be a multiple of 256 KiB.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files at least this large are uploaded as several parts in parallel, which
+# are then composed into the destination blob.
+COMPOSITE_UPLOAD_THRESHOLD = 150 * 1024 * 1024
+_MIN_COMPOSITE_PART_SIZE = 32 * 1024 * 1024
+_MAX_COMPOSITE_PARTS = 32
+_PARALLEL_UPLOADS = 8
+
+# Downloads are split into ranges of this size, fetched in parallel.
+DOWNLOAD_RANGE_SIZE = 8 * 1024 * 1024
+_PARALLEL_DOWNLOADS = 8
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_client = []
+
+
+def storage_client():
+    """Return the storage client of the process, creating it on first use."""
+    with _lock:
+        if not _client:
+            _client.append(storage.Client())
+        return _client[0]
+
+
+def local_storage_dir():
+    """Return the directory standing in for Google Cloud Storage, if any."""
+    return os.environ.get('ARTMAN_GCS_LOCAL_DIR')
+
+
+def upload_file(bucket_name, src_path, dest_path):
+    """Upload a local file to a blob and verify its checksums.
+
+    The file is streamed in binary mode through a resumable upload. Files of
+    at least COMPOSITE_UPLOAD_THRESHOLD bytes are uploaded as parts in
+    parallel, then composed.
+
+    Args:
+        bucket_name (str): The name of the destination bucket.
+        src_path (str): The file to upload.
+        dest_path (str): The name of the destination blob.
+
+    Returns:
+        str: The public url of the uploaded blob.
+
+    Raises:
+        IOError: if the uploaded content does not match the local file.
+    """
+    if local_storage_dir():
+        return _upload_to_local_dir(bucket_name, src_path, dest_path)
+
+    bucket = storage_client().bucket(bucket_name)
+    size = os.path.getsize(src_path)
+    if size < COMPOSITE_UPLOAD_THRESHOLD:
+        blob = _upload_part(bucket, dest_path, src_path, 0, size)
+        return blob.public_url
+
+    blob = _composite_upload(bucket, src_path, dest_path, size)
+    crc32c = _crc32c_function()
+    if crc32c is None:
+        logger.debug('No crc32c implementation is installed; the composed '
+                     'blob %s is only verified part by part.' % dest_path)
+    elif blob.crc32c != file_crc32c(src_path, crc32c):
+        blob.delete()
+        raise IOError('CRC32C mismatch after uploading %s to gs://%s/%s.'
+                      % (src_path, bucket_name, dest_path))
+    return blob.public_url
+
+
+def gcs_cache_dir():
+    """Return the directory where downloaded blobs are cached."""
+    return os.path.expanduser(os.environ.get(
+        'ARTMAN_GCS_CACHE_DIR', os.path.join('~', '.artman', 'gcs-cache')))
+
+
+def download_file(bucket_name, path, dest_path=None, extract_dir=None):
+    """Download a blob, reusing the cached copy of its current generation.
+
+    The blob is fetched as parallel ranged reads straight into the cache,
+    and its checksum is verified before it is used. The cache is read-only;
+    dest_path gets a writable copy, cloned when the filesystem supports it.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        path (str): The name of the blob.
+        dest_path (str): Where to write the blob, if anywhere.
+        extract_dir (str): Where to extract the blob, if it is a tarball.
+
+    Returns:
+        str: The location of the cached blob, or None if it does not exist.
+    """
+    cached = _cached_blob(bucket_name, path)
+    if cached and dest_path:
+        _copy_from_cache(cached, dest_path)
+    if cached and extract_dir:
+        extract_tarball(cached, extract_dir)
+    return cached
+
+
+def _cached_blob(bucket_name, path):
+    """Return the cached copy of a blob, downloading it if needed, or None
+    if the blob does not exist."""
+    if local_storage_dir():
+        cached = os.path.join(local_storage_dir(), bucket_name, path)
+        return cached if os.path.isfile(cached) else None
+
+    blob = storage_client().bucket(bucket_name).get_blob(path)
+    if not blob:
+        return None
+    cached = os.path.join(gcs_cache_dir(), bucket_name, '%s.%s' % (
+        path, blob.generation))
+    if os.path.isfile(cached):
+        logger.info('Using cached gs://%s/%s (generation %s).'
+                    % (bucket_name, path, blob.generation))
+    else:
+        _download_to_cache(blob, cached)
+    return cached
+
+
+def _copy_from_cache(cached, dest_path):
+    """Copy a cached blob to dest_path, where the user owns a writable
+    file."""
+    if not os.path.isdir(os.path.dirname(os.path.abspath(dest_path))):
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)))
+    # The copy is not a hard link: making it writable would also make the
+    # cache writable.
+    file_util.stage_tree(cached, dest_path, 'reflink')
+    os.chmod(dest_path, os.stat(dest_path).st_mode | stat.S_IWUSR)
+
+
+def extract_tarball(tarball, extract_dir):
+    """Extract a gzip or zstd tarball, streaming its members.
+
+    Raises:
+        ValueError: if a member would be written outside extract_dir.
+    """
+    with file_util.open_tarball_stream(tarball) as tar:
+        for member in tar:
+            target = os.path.realpath(os.path.join(extract_dir, member.name))
+            root = os.path.realpath(extract_dir)
+            if target != root and not target.startswith(root + os.path.sep):
+                raise ValueError('Refusing to extract %s outside of %s.'
+                                 % (member.name, extract_dir))
+            tar.extract(member, extract_dir)
+
+
+def file_md5(path, offset=0, length=None):
+    """Return the base64 MD5 of a file range, as reported by GCS."""
+    digest = hashlib.md5()
+    for chunk in _read_range(path, offset, length):
+        digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+
+def file_crc32c(path, crc32c=None):
+    """Return the base64 CRC32C of a file, as reported by GCS."""
+    crc32c = crc32c or _crc32c_function()
+    crc = 0
+    for chunk in _read_range(path, 0, None):
+        crc = crc32c(chunk, crc)
+    return base64.b64encode(struct.pack('>I', crc)).decode('ascii')
+
+
+class _FileSlice(object):
+    """A read-only file object exposing a range of a file."""
+
+    def __init__(self, f, offset, length):
+        self._file = f
+        self._offset = offset
+        self._length = length
+        self._file.seek(offset)
+
+    def read(self, size=-1):
+        remaining = self._length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._file.seek(self._offset + min(max(offset, 0), self._length))
+
+    def tell(self):
+        return self._file.tell() - self._offset
+
+    def seekable(self):
+        return True
+
+
+def _upload_part(bucket, name, src_path, offset, length):
+    """Upload a range of src_path to a blob, and verify its MD5."""
+    blob = bucket.blob(name, chunk_size=UPLOAD_CHUNK_SIZE)
+    with io.open(src_path, 'rb') as f:
+        blob.upload_from_file(_FileSlice(f, offset, length), size=length)
+    if blob.md5_hash != file_md5(src_path, offset, length):
+        blob.delete()
+        raise IOError('MD5 mismatch after uploading %s to gs://%s/%s.'
+                      % (src_path, bucket.name, name))
+    return blob
+
+
+def _composite_upload(bucket, src_path, dest_path, size):
+    part_count = min(_MAX_COMPOSITE_PARTS,
+                     max(1, size // _MIN_COMPOSITE_PART_SIZE))
+    part_size = -(-size // part_count)
+    ranges = [(offset, min(part_size, size - offset))
+              for offset in range(0, size, part_size)]
+    part_names = ['%s.part-%02d' % (dest_path, i) for i in range(len(ranges))]
+    logger.info('Uploading %s as %d parts in parallel.'
+                % (src_path, len(ranges)))
+
+    pool = ThreadPool(min(_PARALLEL_UPLOADS, len(ranges)))
+    try:
+        pool.map(
+            lambda args: _upload_part(bucket, args[0], src_path, *args[1]),
+            list(zip(part_names, ranges)))
+        # gcloud has no public compose method, so the request is sent
+        # through the connection, and the composed blob is fetched back
+        # for its properties.
+        storage_client().connection.api_request(
+            method='POST', path=bucket.blob(dest_path).path + '/compose',
+            data={
+                'sourceObjects': [{'name': name} for name in part_names],
+                'destination': {'contentType': 'application/octet-stream'},
+            })
+        return bucket.get_blob(dest_path)
+    finally:
+        pool.close()
+        pool.join()
+        # Remove the parts, including those of a failed upload.
+        bucket.delete_blobs(part_names, on_error=lambda blob: None)
+
+
+def _download_to_cache(blob, cached):
+    """Download a blob as parallel ranged reads, then verify it."""
+    cache_dir = os.path.dirname(cached)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    size = blob.size or 0
+    ranges = [(offset, min(DOWNLOAD_RANGE_SIZE, size - offset))
+              for offset in range(0, size, DOWNLOAD_RANGE_SIZE)]
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(cached), dir=cache_dir)
+    os.close(fd)
+    logger.info('Downloading gs://%s/%s (%d bytes) in %d ranges.'
+                % (blob.bucket.name, blob.name, size, len(ranges)))
+
+    local = threading.local()
+
+    def fetch(byte_range):
+        # httplib2 connections are not thread safe; use one per thread.
+        if not hasattr(local, 'http'):
+            local.http = _authorized_http()
+        offset, length = byte_range
+        response, content = local.http.request(
+            blob.media_link, 'GET', headers={
+                'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        if response.status not in (200, 206) or len(content) != length:
+            raise IOError('Failed to download bytes %d-%d of gs://%s/%s: '
+                          'HTTP %s.' % (offset, offset + length - 1,
+                                        blob.bucket.name, blob.name,
+                                        response.status))
+        with io.open(tmp_path, 'r+b') as f:
+            f.seek(offset)
+            f.write(content)
+
+    pool = ThreadPool(max(1, min(_PARALLEL_DOWNLOADS, len(ranges))))
+    try:
+        pool.map(fetch, ranges)
+        _verify_download(blob, tmp_path)
+        # Only keep the latest generation of each blob.
+        prefix = os.path.basename(cached).rsplit('.', 1)[0] + '.'
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                os.remove(os.path.join(cache_dir, name))
+        # Cached files are reused by later downloads; make them read-only
+        # so they are not modified in place.
+        os.chmod(tmp_path, 0o444)
+        os.rename(tmp_path, cached)
+    finally:
+        pool.close()
+        pool.join()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _verify_download(blob, path):
+    if blob.md5_hash:
+        if blob.md5_hash != file_md5(path):
+            raise IOError('MD5 mismatch after downloading gs://%s/%s.'
+                          % (blob.bucket.name, blob.name))
+    elif blob.crc32c and _crc32c_function():
+        # Composed blobs only have a CRC32C.
+        if blob.crc32c != file_crc32c(path):
+            raise IOError('CRC32C mismatch after downloading gs://%s/%s.'
+                          % (blob.bucket.name, blob.name))
+    else:
+        logger.debug('gs://%s/%s cannot be verified.'
+                     % (blob.bucket.name, blob.name))
+
+
+def _authorized_http():
+    credentials = storage_client().connection.credentials
+    http = httplib2.Http()
+    return credentials.authorize(http) if credentials else http
+
+
+def _upload_to_local_dir(bucket_name, src_path, dest_path):
+    dest = os.path.join(local_storage_dir(), bucket_name, dest_path)
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    shutil.copyfile(src_path, dest)
+    if file_md5(dest) != file_md5(src_path):
+        raise IOError('MD5 mismatch after copying %s to %s.'
+                      % (src_path, dest))
+    return 'file:' + urllib.request.pathname2url(os.path.abspath(dest))
+
+
+def _read_range(path, offset, length):
+    with io.open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = _HASH_CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = f.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _crc32c_function():
+    """Return a `crc32c(data, crc)` function if a library provides one."""
+    try:
+        import google_crc32c
+        return lambda data, crc: google_crc32c.extend(crc, data)
+    except ImportError:
+        pass
+    try:
+        import crcmod.predefined
+        crc_fun = crcmod.predefined.mkCrcFun('crc-32c')
+        return lambda data, crc: crc_fun(data, crc)
+    except ImportError:
+        return None
@@ -0,0 +1,179 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils related to git repositories.
+
+Most functions return the git command to run rather than running it, so that
+tasks can execute them through `TaskBase.exec_command`.
+"""
+
+import os
+import re
+import stat
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def git_cache_dir():
+    """Return the directory where persistent bare mirrors are kept.
+
+    It can be overridden through the `ARTMAN_GIT_CACHE_DIR` environment
+    variable.
+    """
+    return os.path.expanduser(os.environ.get(
+        'ARTMAN_GIT_CACHE_DIR', os.path.join('~', '.artman', 'git-cache')))
+
+
+def mirror_dir(location):
+    """Return the path of the bare mirror for a repository location.
+
+    Args:
+        location (str): The repository location, either in the
+            `git@github.com:owner/repo.git` or in the URL form. Credentials
+            embedded in the location are not part of the mirror path.
+    """
+    name = re.sub(r'^[a-z+]+://', '', location.rstrip('/'))
+    name = re.sub(r'^[^@/]+@', '', name)
+    if name.endswith('.git'):
+        name = name[:-4]
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+    return os.path.join(git_cache_dir(), name + '.git')
+
+
+def update_mirror_commands(mirror, url):
+    """Return the commands which create the mirror if needed and refresh it.
+
+    The mirror is fetched from an explicit url instead of a configured remote,
+    so that credentials embedded in the url are never written to disk.
+    """
+    commands = []
+    if not os.path.isdir(mirror):
+        commands.append(['git', 'init', '--bare', '--quiet', mirror])
+    commands.append(['git', '--git-dir=' + mirror, 'fetch', '--prune', url,
+                     '+refs/heads/*:refs/heads/*'])
+    return commands
+
+
+def shared_clone_command(mirror, dest, branch):
+    """Return the command which checks out a branch of the mirror to dest.
+
+    The clone borrows all its objects from the mirror, so it does not need
+    any network access and only writes the checked out files.
+    """
+    return ['git', 'clone', '--shared', '--single-branch', '--branch', branch,
+            mirror, dest]
+
+
+def shared_checkout_commands(mirror, dest, commit):
+    """Return the commands which check out a commit of the mirror to dest.
+
+    Like `shared_clone_command`, the clone borrows all its objects from the
+    mirror. The commit is checked out on a detached HEAD, so it can be any
+    revision of the mirror rather than only the tip of a branch.
+    """
+    return [
+        ['git', 'clone', '--shared', '--no-checkout', '--quiet', mirror,
+         dest],
+        ['git', '-C', dest, 'checkout', '--quiet', '--detach', commit],
+    ]
+
+
+def refresh_clone_commands(repo_dir, branch):
+    """Return the commands which reset an existing clone to its remote branch.
+
+    The clone is fetched incrementally from its `origin` remote, then the
+    local branch is recreated at the fetched commit and checked out, whatever
+    branch was checked out before, and untracked and ignored files are
+    removed.
+    """
+    return [
+        ['git', '-C', repo_dir, 'fetch', '--quiet', 'origin', branch],
+        ['git', '-C', repo_dir, 'checkout', '--force', '--quiet', '-B',
+         branch, 'FETCH_HEAD'],
+        ['git', '-C', repo_dir, 'clean', '-fdx', '--quiet'],
+    ]
+
+
+def fast_import_stream(ref, from_ref, committer, message, mappings):
+    """Yield a `git fast-import` stream committing generated code onto a ref.
+
+    The commit is created on top of from_ref. Every destination path is
+    emptied, then filled with the content of its source directory, which is
+    equivalent to `git rm -r <dest>`, copying the code and `git add <dest>`
+    in a working tree, without needing one.
+
+    Args:
+        ref (str): The ref the commit is written to.
+        from_ref (str): The ref of the parent commit.
+        committer (str): The committer identity, as printed by
+            `git var GIT_COMMITTER_IDENT`.
+        message (str): The commit message.
+        mappings (list): (src_dir, dest) tuples; dest is relative to the
+            root of the repository.
+
+    Yields:
+        bytes: Consecutive chunks of the stream.
+    """
+    message = message.encode('utf8')
+    yield ('commit %s\ncommitter %s\ndata %d\n'
+           % (ref, committer, len(message))).encode('utf8')
+    yield message + b'\n'
+    yield ('from %s\n' % from_ref).encode('utf8')
+    for src_dir, dest in mappings:
+        dest = _repo_path(dest)
+        if dest:
+            yield ('D %s\n' % _quote_path(dest)).encode('utf8')
+        else:
+            yield b'deleteall\n'
+    for src_dir, dest in mappings:
+        dest = _repo_path(dest)
+        for root, dirs, files in os.walk(src_dir):
+            for name in sorted(files + [d for d in dirs if os.path.islink(
+                    os.path.join(root, d))]):
+                path = os.path.join(root, name)
+                repo_path = _repo_path(os.path.join(
+                    dest, os.path.relpath(path, src_dir)))
+                for chunk in _file_stream(path, repo_path):
+                    yield chunk
+    yield b'\n'
+
+
+def _file_stream(path, repo_path):
+    """Yield the fast-import `M` command and the data of a single file."""
+    if os.path.islink(path):
+        target = os.readlink(path).encode('utf8')
+        yield ('M 120000 inline %s\ndata %d\n'
+               % (_quote_path(repo_path), len(target))).encode('utf8')
+        yield target + b'\n'
+        return
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        mode = '100755' if st.st_mode & stat.S_IXUSR else '100644'
+        yield ('M %s inline %s\ndata %d\n'
+               % (mode, _quote_path(repo_path), st.st_size)).encode('utf8')
+        for chunk in iter(lambda: f.read(_STREAM_CHUNK_SIZE), b''):
+            yield chunk
+    yield b'\n'
+
+
+def _repo_path(path):
+    """Normalize a path relative to the root of the repository."""
+    path = os.path.normpath(path).replace(os.path.sep, '/')
+    return '' if path == '.' else path.strip('/')
+
+
+def _quote_path(path):
+    if path.startswith('"') or '\n' in path:
+        return '"%s"' % (path.replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+    return path
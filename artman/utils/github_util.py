@@ -0,0 +1,135 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils related to the GitHub API.
+
+Clients and repositories are shared by every task of the process, so that
+consecutive requests reuse the same keep-alive HTTP session, and calls are
+retried with backoff when GitHub rate limits them.
+"""
+
+import threading
+import time
+
+import github3
+
+import six
+
+from artman.utils.logger import logger
+
+# How long a cached repository is used before being revalidated with a
+# conditional request, which does not count against the rate limit when the
+# repository did not change.
+REPOSITORY_TTL_SECONDS = 300
+
+# GitHub recommends waiting at least one second between requests creating
+# content, to avoid hitting the secondary rate limits.
+MIN_WRITE_INTERVAL_SECONDS = 1.0
+
+MAX_ATTEMPTS = 5
+_INITIAL_BACKOFF_SECONDS = 2
+_MAX_BACKOFF_SECONDS = 120
+
+_lock = threading.RLock()
+_clients = {}
+_repositories = {}
+_last_write = [0.0]
+
+
+def client(username, token):
+    """Return the GitHub client of the given user, logging in only once."""
+    with _lock:
+        key = (username, token)
+        if key not in _clients:
+            _clients[key] = github3.login(username, token)
+        return _clients[key]
+
+
+def repository(username, token, owner, name):
+    """Return the repository, looking it up only once per process.
+
+    A cached repository older than REPOSITORY_TTL_SECONDS is revalidated
+    with its ETag before being returned.
+    """
+    with _lock:
+        key = (username, token, owner, name)
+        cached = _repositories.get(key)
+        if cached and time.time() - cached[1] < REPOSITORY_TTL_SECONDS:
+            return cached[0]
+        if cached:
+            repo = call_with_backoff(cached[0].refresh, conditional=True)
+        else:
+            repo = call_with_backoff(
+                client(username, token).repository, owner, name)
+        if repo:
+            _repositories[key] = (repo, time.time())
+        return repo
+
+
+def create_pull(repo, **kwargs):
+    """Create a pull request, spacing writes to avoid secondary limits."""
+    with _lock:
+        wait = _last_write[0] + MIN_WRITE_INTERVAL_SECONDS - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return call_with_backoff(repo.create_pull, **kwargs)
+        finally:
+            _last_write[0] = time.time()
+
+
+def call_with_backoff(method, *args, **kwargs):
+    """Call a github3 method, retrying when rate limited or on 5xx errors.
+
+    The wait honors the `Retry-After` and `X-RateLimit-Reset` headers of the
+    response when present, and otherwise backs off exponentially.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return method(*args, **kwargs)
+        except github3.exceptions.GitHubError as e:
+            wait = _retry_delay(e, attempt)
+            if wait is None or attempt == MAX_ATTEMPTS - 1:
+                raise
+            logger.warning('GitHub request failed with %s %s; retrying in '
+                           '%d seconds.' % (e.code, e.msg, wait))
+            time.sleep(wait)
+
+
+def clear_cache():
+    """Forget every cached client and repository."""
+    with _lock:
+        _clients.clear()
+        _repositories.clear()
+        _last_write[0] = 0.0
+
+
+def _retry_delay(error, attempt):
+    """Return how long to wait before retrying, or None not to retry."""
+    backoff = min(_INITIAL_BACKOFF_SECONDS * 2 ** attempt,
+                  _MAX_BACKOFF_SECONDS)
+    if error.code >= 500:
+        return backoff
+    if error.code not in (403, 429):
+        return None
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    if headers.get('Retry-After', '').isdigit():
+        return int(headers['Retry-After'])
+    if headers.get('X-RateLimit-Remaining') == '0':
+        reset = int(headers.get('X-RateLimit-Reset', 0))
+        return max(reset - int(time.time()), 0) + 1
+    msg = error.msg if isinstance(error.msg, six.text_type) else ''
+    if 'rate limit' in msg.lower():
+        # Secondary rate limits do not always come with a Retry-After.
+        return backoff
+    return None
@@ -0,0 +1,202 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils maintaining a local snapshot of the googleapis repository.
+
+The snapshot is kept under `ARTMAN_GOOGLEAPIS_CACHE_DIR`
+(`~/.artman/googleapis-cache` by default) along with the ETag of the archive
+it was extracted from, so it is only downloaded again when the archive
+changed. Setting `ARTMAN_GOOGLEAPIS_DIR` to a local googleapis checkout uses
+it instead of downloading anything, which is meant for offline testing.
+
+Jobs only get the parts of googleapis their API needs, see api_paths, along
+with the protos those import.
+"""
+
+import contextlib
+import io
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+from six.moves import urllib
+
+from artman.utils import file_util
+from artman.utils.logger import logger
+
+ARCHIVE_URL = ('https://codeload.github.com/googleapis/googleapis/'
+               'tar.gz/master')
+
+# The directories of googleapis every pipeline needs, for the shared
+# configuration of the languages and of packaging.
+SHARED_PATHS = ('gapic',)
+
+_IMPORT_RE = re.compile(
+    r'^\s*import\s+(?:public\s+|weak\s+)?"([^"]+)"\s*;', re.MULTILINE)
+
+
+def googleapis_cache_dir():
+    """Return the directory where the googleapis snapshot is cached."""
+    return os.path.expanduser(os.environ.get(
+        'ARTMAN_GOOGLEAPIS_CACHE_DIR',
+        os.path.join('~', '.artman', 'googleapis-cache')))
+
+
+def materialize(dest, paths=None):
+    """Make an up-to-date googleapis snapshot available at dest.
+
+    The archive is fetched with a conditional request against the ETag of
+    the cached snapshot, and only downloaded and extracted when it changed.
+    Files are then cloned from the snapshot when the filesystem supports
+    it, and copied otherwise, so that jobs can never modify the snapshot.
+
+    Args:
+        dest (str): The directory to create.
+        paths (list): The only files and directories needed, relative to
+            the root of the repository. The directories of the protos they
+            import are added. Everything is made available if None.
+
+    Returns:
+        str: dest.
+    """
+    local_dir = os.environ.get('ARTMAN_GOOGLEAPIS_DIR')
+    if local_dir:
+        _link_paths(os.path.abspath(os.path.expanduser(local_dir)), dest,
+                    paths)
+        return dest
+
+    cache_dir = googleapis_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with file_util.locked(os.path.join(cache_dir, 'lock')):
+        _link_paths(_refresh_snapshot(cache_dir), dest, paths)
+    return dest
+
+
+def api_paths(root_dir, api_files):
+    """Return the parts of googleapis an API needs.
+
+    Args:
+        root_dir (str): The googleapis directory of the API configuration.
+        api_files (list): The proto directories and configuration files of
+            the API. Those outside of root_dir are ignored.
+
+    Returns:
+        list: The paths relative to root_dir, with SHARED_PATHS.
+    """
+    paths = set(SHARED_PATHS)
+    for path in api_files:
+        rel_path = os.path.relpath(os.path.abspath(path), root_dir)
+        if rel_path != os.pardir and not rel_path.startswith(
+                os.pardir + os.sep):
+            paths.add(rel_path)
+    return sorted(paths)
+
+
+def extract_archive(fileobj, dest):
+    """Extract a GitHub archive stream, dropping its top-level directory.
+
+    Args:
+        fileobj (file): The gzipped tar stream.
+        dest (str): The directory to extract to.
+    """
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+        for member in tar:
+            name = member.name.split('/', 1)[-1] if '/' in member.name else ''
+            if not name:
+                continue
+            if name.startswith('/') or '..' in name.split('/'):
+                raise ValueError('Refusing to extract %s.' % member.name)
+            member.name = name
+            tar.extract(member, dest)
+
+
+def _refresh_snapshot(cache_dir):
+    """Return the cached snapshot, after updating it if the archive changed.
+
+    Must be called with the cache locked.
+    """
+    snapshot = os.path.join(cache_dir, 'googleapis')
+    etag_file = os.path.join(cache_dir, 'etag')
+    etag = None
+    if os.path.isdir(snapshot) and os.path.isfile(etag_file):
+        with io.open(etag_file) as f:
+            etag = f.read().strip()
+    request = urllib.request.Request(ARCHIVE_URL)
+    if etag:
+        request.add_header('If-None-Match', etag)
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        logger.info('googleapis snapshot %s is up to date.' % etag)
+        return snapshot
+
+    logger.info('Downloading googleapis snapshot from %s.' % ARCHIVE_URL)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        with contextlib.closing(response):
+            extract_archive(response, tmp_dir)
+        if os.path.isdir(snapshot):
+            shutil.rmtree(snapshot)
+        os.rename(tmp_dir, snapshot)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    with io.open(etag_file, 'w') as f:
+        f.write(u'%s' % response.info().get('ETag', ''))
+    return snapshot
+
+
+def _link_paths(snapshot, dest, paths):
+    paths = _with_imports(snapshot, paths) if paths else ['.']
+    for path in paths:
+        src = os.path.join(snapshot, path)
+        if os.path.exists(src):
+            file_util.stage_tree(src, os.path.normpath(
+                os.path.join(dest, path)), 'reflink')
+        else:
+            logger.warning('%s does not exist in googleapis.' % path)
+
+
+def _with_imports(snapshot, paths):
+    """Return paths, and the directories of the protos they import in
+    snapshot, transitively."""
+    needed = [os.path.normpath(path) for path in paths]
+    pending = list(needed)
+    while pending:
+        for imported in _proto_imports(os.path.join(snapshot, pending.pop())):
+            directory = os.path.dirname(imported)
+            if (os.path.isfile(os.path.join(snapshot, imported)) and
+                    not _covered(directory, needed)):
+                needed.append(directory)
+                pending.append(directory)
+    return needed
+
+
+def _proto_imports(path):
+    """Yield the files imported by the protos under path."""
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.endswith('.proto'):
+                with io.open(os.path.join(root, name), encoding='utf8',
+                             errors='replace') as f:
+                    for imported in _IMPORT_RE.findall(f.read()):
+                        yield imported
+
+
+def _covered(path, paths):
+    return any(path == p or path.startswith(p + '/') for p in paths)
@@ -14,14 +14,17 @@
 """Util class for job-related operations."""
 
 from __future__ import print_function
+import atexit
 import contextlib
 import os
+import threading
 import time
 
 from oslo_utils import uuidutils
 
 from taskflow import engines
 from taskflow import states
+from taskflow.jobs import base as jobs_base
 from taskflow.persistence import logbook
 
 from artman.pipelines import pipeline_factory
@@ -31,61 +34,181 @@ from artman.utils.logger import logger
 # TODO(cbao): Include machine name
 POSTER_NAME = "poster-%s" % os.getpid()
 
+# The connected posters, by job board name, shared across calls.
+_posters = {}
+_posters_lock = threading.Lock()
 
-def post_remote_pipeline_job_and_wait(pipeline, jobboard_name):
-    """Post a pipeline job and wait until it is finished."""
-    my_name = POSTER_NAME
-    logger.info("Starting poster with name: %s" % my_name)
-    persist_backend = backend_helper.default_persistence_backend()
-    with contextlib.closing(persist_backend):
-        with contextlib.closing(persist_backend.get_connection()) as conn:
+
+class JobCancelledError(Exception):
+    """Raised when waiting for a job which was cancelled."""
+
+
+class JobTimeoutError(Exception):
+    """Raised when a job does not complete within the timeout."""
+
+
+class JobPoster(object):
+    """Posts pipeline jobs to a job board, and waits for them to complete.
+
+    The persistence backend and job board connections are opened once, and
+    shared by all the jobs posted until close() is called. A job is removed
+    from the board once a conductor consumed it, and the board notifies the
+    removal, so waiting does not poll. Any number of threads may wait for
+    jobs at once.
+    """
+
+    def __init__(self, jobboard_name, name=POSTER_NAME):
+        self.name = name
+        self._persist_backend = backend_helper.default_persistence_backend()
+        with contextlib.closing(
+                self._persist_backend.get_connection()) as conn:
             conn.upgrade()
-        jobboard = backend_helper.get_jobboard(my_name, jobboard_name)
-        jobboard.connect()
-        with contextlib.closing(jobboard):
-            # Create information in the persistence backend about the
-            # unit of work we want to complete and the factory that
-            # can be called to create the tasks that the work unit needs
-            # to be done.
-            lb = logbook.LogBook("post-from-%s" % my_name)
-            flow_uuid = uuidutils.generate_uuid()
-            fd = logbook.FlowDetail("flow-of-%s" % my_name, flow_uuid)
-            lb.add(fd)
-            with contextlib.closing(persist_backend.get_connection()) as conn:
-                conn.save_logbook(lb)
-
-            engines.save_factory_details(fd,
-                                         pipeline_factory.make_pipeline_flow,
-                                         [pipeline.name, True],
-                                         pipeline.kwargs,
-                                         backend=persist_backend)
-            # Post, and be done with it!
-            jb = jobboard.post("job-from-%s" % my_name, book=lb)
-            logger.info('Posted: %s' % jb)
-            # TODO(cbao): Move wait until into a seperate method.
-            # TODO(lukesneeringer): ...and fix the logging.
-            state = states.UNCLAIMED
-            print('Job status: %s' % state)
-            while state != states.COMPLETE:
-                if (jb.state != state):
-                    state = jb.state
-                    print('Job status: %s' % state)
-                time.sleep(1)
-            return jb
+        self._jobboard = backend_helper.get_jobboard(name, jobboard_name)
+        self._removed = threading.Condition()
+        self._removals = 0
+        self._cancelled = set()
+        self._jobboard.notifier.register(jobs_base.REMOVAL, self._on_removal)
+        self._jobboard.connect()
+
+    def post(self, pipeline):
+        """Post a pipeline job.
+
+        Returns:
+            Job: The job posted.
+        """
+        # Create information in the persistence backend about the unit of
+        # work we want to complete and the factory that can be called to
+        # create the tasks that the work unit needs to be done.
+        lb = logbook.LogBook("post-from-%s" % self.name)
+        flow_uuid = uuidutils.generate_uuid()
+        fd = logbook.FlowDetail("flow-of-%s" % self.name, flow_uuid)
+        lb.add(fd)
+        with contextlib.closing(
+                self._persist_backend.get_connection()) as conn:
+            conn.save_logbook(lb)
+
+        engines.save_factory_details(fd,
+                                     pipeline_factory.make_pipeline_flow,
+                                     [pipeline.name, True],
+                                     pipeline.kwargs,
+                                     backend=self._persist_backend)
+        jb = self._jobboard.post("job-from-%s" % self.name, book=lb)
+        logger.info('Posted: %s' % jb)
+        return jb
+
+    def wait(self, jb, timeout=None):
+        """Wait until a job is complete.
+
+        Args:
+            jb (Job): The job to wait for.
+            timeout (float): The longest time to wait for, in seconds. Waits
+                forever if None.
+
+        Returns:
+            bool: Whether the job completed, rather than the wait timing
+                out.
+
+        Raises:
+            JobCancelledError: If the job was cancelled.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            # The state is checked again after every removal from the board,
+            # and once at first in case the job was removed before this call.
+            with self._removed:
+                removals = self._removals
+            if jb.uuid in self._cancelled:
+                raise JobCancelledError('Job %s was cancelled.' % jb.uuid)
+            if jb.state == states.COMPLETE:
+                return True
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+            with self._removed:
+                if self._removals == removals:
+                    self._removed.wait(remaining)
+
+    def cancel(self, jb):
+        """Cancel a job which no conductor claimed yet.
+
+        The job is moved to the trash of the job board, and the threads
+        waiting for it get a JobCancelledError.
+
+        Raises:
+            taskflow.exceptions.UnclaimableJob: If a conductor already
+                claimed the job.
+        """
+        self._jobboard.claim(jb, self.name)
+        with self._removed:
+            self._cancelled.add(jb.uuid)
+        try:
+            self._jobboard.trash(jb, self.name)
+        except Exception:
+            with self._removed:
+                self._cancelled.discard(jb.uuid)
+            self._jobboard.abandon(jb, self.name)
+            raise
+        logger.info('Cancelled: %s' % jb)
+
+    def fetch_status(self, jb):
+        """Return the details of the atoms of the flows of a job, and the
+        details of its last flow."""
+        result = []
+        flow_detail = None
+        with contextlib.closing(
+                self._persist_backend.get_connection()) as conn:
+            for flow in jb.book:
+                flow_detail = conn.get_flow_details(flow.uuid)
+                result += flow_detail
+        return result, flow_detail
+
+    def close(self):
+        self._jobboard.close()
+        self._persist_backend.close()
+
+    def _on_removal(self, state, details):
+        with self._removed:
+            self._removals += 1
+            self._removed.notify_all()
+
+
+def get_poster(jobboard_name):
+    """Return the shared poster of a job board, connecting it if needed."""
+    with _posters_lock:
+        if jobboard_name not in _posters:
+            _posters[jobboard_name] = JobPoster(jobboard_name)
+        return _posters[jobboard_name]
+
+
+@atexit.register
+def close_posters():
+    """Close the connections of the shared posters."""
+    with _posters_lock:
+        posters = list(_posters.values())
+        _posters.clear()
+    for poster in posters:
+        poster.close()
+
+
+def post_remote_pipeline_job_and_wait(pipeline, jobboard_name, timeout=None):
+    """Post a pipeline job and wait until it is finished, or for at most
+    timeout seconds if given.
+
+    Raises:
+        JobTimeoutError: If the job did not complete within the timeout.
+    """
+    poster = get_poster(jobboard_name)
+    logger.info("Starting poster with name: %s" % poster.name)
+    jb = poster.post(pipeline)
+    print('Job status: %s' % states.UNCLAIMED)
+    if not poster.wait(jb, timeout):
+        raise JobTimeoutError('Job %s did not complete within %s seconds.'
+                              % (jb.uuid, timeout))
+    print('Job status: %s' % jb.state)
+    return jb
 
 
 def fetch_job_status(jb, jobboard_name):
-    result = []
-    my_name = POSTER_NAME
-    persist_backend = backend_helper.default_persistence_backend()
-    with contextlib.closing(persist_backend):
-        with contextlib.closing(persist_backend.get_connection()) as conn:
-            conn.upgrade()
-        jobboard = backend_helper.get_jobboard(my_name, jobboard_name)
-        jobboard.connect()
-        with contextlib.closing(jobboard):
-            with contextlib.closing(persist_backend.get_connection()) as conn:
-                for flow in jb.book:
-                    flow_detail = conn.get_flow_details(flow.uuid)
-                    result += flow_detail
-    return result, flow_detail
+    return get_poster(jobboard_name).fetch_status(jb)
@@ -0,0 +1,263 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils shipping log records to a remote sink while a task runs.
+
+`ShippingHandler` buffers formatted records and writes them to a sink in
+batches bounded in size and age from a background thread, so that logs are
+visible while the task runs, and memory stays bounded however much it logs.
+
+A sink is any object with a `write(entries)` method, taking a list of
+(severity, text) tuples. `make_sink` creates one of the sinks below from a
+spec: `cloud` for Cloud Logging, `file:///path/to/file` to append to a local
+file, or an `http://` URL to POST batches to, such as a local stand-in of the
+logging service.
+"""
+
+import io
+import json
+import logging
+import threading
+import time
+
+from six.moves import queue, urllib
+
+# The maximum number and total size of the records of a batch, and the
+# longest time a record is buffered before being shipped.
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 256 * 1024
+FLUSH_INTERVAL_SECONDS = 5.0
+
+# The maximum number of records waiting to be shipped. Records logged while
+# the buffer is full are dropped, and counted.
+MAX_BUFFERED_RECORDS = 10000
+
+# Reports the batches which failed to ship on stderr. It does not propagate,
+# as the loggers a ShippingHandler is attached to would queue the failure
+# for the same failing sink, and fail again.
+_logger = logging.getLogger(__name__)
+_logger.propagate = False
+_logger.addHandler(logging.StreamHandler())
+
+
+class ShippingHandler(logging.Handler):
+    """A logging handler shipping records to a sink in batches.
+
+    Args:
+        sink: The sink to write batches to.
+        max_batch_records (int): The maximum number of records of a batch.
+        max_batch_bytes (int): The maximum total size of the records of a
+            batch. A single larger record is shipped in its own batch.
+        flush_interval (float): The longest time, in seconds, a record is
+            buffered before being shipped.
+        max_buffered_records (int): The maximum number of records waiting
+            to be shipped.
+
+    Attributes:
+        dropped (int): The number of records dropped so far.
+        ship_seconds (float): The time spent writing batches to the sink so
+            far.
+    """
+
+    def __init__(self, sink, max_batch_records=MAX_BATCH_RECORDS,
+                 max_batch_bytes=MAX_BATCH_BYTES,
+                 flush_interval=FLUSH_INTERVAL_SECONDS,
+                 max_buffered_records=MAX_BUFFERED_RECORDS):
+        super(ShippingHandler, self).__init__()
+        self.sink = sink
+        self.dropped = 0
+        self.ship_seconds = 0.0
+        self._max_batch_records = max_batch_records
+        self._max_batch_bytes = max_batch_bytes
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(max_buffered_records)
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._ship_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            entry = (_severity(record), self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        with self._flushed:
+            try:
+                self._queue.put_nowait(entry)
+                self._pending += 1
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        """Wait until every record emitted so far was shipped."""
+        with self._flushed:
+            while self._pending and self._thread.is_alive():
+                self._flushed.wait(self._flush_interval)
+
+    def close(self):
+        """Ship the remaining records and stop the background thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        super(ShippingHandler, self).close()
+
+    def _ship_forever(self):
+        batch, records, size, reported = [], 0, 0, 0
+        deadline = None
+        entry = True
+        while entry is not None:
+            entry = self._next_entry(deadline)
+            if entry:
+                batch.append(entry)
+                records += 1
+                size += len(entry[1])
+            warning, reported = self._dropped_warning(reported)
+            if warning:
+                batch.append(warning)
+            if batch and deadline is None:
+                deadline = time.time() + self._flush_interval
+            if batch and self._should_ship(entry, records, size, deadline):
+                self._write(batch, records)
+                batch, records, size, deadline = [], 0, 0, None
+
+    def _next_entry(self, deadline):
+        """Return the next entry, None once closed, or False if none came
+        before the deadline.
+
+        Without a deadline, False is still returned after flush_interval,
+        so that records dropped while the queue was full are reported even
+        if no record follows them.
+        """
+        timeout = self._flush_interval
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+    def _dropped_warning(self, reported):
+        """Return the warning entry about the records dropped since the
+        first `reported` ones, if any, and the number of dropped records
+        it reports."""
+        dropped = self.dropped
+        if dropped <= reported:
+            return None, reported
+        return (('WARNING', '%d log records were dropped.'
+                 % (dropped - reported)), dropped)
+
+    def _should_ship(self, entry, records, size, deadline):
+        """Return whether to ship the batch after getting entry."""
+        return (entry is None or entry is False
+                or records >= self._max_batch_records
+                or size >= self._max_batch_bytes
+                or time.time() >= deadline)
+
+    def _write(self, batch, records):
+        start = time.time()
+        try:
+            self.sink.write(batch)
+        except Exception:
+            # Losing a batch must not fail the task being logged.
+            _logger.exception(
+                'Failed to ship %d log records.' % len(batch))
+        self.ship_seconds += time.time() - start
+        with self._flushed:
+            self._pending -= records
+            self._flushed.notify_all()
+
+
+class CloudLoggingSink(object):
+    """Write batches to a Cloud Logging log, one entry per record."""
+
+    def __init__(self, log_id, client=None):
+        if client is None:
+            from gcloud import logging as cloud_logging
+            client = cloud_logging.Client()
+        self._logger = client.logger(log_id)
+
+    def write(self, entries):
+        batch = self._logger.batch()
+        for severity, text in entries:
+            batch.log_text(text, severity=severity)
+        batch.commit()
+
+
+class FileSink(object):
+    """Append batches to a local file, one line per record."""
+
+    def __init__(self, path):
+        self._path = path
+
+    def write(self, entries):
+        with io.open(self._path, 'a', encoding='utf8') as f:
+            for severity, text in entries:
+                f.write(u'%s %s\n' % (severity, text))
+
+
+class HttpSink(object):
+    """POST batches as JSON to a URL.
+
+    The body is an object with an `entries` list of objects with `severity`
+    and `text` fields, as well as the `log_id`.
+    """
+
+    def __init__(self, url, log_id):
+        self._url = url
+        self._log_id = log_id
+
+    def write(self, entries):
+        body = json.dumps({
+            'log_id': self._log_id,
+            'entries': [{'severity': severity, 'text': text}
+                        for severity, text in entries],
+        }).encode('utf8')
+        request = urllib.request.Request(
+            self._url, data=body,
+            headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request).close()
+
+
+def make_sink(spec, log_id):
+    """Create the sink described by spec, for the given log.
+
+    Args:
+        spec (str): `cloud`, a `file://` URL or an `http(s)://` URL. The
+            path of a `file://` URL can contain a `{log_id}` placeholder.
+        log_id (str): The name of the log, such as the task id.
+    """
+    if spec == 'cloud':
+        return CloudLoggingSink(log_id)
+    if spec.startswith('file://'):
+        return FileSink(spec[len('file://'):].format(log_id=log_id))
+    if spec.startswith(('http://', 'https://')):
+        return HttpSink(spec, log_id)
+    raise ValueError('Unknown log sink %s.' % spec)
+
+
+def _severity(record):
+    """Map a record level, including the custom artman ones, to a Cloud
+    Logging severity."""
+    if record.levelno >= logging.CRITICAL:
+        return 'CRITICAL'
+    if record.levelno >= logging.ERROR:
+        return 'ERROR'
+    if record.levelno >= logging.WARNING:
+        return 'WARNING'
+    if record.levelno >= logging.INFO:
+        return 'INFO'
+    return 'DEBUG'
@@ -18,10 +18,7 @@ import subprocess
 
 from six.moves import urllib
 
-from taskflow import engines
-from taskflow.patterns import linear_flow
-
-from artman.tasks import io_tasks
+from artman.utils import gcs_util
 from artman.utils.logger import logger
 
 
@@ -51,9 +48,16 @@ def task_transition(state, details):
                 (details['task_name'], state))
 
 
-def download_from_gcs(bucket_name, path, output_dir):
-    flow = linear_flow.Flow('download_from_gcs')
-    args = {'bucket_name': bucket_name, 'path': path, 'output_dir': output_dir}
-    flow.add(io_tasks.BlobDownloadTask('BlobDownload'))
-    engine = engines.load(flow, engine="serial", store=args)
-    engine.run()
+def download_from_gcs(bucket_name, path, output_dir, extract_dir=None):
+    """Download a blob to output_dir/path, optionally extracting it.
+
+    Returns:
+        str: The location of the downloaded file, or None if the blob does
+            not exist.
+    """
+    filename = os.path.join(output_dir, path)
+    if not gcs_util.download_file(bucket_name, path, filename,
+                                  extract_dir=extract_dir):
+        logger.error('Cannot find the output from GCS.')
+        return None
+    return filename
@@ -222,7 +222,7 @@ def group_by_dirname(protos):
 def protoc_header_params(proto_path,
                           toolkit_path):
     proto_path = proto_path[:]
-    proto_path.append(_find_protobuf_path(toolkit_path))
+    proto_path.append(find_protobuf_path(toolkit_path))
     return (['--proto_path=' + path for path in proto_path])
 
 
@@ -338,7 +338,7 @@ def _is_proto_excluded(proto, excluded_proto_path):
     return False
 
 _protobuf_path = None
-def _find_protobuf_path(toolkit_path):
+def find_protobuf_path(toolkit_path):
     """Fetch and locate protobuf source"""
     global _protobuf_path
     if not _protobuf_path:
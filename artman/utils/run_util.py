@@ -0,0 +1,229 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utils running pipelines locally so that failed runs can be resumed.
+
+Every run persists its pipeline arguments and the results of its tasks to
+the local persistence backend, see backend_helper, under a run id. When a
+task fails, taskflow reverts the flow, so the tasks which completed are also
+recorded in the metadata of the flow as they complete. Resuming the run
+recreates the flow with pipeline_factory.make_pipeline_flow, and only
+executes the tasks which did not complete, with the results of the others.
+The tasks whose revert undid their work, such as removing a working tree,
+are executed again, and so are the tasks which come after them. Task
+results must be primitives, as they are persisted as JSON.
+
+Credentials are not persisted, and must be given again to resume a run.
+Completed runs are deleted, and so are runs which started more than
+`ARTMAN_RUN_RETENTION_DAYS` (7 by default) ago when a new run starts.
+"""
+
+import contextlib
+import datetime
+import os
+
+import six
+
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+from taskflow import engines
+from taskflow import exceptions
+from taskflow import states
+from taskflow import task
+from taskflow.engines.action_engine import compiler
+from taskflow.persistence import logbook
+
+from artman.pipelines import pipeline_factory
+from artman.utils import backend_helper
+from artman.utils.logger import logger
+
+# The key of the flow metadata listing the tasks which completed.
+COMPLETED_TASKS = 'artman_completed_tasks'
+
+# The pipeline arguments holding credentials, which are never persisted.
+CREDENTIAL_ARGS = ('github',)
+
+# How long the runs which did not complete are kept after they started, in
+# days.
+RETENTION_DAYS = float(os.environ.get('ARTMAN_RUN_RETENTION_DAYS', 7))
+
+
+def run_pipeline(pipeline_name, pipeline_kwargs):
+    """Run a pipeline with the serial engine, persisting its progress.
+
+    Returns:
+        str: The id of the run.
+    """
+    run_id = uuidutils.generate_uuid()
+    persisted_kwargs, credentials = split_credentials(pipeline_kwargs)
+    backend = backend_helper.local_persistence_backend()
+    with contextlib.closing(backend):
+        with contextlib.closing(backend.get_connection()) as conn:
+            conn.upgrade()
+            _prune_runs(conn)
+            book = logbook.LogBook('artman-run', uuid=run_id)
+            flow_detail = logbook.FlowDetail(pipeline_name,
+                                             uuidutils.generate_uuid())
+            book.add(flow_detail)
+            conn.save_logbook(book)
+        engines.save_factory_details(flow_detail,
+                                     pipeline_factory.make_pipeline_flow,
+                                     [pipeline_name, False],
+                                     persisted_kwargs,
+                                     backend=backend)
+        pipeline = pipeline_factory.make_pipeline(pipeline_name, False,
+                                                  **pipeline_kwargs)
+        store, _ = split_credentials(pipeline.kwargs)
+        engine = engines.load(
+            pipeline.flow, engine='serial', store=store, book=book,
+            flow_detail=flow_detail, backend=backend)
+        engine.storage.inject(credentials, transient=True)
+        logger.info('Starting run %s.' % run_id)
+        _run(engine, backend, flow_detail, run_id)
+    return run_id
+
+
+def resume_pipeline(run_id, credentials=None):
+    """Resume a run, only executing the tasks which did not complete.
+
+    Args:
+        run_id (str): The id of the run.
+        credentials (dict): The credential arguments of the pipeline, see
+            CREDENTIAL_ARGS, which were not persisted.
+    """
+    credentials = credentials or {}
+    backend = backend_helper.local_persistence_backend()
+    with contextlib.closing(backend):
+        book, flow_detail = _load(backend, run_id)
+        factory = flow_detail.meta['factory']
+        flow = pipeline_factory.make_pipeline_flow(
+            factory['args'][0], False,
+            **dict(factory['kwargs'], **credentials))
+        completed = _reusable_tasks(flow, flow_detail)
+        for atom_detail in flow_detail:
+            if atom_detail.name in completed:
+                atom_detail.state = states.SUCCESS
+            elif atom_detail.state != states.SUCCESS:
+                atom_detail.state = states.PENDING
+                atom_detail.results = None
+                atom_detail.failure = None
+            atom_detail.intention = states.EXECUTE
+        flow_detail.meta[COMPLETED_TASKS] = sorted(completed)
+        flow_detail.state = states.RESUMING
+        with contextlib.closing(backend.get_connection()) as conn:
+            conn.update_flow_details(flow_detail)
+        engine = engines.load(
+            flow, engine='serial', book=book, flow_detail=flow_detail,
+            backend=backend)
+        engine.storage.inject(credentials, transient=True)
+        logger.info('Resuming run %s, skipping %d completed tasks.'
+                    % (run_id, len(completed)))
+        _run(engine, backend, flow_detail, run_id)
+
+
+def load_run(run_id):
+    """Return the pipeline name and arguments of a run.
+
+    Raises:
+        ValueError: If the run does not exist.
+    """
+    backend = backend_helper.local_persistence_backend()
+    with contextlib.closing(backend):
+        _, flow_detail = _load(backend, run_id)
+    factory = flow_detail.meta['factory']
+    return factory['args'][0], factory['kwargs']
+
+
+def split_credentials(pipeline_kwargs):
+    """Split pipeline arguments into those which can be persisted, and the
+    credentials."""
+    persisted = dict(pipeline_kwargs)
+    credentials = {}
+    for name in CREDENTIAL_ARGS:
+        if name in persisted:
+            credentials[name] = persisted.pop(name)
+    return persisted, credentials
+
+
+def _reusable_tasks(flow, flow_detail):
+    """Return the names of the completed tasks whose results can be reused.
+
+    The tasks which completed were reverted when the run failed. Those which
+    override revert undid their work, so they must be executed again, and so
+    must the tasks which follow them in the flow.
+    """
+    completed = set(flow_detail.meta.get(COMPLETED_TASKS, []))
+    graph = compiler.PatternCompiler(flow).compile().execution_graph
+    states_by_name = dict((ad.name, ad.state) for ad in flow_detail)
+    stale = [node for node in graph.nodes_iter()
+             if node.name in completed and _reverts(node) and
+             states_by_name.get(node.name) != states.SUCCESS]
+    visited = set()
+    while stale:
+        node = stale.pop()
+        if node not in visited:
+            visited.add(node)
+            completed.discard(node.name)
+            stale.extend(graph.successors(node))
+    return completed
+
+
+def _reverts(atom):
+    """Return whether an atom undoes its work when reverted."""
+    return isinstance(atom, task.BaseTask) and (
+        six.get_unbound_function(type(atom).revert) is not
+        six.get_unbound_function(task.BaseTask.revert))
+
+
+def _prune_runs(conn):
+    """Delete the runs which started more than RETENTION_DAYS ago."""
+    oldest = timeutils.utcnow() - datetime.timedelta(days=RETENTION_DAYS)
+    for book in list(conn.get_logbooks()):
+        # The update time of logbooks is not reliable across backends.
+        if timeutils.normalize_time(book.created_at) < oldest:
+            logger.debug('Deleting run %s, older than %s days.'
+                         % (book.uuid, RETENTION_DAYS))
+            conn.destroy_logbook(book.uuid)
+
+
+def _load(backend, run_id):
+    with contextlib.closing(backend.get_connection()) as conn:
+        conn.upgrade()
+        try:
+            book = conn.get_logbook(run_id)
+        except exceptions.NotFound:
+            raise ValueError('Run %s does not exist.' % run_id)
+    return book, next(iter(book))
+
+
+def _run(engine, backend, flow_detail, run_id):
+    def record_completion(state, details):
+        flow_detail.meta.setdefault(COMPLETED_TASKS, []).append(
+            details['task_name'])
+        with contextlib.closing(backend.get_connection()) as conn:
+            conn.update_flow_details(flow_detail)
+
+    engine.atom_notifier.register(states.SUCCESS, record_completion)
+    try:
+        engine.run()
+    except exceptions.StorageFailure:
+        logger.error('Run %s failed to persist the result of a task, which '
+                     'must be a primitive.' % run_id)
+        raise
+    except BaseException:
+        logger.error('Run %s failed. Resume it with `artman resume %s`.'
+                     % (run_id, run_id))
+        raise
+    # Only runs which did not complete can be resumed.
+    with contextlib.closing(backend.get_connection()) as conn:
+        conn.destroy_logbook(run_id)
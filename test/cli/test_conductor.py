@@ -32,3 +32,38 @@ class ParseArgsTests(unittest.TestCase):
             '-l')
         assert flags.queue_name == 'projects/foo/locations/bar/queues/baz'
         assert flags.log_local is True
+        assert flags.workers == 1
+
+    def test_queue(self):
+        flags = conductor._parse_args('--queue', 'sqlite:///tmp/queue.db')
+        assert flags.queue == 'sqlite:///tmp/queue.db'
+
+    def test_workers(self):
+        flags = conductor._parse_args(
+            '--queue-name',
+            'projects/foo/locations/bar/queues/baz',
+            '--workers', '4')
+        assert flags.workers == 4
+
+    def test_lease(self):
+        flags = conductor._parse_args(
+            '--queue-name',
+            'projects/foo/locations/bar/queues/baz',
+            '--lease-seconds', '600',
+            '--renew-seconds', '60')
+        assert flags.lease_seconds == 600
+        assert flags.renew_seconds == 60
+
+    def test_prefetch(self):
+        flags = conductor._parse_args('--queue', 'sqlite:///tmp/queue.db')
+        assert flags.prefetch is None
+        flags = conductor._parse_args(
+            '--queue', 'sqlite:///tmp/queue.db', '--prefetch', '8')
+        assert flags.prefetch == 8
+
+    def test_metrics_port(self):
+        flags = conductor._parse_args('--queue', 'sqlite:///tmp/queue.db')
+        assert flags.metrics_port is None
+        flags = conductor._parse_args(
+            '--queue', 'sqlite:///tmp/queue.db', '--metrics-port', '9090')
+        assert flags.metrics_port == 9090
@@ -55,6 +55,54 @@ class ParseArgsTests(unittest.TestCase):
         assert flags.target == 'staging'
         assert flags.verbosity is None
         assert flags.dry_run is False
+        assert flags.staging_strategy is None
+        assert flags.batch_publish is False
+
+    def test_staging_strategy(self):
+        flags = main.parse_args('publish', '--target=staging', '--dry-run',
+                                '--staging-strategy=hardlink', 'python_gapic')
+        assert flags.staging_strategy == 'hardlink'
+
+        with pytest.raises(SystemExit):
+            main.parse_args('publish', '--target=staging',
+                            '--staging-strategy=symlink', 'python_gapic')
+
+    def test_resume(self):
+        flags = main.parse_args('--local', 'resume', 'abc')
+        assert flags.subcommand == 'resume'
+        assert flags.run_id == 'abc'
+
+        with pytest.raises(SystemExit):
+            main.parse_args('resume')
+
+        flags = main.parse_args('resume', '--github-username=test',
+                                '--github-token=token', 'abc')
+        assert flags.github_username == 'test'
+        assert flags.github_token == 'token'
+
+
+class NormalizeResumeFlagTests(unittest.TestCase):
+    def setUp(self):
+        self.flags = main.parse_args('resume', '--github-username=test',
+                                     '--github-token=token', 'abc')
+        self.user_config = UserConfig()
+
+    @mock.patch('artman.utils.run_util.load_run')
+    def test_credentials_are_requested_again(self, load_run):
+        load_run.return_value = ('PythonGapicClientPipeline', {
+            'root_dir': '/googleapis', 'publish': 'github'})
+        name, args = main.normalize_resume_flags(self.flags,
+                                                 self.user_config)
+        assert name == 'PythonGapicClientPipeline'
+        assert args['github'] == {'username': 'test', 'token': 'token'}
+        assert self.flags.root_dir == '/googleapis'
+
+    @mock.patch('artman.utils.run_util.load_run')
+    def test_no_credentials_without_github(self, load_run):
+        load_run.return_value = ('PythonGapicClientPipeline', {
+            'root_dir': '/googleapis', 'publish': 'noop'})
+        _, args = main.normalize_resume_flags(self.flags, self.user_config)
+        assert 'github' not in args
 
 
 class NormalizeFlagTests(unittest.TestCase):
@@ -94,3 +142,12 @@ class NormalizeFlagTests(unittest.TestCase):
         assert args['publish'] == 'github'
         assert args['github']['username'] == 'test'
         assert args['github']['token'] == 'testtoken'
+        assert 'batch_publish' not in args
+
+    def test_batch_publish(self):
+        self.flags.target = 'github'
+        self.flags.subcommand = 'publish'
+        self.flags.batch_publish = True
+        name, args = main.normalize_flags(self.flags, self.user_config)
+        assert args['publish'] == 'github'
+        assert args['batch_publish'] is True
@@ -13,9 +13,15 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import base64
 import json
+import multiprocessing
+import multiprocessing.pool
 import os
+import shutil
 import subprocess
+import tempfile
+import time
 import unittest
 import uuid
 
@@ -24,7 +30,9 @@ from googleapiclient.discovery import build_from_document
 import mock
 
 from artman.cli import main
-from artman.conductors import cloudtasks_conductor
+from artman.conductors import cloudtasks_conductor, queues
+from artman.utils import git_util
+from artman.utils.logger import logger
 
 
 class ConductorTests(unittest.TestCase):
@@ -63,111 +71,527 @@ class ConductorTests(unittest.TestCase):
         ]
     })
 
-    _FAKE_ACK_TASK_RESPONSE = json.dumps({})
-
-    _FAKE_DELETE_TASK_RESPONSE = json.dumps({})
-
-    _FAKE_CANCEL_TASK_LEASE_RESPONSE = json.dumps({
-        'name': 'projects/foo/locations/bar/queues/baz/tasks/fake'
+    _FAKE_RENEW_TASK_LEASE_RESPONSE = json.dumps({
+        'name': 'projects/foo/locations/bar/queues/baz/tasks/fake',
+        'scheduleTime': '2018-01-01T00:05:00Z',
     })
 
     _FAKE_QUEUE_NAME = 'projects/foo/locations/bar/queues/baz'
 
-    @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
-    @mock.patch.object(main, 'main')
-    @mock.patch.object(cloudtasks_conductor, '_write_to_cloud_logging')
-    @mock.patch.object(cloudtasks_conductor, '_cleanup')
-    def test_execute_task_succeed(self, cleanup, write_to_cloud_logging,
-                                  cli_main, prepare_dir):
+    @mock.patch.object(cloudtasks_conductor, '_run_task')
+    @mock.patch.object(queues.CloudTasksQueue, 'ack')
+    @mock.patch.object(queues.CloudTasksQueue, 'cancel_lease')
+    def test_pull_and_execute_tasks_succeed(self, cancel_task_lease, ack_task,
+                                            run_task):
         http = HttpMockSequence([
             ({'status': '200'}, self._FAKE_PULL_TASKS_RESPONSE),
-            ({'status': '200'}, self._FAKE_ACK_TASK_RESPONSE),
         ])
-
-        client = self._create_cloudtasks_client_testing(http=http)
-        prepare_dir.return_value = (
-            'task_id', '/tmp', '/tmp/artman-config.yaml', '/tmp/artman.log')
-        write_to_cloud_logging.return_value = None
-        cleanup.return_value = None
+        queue = self._create_queue_testing(http=http)
+        run_task.return_value = (True, {})
+        running = {}
 
         cloudtasks_conductor._pull_and_execute_tasks(
-            task_client=client,
-            queue_name=self._FAKE_QUEUE_NAME)
-        cli_main.assert_called_once_with(
-            u'--api', u'pubsub', u'--lang', u'python', '--user-config',
-            '/tmp/artman-config.yaml')
+            queue=queue,
+            running=running,
+            pool=self._pool())
         # Make sure ack is called when the task execution succeeds.
-        cleanup.assert_called_once()
-        write_to_cloud_logging.assert_called_with('task_id', '/tmp/artman.log')
+        ack_task.assert_called_once()
+        assert cancel_task_lease.call_count == 0
+        assert running == {}
+
+    @mock.patch.object(cloudtasks_conductor, '_run_task')
+    @mock.patch.object(queues.CloudTasksQueue, 'ack')
+    @mock.patch.object(queues.CloudTasksQueue, 'cancel_lease')
+    def test_pull_and_execute_tasks_fail(self, cancel_task_lease, ack_task,
+                                         run_task):
+        http = HttpMockSequence([
+            ({'status': '200'}, self._FAKE_PULL_TASKS_RESPONSE),
+        ])
+        queue = self._create_queue_testing(http=http)
+        run_task.return_value = (False, {})
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=queue,
+            running={},
+            pool=self._pool())
+        # Make sure cancel is called when the task execution fails.
+        cancel_task_lease.assert_called_once()
+        assert ack_task.call_count == 0
+
+    @mock.patch.object(cloudtasks_conductor, '_start_task')
+    @mock.patch.object(cloudtasks_conductor, '_reap_tasks')
+    def test_pull_sized_to_free_workers(self, reap_tasks, start_task):
+        queue = mock.Mock()
+        queue.pull.return_value = json.loads(
+            self._FAKE_PULL_TASKS_RESPONSE)['tasks']
+        running = {name: self._execution('--api %s' % name)
+                   for name in ('a', 'b')}
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=queue,
+            running=running,
+            pool='pool',
+            workers=5)
+        queue.pull.assert_called_once_with(3, 300)
+        start_task.assert_called_once_with(
+            queue, queue.pull.return_value[0], running, 'pool', 'cloud')
+        # More tasks may be pending, so pull again right away.
+        reap_tasks.assert_called_once_with(
+            queue, running, 0, 300, 120, mock.ANY)
+
+    @mock.patch.object(cloudtasks_conductor, '_reap_tasks')
+    def test_no_pull_without_free_workers(self, reap_tasks):
+        queue = mock.Mock()
+        running = {'a': None}
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=queue,
+            running=running,
+            pool='pool')
+        assert queue.pull.call_count == 0
+        reap_tasks.assert_called_once_with(
+            queue, running, None, 300, 120, mock.ANY)
+
+    @mock.patch.object(cloudtasks_conductor, '_start_task')
+    @mock.patch.object(cloudtasks_conductor, '_reap_tasks')
+    def test_prefetch(self, reap_tasks, start_task):
+        queue = mock.Mock()
+        queue.pull.return_value = [self._task('--api %s' % api, name=api)
+                                   for api in ('a', 'b', 'c')]
+        running = {'x': self._execution('--api x')}
+        backlog = cloudtasks_conductor._Backlog()
+        start_task.side_effect = (
+            lambda queue, task, running, pool, log_sink: running.update(
+                {task['name']: self._execution('--api y')}))
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=queue,
+            running=running,
+            pool='pool',
+            workers=2,
+            backlog=backlog,
+            prefetch=2)
+        queue.pull.assert_called_once_with(3, 300)
+        assert start_task.call_count == 1
+        # The other tasks wait for a free worker, under lease.
+        assert [t['name'] for t in backlog.tasks] == ['b', 'c']
+
+    def test_backlog_priorities(self):
+        backlog = cloudtasks_conductor._Backlog()
+        for name, args in [('batch', '--priority batch'),
+                           ('unknown', '--priority urgent'),
+                           ('interactive', '--priority interactive'),
+                           ('default', '--api pubsub')]:
+            backlog.add(self._task(args, name=name))
+
+        assert [backlog.pop({})['name'] for _ in range(4)] == [
+            'interactive', 'default', 'batch', 'unknown']
+
+    def test_backlog_fair_share(self):
+        backlog = cloudtasks_conductor._Backlog()
+        for i in range(3):
+            backlog.add(self._task('--tenant nightly', name='nightly%d' % i))
+        backlog.add(self._task('--tenant alice', name='alice'))
+        backlog.add(self._task('--tenant bob', name='bob'))
+        running = {'x': self._execution('--tenant alice')}
+
+        # Bob has no running task, and alice has one.
+        assert [backlog.pop(running)['name'] for _ in range(3)] == [
+            'nightly0', 'bob', 'nightly1']
+        # The tenants which did not start a task yet go first.
+        backlog.add(self._task('--tenant nightly', name='nightly3'))
+        assert [backlog.pop({})['name'] for _ in range(3)] == [
+            'alice', 'nightly2', 'nightly3']
+
+    def test_backlog_renew_leases(self):
+        queue = mock.Mock()
+        queue.renew_lease.side_effect = [None, queues.LeaseError()]
+        backlog = cloudtasks_conductor._Backlog()
+        backlog.add(self._task('--api a', name='a'))
+        backlog.add(self._task('--api b', name='b'))
+
+        backlog.renew_leases(queue, 300, 0)
+        # The task whose lease is lost is left to be redelivered.
+        assert [t['name'] for t in backlog.tasks] == ['a']
+
+    @mock.patch.object(cloudtasks_conductor, '_reap_tasks')
+    def test_idle_backoff(self, reap_tasks):
+        queue = mock.Mock()
+        queue.pull.return_value = []
+        sleeps = []
+        idle_sleep = 0
+        for _ in range(7):
+            idle_sleep = cloudtasks_conductor._pull_and_execute_tasks(
+                queue=queue,
+                running={},
+                pool='pool',
+                idle_sleep=idle_sleep)
+            sleeps.append(idle_sleep)
+            timeout = reap_tasks.call_args[0][2]
+            assert idle_sleep / 2.0 <= timeout <= idle_sleep
+        assert sleeps == [1, 2, 4, 8, 16, 30, 30]
+
+        # Pulling tasks again resets the backoff.
+        queue.pull.return_value = json.loads(
+            self._FAKE_PULL_TASKS_RESPONSE)['tasks']
+        with mock.patch.object(cloudtasks_conductor, '_start_task'):
+            assert cloudtasks_conductor._pull_and_execute_tasks(
+                queue=queue,
+                running={},
+                pool='pool',
+                idle_sleep=30) == 0
+
+    def test_finish_task_metrics(self):
+        task = self._task('generate python_gapic', name='a')
+        failed = self._task('generate java_gapic', name='b')
+        labels = {'pipeline': 'gapic', 'language': 'python'}
+        acked = cloudtasks_conductor.TASKS_ACKED.value(**labels)
+        failures = cloudtasks_conductor.TASKS_FAILED.value(
+            pipeline='gapic', language='java')
+        clones = cloudtasks_conductor.CLONE_SECONDS.count(**labels)
+
+        execution = cloudtasks_conductor._Execution(task, mock.Mock())
+        execution.result.get.return_value = (True, {'clone': 3.5})
+        cloudtasks_conductor._finish_task(mock.Mock(), execution)
+        execution = cloudtasks_conductor._Execution(failed, mock.Mock())
+        execution.result.ready.return_value = False
+        execution.started_at = 0
+        cloudtasks_conductor._finish_task(mock.Mock(), execution)
+
+        assert cloudtasks_conductor.TASKS_ACKED.value(**labels) == acked + 1
+        assert cloudtasks_conductor.TASKS_FAILED.value(
+            pipeline='gapic', language='java') == failures + 1
+        assert cloudtasks_conductor.CLONE_SECONDS.count(**labels) == (
+            clones + 1)
+
+    def test_task_labels(self):
+        assert cloudtasks_conductor._task_labels(self._task(
+            '--config artman_pubsub.yaml generate python_gapic')) == {
+                'pipeline': 'gapic', 'language': 'python'}
+        assert cloudtasks_conductor._task_labels(self._task(
+            '--api pubsub --lang python')) == {
+                'pipeline': '', 'language': ''}
+
+    def test_wake(self):
+        start = time.time()
+        cloudtasks_conductor.wake()
+        cloudtasks_conductor._reap_tasks(mock.Mock(), {}, timeout=10)
+        assert time.time() - start < 5
+
+    @mock.patch.object(time, 'time')
+    def test_queue_wait_seconds(self, time_):
+        time_.return_value = 1514764812.5
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        assert cloudtasks_conductor._queue_wait_seconds(task) is None
+        task['createTime'] = '2018-01-01T00:00:00Z'
+        assert cloudtasks_conductor._queue_wait_seconds(task) == 12.5
+
+    @mock.patch.object(cloudtasks_conductor, '_queue_wait_seconds')
+    def test_queue_wait_per_priority_and_tenant(self, queue_wait_seconds):
+        queue_wait_seconds.return_value = 2.5
+        histogram = cloudtasks_conductor.QUEUE_WAIT_SECONDS
+        labels = {'pipeline': 'gapic', 'language': 'python'}
+        batch = histogram.count(priority='batch', tenant='t1', **labels)
+        interactive = histogram.count(priority='interactive', tenant='',
+                                      **labels)
+        for args in ('--priority batch --tenant t1', '--api a', '--api b'):
+            cloudtasks_conductor._start_task(
+                mock.Mock(), self._task(args + ' generate python_gapic'), {},
+                mock.Mock())
+
+        assert histogram.count(priority='batch', tenant='t1', **labels) == (
+            batch + 1)
+        assert histogram.count(priority='interactive', tenant='',
+                               **labels) == interactive + 2
+
+    def test_reap_lost_task(self):
+        queue = mock.Mock()
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        execution = cloudtasks_conductor._Execution(task, mock.Mock())
+        execution.result.ready.return_value = False
+        execution.started_at -= (cloudtasks_conductor.MAX_TASK_SECONDS +
+                                 cloudtasks_conductor.KILL_GRACE_SECONDS + 1)
+        running = {task['name']: execution}
+
+        cloudtasks_conductor._reap_tasks(queue, running, timeout=0)
+        queue.cancel_lease.assert_called_once_with(task)
+        assert queue.ack.call_count == 0
+        assert running == {}
+
+    @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
+    @mock.patch.object(main, 'main')
+    @mock.patch.object(os, 'chdir')
+    @mock.patch.object(cloudtasks_conductor, '_cleanup')
+    def test_worker_pool(self, cleanup, chdir, cli_main, prepare_dir):
+        prepare_dir.return_value = ('/tmp', '/tmp/artman-config.yaml')
+        cli_main.side_effect = [None, SystemExit(32)]
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        log_sink = 'file://' + self._log_file()
+        # A single worker, replaced after every task.
+        pool = multiprocessing.Pool(
+            1, initializer=cloudtasks_conductor._init_worker,
+            maxtasksperchild=1)
+        self.addCleanup(pool.terminate)
+
+        results = [pool.apply_async(cloudtasks_conductor._run_task,
+                                    (task, log_sink)) for _ in range(2)]
+        # Each task runs in a fresh worker forked from this process, so both
+        # see the first side effect of the mock.
+        assert [r.get(timeout=30)[0] for r in results] == [True, True]
+
+        cli_main.side_effect = SystemExit(32)
+        pool = multiprocessing.Pool(
+            1, initializer=cloudtasks_conductor._init_worker)
+        self.addCleanup(pool.terminate)
+        # Exiting artman fails the task without ending the worker.
+        for _ in range(2):
+            succeeded, _ = pool.apply(cloudtasks_conductor._run_task,
+                                      (task, log_sink))
+            assert not succeeded
 
+    @mock.patch.object(cloudtasks_conductor, 'MAX_TASK_SECONDS', 1)
     @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
-    @mock.patch.object(cloudtasks_conductor, '_delete_task')
-    @mock.patch.object(cloudtasks_conductor, '_write_to_cloud_logging')
+    @mock.patch.object(main, 'main')
+    @mock.patch.object(os, 'chdir')
     @mock.patch.object(cloudtasks_conductor, '_cleanup')
-    def test_execute_task_exceeding_max_attmpts(self, cleanup,
-                                                write_to_cloud_logging,
-                                                delete_task, prepare_dir):
+    def test_worker_killed_on_timeout(self, cleanup, chdir, cli_main,
+                                      prepare_dir):
+        prepare_dir.return_value = ('/tmp', '/tmp/artman-config.yaml')
+        cli_main.side_effect = lambda *args: time.sleep(60)
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        log_sink = 'file://' + self._log_file()
+        pool = multiprocessing.Pool(
+            1, initializer=cloudtasks_conductor._init_worker)
+        self.addCleanup(pool.terminate)
+
+        stuck = pool.apply_async(cloudtasks_conductor._run_task,
+                                 (task, log_sink))
+        # The replacement of the killed worker is forked with the current
+        # side effect.
+        cli_main.side_effect = None
+        succeeded, _ = pool.apply_async(
+            cloudtasks_conductor._run_task, (task, log_sink)).get(timeout=30)
+        assert succeeded
+        assert not stuck.ready()
+
+    @mock.patch.object(time, 'time')
+    def test_renew_leases(self, time_):
+        http = HttpMockSequence([
+            ({'status': '200'}, self._FAKE_RENEW_TASK_LEASE_RESPONSE),
+        ])
+        queue = self._create_queue_testing(http=http)
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        time_.return_value = 1000
+        renewed = cloudtasks_conductor._Execution(dict(task), None)
+        time_.return_value = 1100
+        fresh = cloudtasks_conductor._Execution(dict(task), None)
+        time_.return_value = 1150
+        labels = cloudtasks_conductor._task_labels(task)
+        renewals = cloudtasks_conductor.LEASE_RENEWALS.value(**labels)
+
+        cloudtasks_conductor._renew_leases(queue, [renewed, fresh], 300, 120)
+        assert renewed.renewals == 1
+        assert renewed.lease_renewed_at == 1150
+        assert renewed.task['scheduleTime'] == '2018-01-01T00:05:00Z'
+        assert fresh.renewals == 0
+        assert cloudtasks_conductor.LEASE_RENEWALS.value(**labels) == (
+            renewals + 1)
+
+    def test_renew_leases_failure(self):
+        http = HttpMockSequence([
+            ({'status': '404'}, '{}'),
+        ])
+        queue = self._create_queue_testing(http=http)
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        execution = cloudtasks_conductor._Execution(task, None)
+        labels = cloudtasks_conductor._task_labels(task)
+        failures = cloudtasks_conductor.LEASE_RENEWAL_FAILURES.value(**labels)
+
+        cloudtasks_conductor._renew_leases(queue, [execution], 300, 0)
+        assert execution.renewals == 0
+        assert cloudtasks_conductor.LEASE_RENEWAL_FAILURES.value(
+            **labels) == failures + 1
+
+    @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
+    @mock.patch.object(queues.CloudTasksQueue, 'delete')
+    def test_execute_task_exceeding_max_attmpts(self, delete_task,
+                                                prepare_dir):
         http = HttpMockSequence([
             ({'status': '200'}, self._FAKE_PULL_TASKS_RESPONSE_WITH_ATTEMPTS),
-            ({'status': '200'}, self._FAKE_DELETE_TASK_RESPONSE),
         ])
-        client = self._create_cloudtasks_client_testing(http=http)
-        prepare_dir.return_value = (
-            'task_id', '/tmp', '/tmp/artman-config.yaml', '/tmp/artman.log')
-        write_to_cloud_logging.return_value = None
-        cleanup.return_value = None
+        queue = self._create_queue_testing(http=http)
+        running = {}
 
         cloudtasks_conductor._pull_and_execute_tasks(
-            task_client=client,
-            queue_name=self._FAKE_QUEUE_NAME)
+            queue=queue,
+            running=running,
+            pool='pool')
         delete_task.assert_called_once()
-        cleanup.assert_called_once()
-        write_to_cloud_logging.assert_called_with('task_id', '/tmp/artman.log')
+        assert prepare_dir.call_count == 0
+        assert running == {}
 
+    @mock.patch.object(uuid, 'uuid4')
     @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
     @mock.patch.object(main, 'main')
-    @mock.patch.object(cloudtasks_conductor, '_write_to_cloud_logging')
+    @mock.patch.object(os, 'chdir')
     @mock.patch.object(cloudtasks_conductor, '_cleanup')
-    def test_execute_task_fail(self, cleanup, write_to_cloud_logging,
-                               cli_main, prepare_dir):
-        http = HttpMockSequence([
-            ({'status': '200'}, self._FAKE_PULL_TASKS_RESPONSE),
-            ({'status': '200'}, self._FAKE_CANCEL_TASK_LEASE_RESPONSE),
-        ])
-        client = self._create_cloudtasks_client_testing(http=http)
-        prepare_dir.return_value = (
-            'task_id', '/tmp', '/tmp/artman-config.yaml', '/tmp/artman.log')
-        cli_main.side_effect = RuntimeError('abc')
-        write_to_cloud_logging.return_value = None
-        cleanup.return_value = None
+    def test_run_task_succeed(self, cleanup, chdir, cli_main, prepare_dir,
+                              uuid4):
+        uuid4.return_value = uuid.UUID('00000000-0000-0000-0000-000000000000')
+        prepare_dir.return_value = ('/tmp', '/tmp/artman-config.yaml')
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        log_file = self._log_file()
 
-        cloudtasks_conductor._pull_and_execute_tasks(
-            task_client=client,
-            queue_name=self._FAKE_QUEUE_NAME)
+        succeeded, timings = cloudtasks_conductor._run_task(
+            task, 'file://' + log_file)
+        assert succeeded
+        assert sorted(timings) == ['clone', 'generation', 'log_upload']
+        prepare_dir.assert_called_once_with('00000000', revision='master')
         cli_main.assert_called_once_with(
             u'--api', u'pubsub', u'--lang', u'python', '--user-config',
             '/tmp/artman-config.yaml')
-        # Make sure cancel is called when the task execution fails.
+        # Each task runs in its own working directory.
+        chdir.assert_called_once_with('/tmp')
         cleanup.assert_called_once()
-        write_to_cloud_logging.assert_called_with('task_id', '/tmp/artman.log')
+        # Close the log handler the way the real cleanup does.
+        cleanup.call_args[0][1].close()
+        with open(log_file) as f:
+            assert 'Beginning of 00000000' in f.read()
+
+    @mock.patch.object(cloudtasks_conductor, '_prepare_dir')
+    @mock.patch.object(main, 'main')
+    @mock.patch.object(os, 'chdir')
+    @mock.patch.object(cloudtasks_conductor, '_cleanup')
+    def test_run_task_fail(self, cleanup, chdir, cli_main, prepare_dir):
+        prepare_dir.return_value = ('/tmp', '/tmp/artman-config.yaml')
+        cli_main.side_effect = RuntimeError('abc')
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+
+        succeeded, timings = cloudtasks_conductor._run_task(
+            task, 'file://' + self._log_file())
+        assert not succeeded
+        # The failed step is timed too.
+        assert 'generation' in timings
+        cleanup.assert_called_once()
+        cleanup.call_args[0][1].close()
 
     @mock.patch.object(os, 'makedirs')
-    @mock.patch.object(uuid, 'uuid4')
-    @mock.patch.object(subprocess, 'check_output')
-    def test_prepare_dir(self, check_output, uuid4, os_mkdir):
-        uuid4.return_value = uuid.UUID('00000000-0000-0000-0000-000000000000')
+    @mock.patch.object(cloudtasks_conductor, '_checkout_googleapis')
+    def test_prepare_dir(self, checkout_googleapis, os_mkdir):
         artman_user_config_mock = mock.mock_open()
         os_mkdir.return_value = None
-        check_output.return_value = b'dummy output'
         with mock.patch('io.open', artman_user_config_mock, create=True):
-            cloudtasks_conductor._prepare_dir()
+            cloudtasks_conductor._prepare_dir('00000000', revision='abcdef')
             os_mkdir.assert_called_once_with(
                 '/tmp/artman/00000000')
+            checkout_googleapis.assert_called_once_with(
+                'https://github.com/googleapis/googleapis.git', 'abcdef',
+                '/tmp/artman/00000000/googleapis')
             handler = artman_user_config_mock()
             handler.write.assert_called()
 
-    def _create_cloudtasks_client_testing(self, http):
+    def test_checkout_googleapis(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        source = os.path.join(tmp_dir, 'googleapis')
+        for command in (['git', 'init', '--quiet', source],
+                        ['git', '-C', source, 'checkout', '--quiet', '-b',
+                         'master']):
+            subprocess.check_call(command)
+        first = self._commit(source, 'v1')
+        self._commit(source, 'v2')
+
+        with mock.patch.dict(os.environ, {
+                'ARTMAN_GIT_CACHE_DIR': os.path.join(tmp_dir, 'cache')}):
+            cloudtasks_conductor._checkout_googleapis(
+                source, 'master', os.path.join(tmp_dir, 'task1'))
+            with mock.patch.object(git_util,
+                                   'update_mirror_commands') as update:
+                # Known commits are checked out without fetching.
+                cloudtasks_conductor._checkout_googleapis(
+                    source, first, os.path.join(tmp_dir, 'task2'))
+                assert update.call_count == 0
+
+        with open(os.path.join(tmp_dir, 'task1', 'VERSION')) as f:
+            assert f.read() == 'v2'
+        with open(os.path.join(tmp_dir, 'task2', 'VERSION')) as f:
+            assert f.read() == 'v1'
+
+    def test_coalescing_key(self):
+        def key(args):
+            return cloudtasks_conductor._coalescing_key({'pullTaskTarget': {
+                'payload': base64.b64encode(args)}})
+
+        assert (key(b'generate --api pubsub --lang python') ==
+                key(b'generate --lang python --api pubsub'))
+        assert (key(b'generate --api pubsub --lang python') !=
+                key(b'generate --api pubsub --lang java'))
+        assert (key(b'--api pubsub --googleapis-revision abc') !=
+                key(b'--api pubsub --googleapis-revision def'))
+
+    def test_renew_leases_drops_lost_duplicates(self):
+        queue = mock.Mock()
+        task = json.loads(self._FAKE_PULL_TASKS_RESPONSE)['tasks'][0]
+        duplicate = dict(task, name=task['name'] + '2')
+        execution = cloudtasks_conductor._Execution(task, None)
+        execution.followers.append(duplicate)
+        queue.renew_lease.side_effect = [None, queues.LeaseError()]
+
+        cloudtasks_conductor._renew_leases(queue, [execution], 300, 0)
+        assert execution.followers == []
+        assert execution.renewals == 1
+
+    def test_task_args(self):
+        task = {'pullTaskTarget': {'payload': base64.b64encode(
+            b'--api pubsub --googleapis-revision abcdef --lang python')}}
+        args, revision = cloudtasks_conductor._task_args(task)
+        assert args == [u'--api', u'pubsub', u'--lang', u'python']
+        assert revision == u'abcdef'
+
+    def test_scheduling_class(self):
+        task = self._task('--api pubsub --priority batch --tenant nightly')
+        assert cloudtasks_conductor._scheduling_class(task) == (
+            'batch', 'nightly')
+        args, _ = cloudtasks_conductor._task_args(task)
+        assert args == [u'--api', u'pubsub']
+        assert cloudtasks_conductor._scheduling_class(
+            self._task('--api pubsub')) == ('interactive', '')
+
+    def _execution(self, args):
+        return cloudtasks_conductor._Execution(self._task(args), None)
+
+    def _task(self, args, name='fake'):
+        return {'name': name,
+                'pullTaskTarget': {'payload': base64.b64encode(
+                    args.encode('utf8')).decode('ascii')},
+                'taskStatus': {'attemptDispatchCount': '0'},
+                'scheduleTime': ''}
+
+    def _pool(self):
+        pool = multiprocessing.pool.ThreadPool(1)
+        self.addCleanup(pool.terminate)
+        return pool
+
+    def _log_file(self):
+        self.addCleanup(logger.setLevel, logger.level)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return os.path.join(tmp_dir, 'artman.log')
+
+    def _commit(self, repo, version):
+        with open(os.path.join(repo, 'VERSION'), 'w') as f:
+            f.write(version)
+        subprocess.check_call(['git', '-C', repo, 'add', 'VERSION'])
+        subprocess.check_call(
+            ['git', '-C', repo, '-c', 'user.name=test',
+             '-c', 'user.email=test@example.com', 'commit', '--quiet',
+             '-m', version])
+        return subprocess.check_output(
+            ['git', '-C', repo, 'rev-parse', 'HEAD']).decode('utf8').strip()
+
+    def _create_queue_testing(self, http):
         with open(
             os.path.join(os.path.dirname(__file__),
                          '../../artman/conductors/cloudtasks.json'), 'r') as f:
-                return build_from_document(f.read(),  http=http)
+                client = build_from_document(f.read(),  http=http)
+        return queues.CloudTasksQueue(self._FAKE_QUEUE_NAME, client=client)
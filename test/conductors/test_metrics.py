@@ -0,0 +1,75 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import unittest
+
+import pytest
+
+from six.moves import urllib
+
+from artman.conductors import metrics
+
+
+class MetricsTests(unittest.TestCase):
+    def test_counter(self):
+        counter = metrics.Counter('test_counter_total', 'Things counted.',
+                                  ('language',))
+        counter.inc(language='python')
+        counter.inc(2, language='python')
+        counter.inc(language='ja"va')
+
+        assert counter.value(language='python') == 3
+        assert counter.render() == [
+            '# HELP test_counter_total Things counted.',
+            '# TYPE test_counter_total counter',
+            'test_counter_total{language="ja\\"va"} 1.0',
+            'test_counter_total{language="python"} 3.0',
+        ]
+
+    def test_counter_labels(self):
+        counter = metrics.Counter('test_labels_total', 'Things counted.',
+                                  ('language',))
+        with pytest.raises(ValueError):
+            counter.inc(pipeline='gapic')
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Durations.',
+                                      buckets=(1, 10))
+        for value in (0.5, 1, 5, 20):
+            histogram.observe(value)
+
+        assert histogram.count() == 4
+        assert histogram.render() == [
+            '# HELP test_seconds Durations.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="1.0"} 2.0',
+            'test_seconds_bucket{le="10.0"} 3.0',
+            'test_seconds_bucket{le="+Inf"} 4.0',
+            'test_seconds_sum 26.5',
+            'test_seconds_count 4.0',
+        ]
+
+    def test_http_server(self):
+        counter = metrics.Counter('test_served_total', 'Things served.')
+        counter.inc()
+        server = metrics.start_http_server(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = 'http://127.0.0.1:%d' % server.server_port
+        response = urllib.request.urlopen(url + '/metrics')
+        assert 'test_served_total 1.0\n' in response.read().decode('utf8')
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
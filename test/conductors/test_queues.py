@@ -0,0 +1,155 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import base64
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+import pytest
+
+from artman.conductors import cloudtasks_conductor, queues
+
+
+class SqliteQueueTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self._path = os.path.join(tmp_dir, 'queue.db')
+        self._queue = queues.open_queue('sqlite://' + self._path)
+
+    def test_pull(self):
+        self._queue.create_task('--api pubsub --lang python')
+        self._queue.create_task('--api logging --lang java')
+
+        tasks = self._queue.pull(5, 300)
+        assert [base64.b64decode(t['pullTaskTarget']['payload'])
+                for t in tasks] == [b'--api pubsub --lang python',
+                                    b'--api logging --lang java']
+        assert tasks[0]['taskStatus']['attemptDispatchCount'] == '0'
+        assert tasks[0]['name'] == self._path + '/tasks/1'
+        # Leased tasks are not handed out again.
+        assert self._queue.pull(5, 300) == []
+
+    def test_pull_is_limited(self):
+        for _ in range(3):
+            self._queue.create_task('--api pubsub --lang python')
+        assert len(self._queue.pull(2, 300)) == 2
+        assert len(self._queue.pull(2, 300)) == 1
+
+    def test_cancel_lease(self):
+        self._queue.create_task('--api pubsub --lang python')
+        task = self._queue.pull(1, 300)[0]
+        self._queue.cancel_lease(task)
+
+        tasks = self._queue.pull(1, 300)
+        assert tasks[0]['name'] == task['name']
+        assert tasks[0]['taskStatus']['attemptDispatchCount'] == '1'
+
+    def test_expired_lease(self):
+        self._queue.create_task('--api pubsub --lang python')
+        task = self._queue.pull(1, 0)[0]
+        time.sleep(0.01)
+
+        assert len(self._queue.pull(1, 300)) == 1
+        # The first lease is not valid anymore.
+        with pytest.raises(queues.LeaseError):
+            self._queue.ack(task)
+
+    def test_ack(self):
+        self._queue.create_task('--api pubsub --lang python')
+        task = self._queue.pull(1, 0.5)[0]
+        self._queue.ack(task)
+        time.sleep(0.5)
+        assert self._queue.pull(1, 300) == []
+
+    def test_renew_lease(self):
+        self._queue.create_task('--api pubsub --lang python')
+        task = self._queue.pull(1, 300)[0]
+        schedule_time = task['scheduleTime']
+        self._queue.renew_lease(task, 600)
+
+        assert task['scheduleTime'] > schedule_time
+        self._queue.ack(task)
+
+    def test_delete(self):
+        self._queue.create_task('--api pubsub --lang python')
+        self._queue.delete(self._queue.pull(1, 0)[0])
+        assert self._queue.pull(1, 300) == []
+
+    @mock.patch.object(cloudtasks_conductor, '_run_task')
+    def test_conductor(self, run_task):
+        run_task.side_effect = [(True, {}), (False, {})]
+        self._queue.create_task('--api pubsub --lang python')
+        self._queue.create_task('--api logging --lang python')
+        pool = multiprocessing.pool.ThreadPool(2)
+        self.addCleanup(pool.terminate)
+        running = {}
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=self._queue, running=running, pool=pool, workers=2)
+        while running:
+            cloudtasks_conductor._reap_tasks(self._queue, running)
+
+        # The failed task is available again, the other one is done.
+        tasks = self._queue.pull(5, 300)
+        assert len(tasks) == 1
+        assert tasks[0]['taskStatus']['attemptDispatchCount'] == '1'
+
+    @mock.patch.object(cloudtasks_conductor, '_run_task')
+    def test_conductor_coalesces_duplicates(self, run_task):
+        # The execution only finishes once both tasks were pulled.
+        pulled = threading.Event()
+        self.addCleanup(pulled.set)
+
+        def wait_for_pull(*args):
+            pulled.wait()
+            return True, {}
+        run_task.side_effect = wait_for_pull
+        self._queue.create_task('--api pubsub --lang python')
+        self._queue.create_task('--lang python  --api pubsub')
+        pool = multiprocessing.pool.ThreadPool(2)
+        self.addCleanup(pool.terminate)
+        running = {}
+        coalesced = cloudtasks_conductor.TASKS_COALESCED.value(
+            pipeline='', language='')
+
+        cloudtasks_conductor._pull_and_execute_tasks(
+            queue=self._queue, running=running, pool=pool, workers=2)
+        assert len(running) == 1
+        execution, = running.values()
+        assert len(execution.tasks) == 2
+        assert cloudtasks_conductor.TASKS_COALESCED.value(
+            pipeline='', language='') == coalesced + 1
+        pulled.set()
+        while running:
+            cloudtasks_conductor._reap_tasks(self._queue, running)
+
+        # A single execution completed both tasks.
+        assert run_task.call_count == 1
+        assert self._queue.pull(5, 0) == []
+
+
+class OpenQueueTests(unittest.TestCase):
+    @mock.patch.object(queues, '_create_tasks_client')
+    def test_cloud_tasks(self, create_tasks_client):
+        queue = queues.open_queue('projects/foo/locations/bar/queues/baz')
+        assert isinstance(queue, queues.CloudTasksQueue)
+        assert queue.queue_name == 'projects/foo/locations/bar/queues/baz'
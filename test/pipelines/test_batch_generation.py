@@ -143,6 +143,45 @@ class BatchTaskFactoryTests(unittest.TestCase):
                 _, kw = make.call_args
                 assert kw['git_repo'] == staging_repo
 
+    def test_get_tasks_batch_publish(self):
+        self._kwargs['publish'] = 'github'
+        self._kwargs['batch_publish'] = True
+        self._kwargs['github'] = {'username': 'test', 'token': 'TOKEN'}
+        self._kwargs['git_repos'] = {
+            'staging': {'location': 'staging_repo.git'}
+        }
+        with mock.patch.object(self._btf, 'make_single_language_flow') as make:
+            make.side_effect = lambda **kw: linear_flow.Flow(kw['api_name'])
+            batch_flow, = self._btf.get_tasks(**self._kwargs)
+            nodes = [node for node, _ in batch_flow.iter_nodes()]
+            assert make.call_count == 3
+            for _, _, kw in make.mock_calls:
+                assert kw['publish'] == 'github_batch'
+        assert isinstance(
+            nodes[0], tasks.publish.github_batch.PrepareGitHubBatchBranch)
+        assert isinstance(
+            nodes[-2], tasks.publish.github_batch.PushGitHubBatchBranch)
+        assert isinstance(
+            nodes[-1],
+            tasks.publish.github_batch.CreateGitHubBatchPullRequest)
+        assert len(nodes) == 6
+
+    def test_get_tasks_batch_publish_different_repos(self):
+        self._kwargs['publish'] = 'github'
+        self._kwargs['batch_publish'] = True
+        self._kwargs['github'] = {'username': 'test', 'token': 'TOKEN'}
+        self._kwargs['git_repos'] = {
+            'staging': {'location': 'staging_repo.git'}
+        }
+        api_kwargs = [
+            {'api_name': 'pubsub', 'git_repo': {'location': 'a.git'}},
+            {'api_name': 'logging', 'git_repo': {'location': 'b.git'}},
+        ]
+        with mock.patch.object(self._btf, 'get_language_api_kwargs') as get:
+            get.return_value = api_kwargs
+            with pytest.raises(ValueError):
+                self._btf.get_tasks(**self._kwargs)
+
 
 def test_get_artman_config_filenames_wildcard():
     api_config_patterns = ['test/cli/data/gapic/api/artman_${API_SHORT_NAME}.yaml',
@@ -43,13 +43,26 @@ class CodeGenerationPipelineBaseTests(unittest.TestCase):
 
         # Assert that the expected keyword arguments were sent.
         _, _, kwargs = super_init.mock_calls[0]
-        assert len(kwargs) == 5
+        assert len(kwargs) == 6
+        assert kwargs['upload_codec'] == 'gzip'
         assert kwargs['tarfile'] == '00000000.tar.gz'
         assert kwargs['bucket_name'] == 'pipeline'
         assert kwargs['src_path'] == '00000000.tar.gz'
         assert kwargs['dest_path'].endswith('00000000.tar.gz')
         assert kwargs['remote_mode'] is True
 
+    @mock.patch.dict('os.environ', {'ARTMAN_UPLOAD_CODEC': 'zstd'})
+    @mock.patch.object(pipeline_base.PipelineBase, '__init__')
+    @mock.patch.object(uuid, 'uuid4')
+    def test_constructor_upload_codec(self, uuid4, super_init):
+        uuid4.return_value = '00000000'
+        code_generation.CodeGenerationPipelineBase(None, remote_mode=True)
+
+        _, _, kwargs = super_init.mock_calls[0]
+        assert kwargs['upload_codec'] == 'zstd'
+        assert kwargs['tarfile'] == '00000000.tar.zst'
+        assert kwargs['dest_path'].endswith('00000000.tar.zst')
+
     @mock.patch.object(pipeline_base.PipelineBase, '__init__')
     def test_constructor_not_remote_mode(self, super_init):
         cgpb = code_generation.CodeGenerationPipelineBase(None,
@@ -0,0 +1,204 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from argparse import Namespace
+import os
+import unittest
+import uuid
+
+import github3
+
+import mock
+
+from taskflow.types import failure
+
+from artman.tasks.publish import github_batch
+from artman.utils import github_util
+
+
+_GIT_REPO = {
+    'location': 'git@github.com:me/repo.git',
+    'paths': ['generated/python/gapic-pubsub-v1'],
+}
+
+_GITHUB = {
+    'username': 'test',
+    'token': 'TOKEN',
+}
+
+
+def _fake_git(staged_tree='1111', head_tree='0000'):
+    def exec_command(args):
+        if args == ['git', 'write-tree']:
+            return staged_tree + '\n'
+        if args == ['git', 'rev-parse', 'HEAD^{tree}']:
+            return head_tree + '\n'
+        return ''
+    return exec_command
+
+
+def _commands(exec_command):
+    return [' '.join(args[0]) for _, args, _ in exec_command.mock_calls]
+
+
+class PrepareGitHubBatchBranchTests(unittest.TestCase):
+    @mock.patch.dict(os.environ, {'ARTMAN_GIT_CACHE_DIR': '/path/to/cache'})
+    @mock.patch.object(github_batch.PrepareGitHubBatchBranch, 'exec_command')
+    @mock.patch.object(uuid, 'uuid4')
+    def test_execute(self, uuid4, exec_command):
+        uuid4.return_value = uuid.UUID('00000000-0000-0000-0000-000000000000')
+        task = github_batch.PrepareGitHubBatchBranch()
+        result = task.execute(
+            git_repo=_GIT_REPO, github=_GITHUB, language='python')
+
+        assert result == ('/tmp/00000000', 'python-batch-00000000')
+        commands = _commands(exec_command)
+        assert commands[-3] == ' '.join([
+            'git clone --shared --single-branch --branch master',
+            '/path/to/cache/github.com_me_repo.git /tmp/00000000'])
+        assert commands[-1] == (
+            'git -C /tmp/00000000 checkout -b python-batch-00000000')
+
+    @mock.patch.object(github_batch.PrepareGitHubBatchBranch, 'exec_command')
+    def test_revert(self, exec_command):
+        task = github_batch.PrepareGitHubBatchBranch()
+        task.revert(result=('/tmp/00000000', 'python-batch-00000000'))
+        assert _commands(exec_command) == ['rm -rf /tmp/00000000']
+
+    @mock.patch.object(github_batch.PrepareGitHubBatchBranch, 'exec_command')
+    def test_revert_after_failure(self, exec_command):
+        task = github_batch.PrepareGitHubBatchBranch()
+        try:
+            raise RuntimeError('clone failed')
+        except RuntimeError:
+            task.revert(result=failure.Failure())
+        assert exec_command.call_count == 0
+
+
+class CommitGitHubBatchApiTests(unittest.TestCase):
+    def _execute(self):
+        task = github_batch.CommitGitHubBatchApi()
+        task.execute(
+            git_repo=_GIT_REPO,
+            api_name='pubsub',
+            api_version='v1',
+            language='python',
+            batch_repo_dir='/tmp/00000000',
+            gapic_code_dir='/path/to/code',
+        )
+
+    @mock.patch.object(github_batch.CommitGitHubBatchApi, 'exec_command')
+    @mock.patch.object(os, 'chdir')
+    def test_execute(self, chdir, exec_command):
+        exec_command.side_effect = _fake_git()
+        self._execute()
+
+        assert chdir.mock_calls[0] == mock.call('/tmp/00000000')
+        assert _commands(exec_command) == [
+            'git rm -r --force --ignore-unmatch '
+            'generated/python/gapic-pubsub-v1',
+            'cp -rf /path/to/code/. generated/python/gapic-pubsub-v1',
+            'git add generated/python/gapic-pubsub-v1',
+            'git write-tree',
+            'git rev-parse HEAD^{tree}',
+            'git commit -m Python GAPIC: Pubsub v1',
+        ]
+
+    @mock.patch.object(github_batch.CommitGitHubBatchApi, 'exec_command')
+    @mock.patch.object(os, 'chdir')
+    def test_execute_without_changes(self, chdir, exec_command):
+        exec_command.side_effect = _fake_git(staged_tree='0000')
+        self._execute()
+
+        assert not [c for c in _commands(exec_command)
+                    if c.startswith('git commit')]
+
+
+class PushGitHubBatchBranchTests(unittest.TestCase):
+    @mock.patch.object(github_batch.PushGitHubBatchBranch, 'exec_command')
+    def test_execute_without_commits(self, exec_command):
+        exec_command.return_value = ''
+        task = github_batch.PushGitHubBatchBranch()
+        commits = task.execute(
+            git_repo=_GIT_REPO,
+            batch_repo_dir='/tmp/00000000',
+            branch_name='python-batch-00000000',
+        )
+
+        assert commits == []
+        assert _commands(exec_command)[-1] == 'rm -rf /tmp/00000000'
+        assert not [c for c in _commands(exec_command) if ' push ' in c]
+
+    @mock.patch.object(github_batch.PushGitHubBatchBranch, 'exec_command')
+    def test_execute(self, exec_command):
+        exec_command.side_effect = [
+            'Python GAPIC: Pubsub v1\nPython GAPIC: Logging v2\n', '', '']
+        task = github_batch.PushGitHubBatchBranch()
+        commits = task.execute(
+            git_repo=_GIT_REPO,
+            batch_repo_dir='/tmp/00000000',
+            branch_name='python-batch-00000000',
+        )
+
+        assert commits == [
+            'Python GAPIC: Pubsub v1', 'Python GAPIC: Logging v2']
+        assert _commands(exec_command) == [
+            'git -C /tmp/00000000 log --reverse --format=%s '
+            'origin/master..python-batch-00000000',
+            'git -C /tmp/00000000 push origin python-batch-00000000',
+            'rm -rf /tmp/00000000',
+        ]
+
+
+class CreateGitHubBatchPullRequestTests(unittest.TestCase):
+    def setUp(self):
+        github_util.clear_cache()
+
+    @mock.patch.object(github3, 'login')
+    def test_execute_without_commits(self, login):
+        task = github_batch.CreateGitHubBatchPullRequest()
+        pr = task.execute(
+            git_repo=_GIT_REPO,
+            github=_GITHUB,
+            branch_name='python-batch-00000000',
+            language='python',
+            batch_commits=[],
+        )
+        assert pr is None
+        assert login.call_count == 0
+
+    @mock.patch.object(github3, 'login')
+    def test_execute(self, login):
+        gh = mock.MagicMock(spec=github3.github.GitHub)
+        login.return_value = gh
+        url = 'https://github.com/me/repo/pulls/1/'
+        gh.repository().create_pull.return_value = Namespace(html_url=url)
+
+        task = github_batch.CreateGitHubBatchPullRequest()
+        pr = task.execute(
+            git_repo=_GIT_REPO,
+            github=_GITHUB,
+            branch_name='python-batch-00000000',
+            language='python',
+            batch_commits=['Python GAPIC: Pubsub v1',
+                           'Python GAPIC: Logging v2'],
+        )
+
+        assert pr == url
+        _, _, kwargs = gh.repository().create_pull.mock_calls[0]
+        assert kwargs['title'] == 'Python GAPIC: 2 APIs'
+        assert kwargs['head'] == 'python-batch-00000000'
+        assert kwargs['body'].endswith(
+            '* Python GAPIC: Pubsub v1\n* Python GAPIC: Logging v2')
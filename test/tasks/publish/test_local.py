@@ -19,6 +19,7 @@ import unittest
 import mock
 
 from artman.tasks.publish import local
+from artman.utils import file_util
 from artman.utils.logger import logger
 
 
@@ -187,3 +188,117 @@ class LocalStagingTests(unittest.TestCase):
         for msg, call in zip(expected_messages, success.mock_calls):
             _, args, _ = call
             assert args[0] == msg
+
+    @mock.patch.object(local.LocalStagingTask, 'exec_command')
+    @mock.patch.object(logger, 'success')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.path.isdir')
+    def test_execute_reuses_existing_clone(
+            self, is_dir, exists, success, exec_command):
+        is_dir.return_value = True
+        exists.side_effect = lambda path: (
+            path == '/tmp/out/api-client-staging/.git')
+        # Run the task against the clone left by a previous run.
+        task = local.LocalStagingTask()
+        task.execute(
+            gapic_code_dir='/path/to/gapic',
+            git_repo={
+                'paths': [
+                    'gapic/pubsub'
+                ],
+                'location': 'git@github.com:googleapis/api-client-staging.git',
+            },
+            output_dir='/tmp/out',
+        )
+
+        # The clone is refreshed in place instead of being cloned again.
+        expected_commands = (
+            'git -C /tmp/out/api-client-staging fetch --quiet origin master',
+            'git -C /tmp/out/api-client-staging checkout --force --quiet '
+            '-B master FETCH_HEAD',
+            'git -C /tmp/out/api-client-staging clean -fdx --quiet',
+            'rm -rf /tmp/out/api-client-staging/gapic/pubsub',
+            'cp -rf /path/to/gapic /tmp/out/api-client-staging/gapic/pubsub',
+            'rm -rf /path/to/gapic',
+        )
+        assert len(exec_command.mock_calls) == len(expected_commands)
+        for cmd, call in zip(expected_commands, exec_command.mock_calls):
+            _, args, _ = call
+            assert ' '.join(args[0]) == cmd
+
+    @mock.patch.object(local.LocalStagingTask, 'exec_command')
+    @mock.patch.object(file_util, 'stage_tree')
+    @mock.patch('os.path.isdir')
+    def test_execute_with_staging_strategy(
+            self, is_dir, stage_tree, exec_command):
+        is_dir.return_value = True
+        stage_tree.return_value = 0
+        task = local.LocalStagingTask()
+        task.execute(
+            gapic_code_dir='/path/to/gapic',
+            git_repo={
+                'paths': ['pubsub'],
+                'location': 'api-client-staging.git',
+            },
+            local_repo_dir='/path/to/local/repo',
+            output_dir='/path/to',
+            staging_strategy='hardlink',
+        )
+
+        # The code is staged in process instead of through `cp`.
+        stage_tree.assert_called_once_with(
+            '/path/to/gapic', '/path/to/local/repo/pubsub', 'hardlink')
+        commands = [' '.join(args[0])
+                    for _, args, _ in exec_command.mock_calls]
+        assert commands == [
+            'rm -rf /path/to/local/repo/pubsub',
+            'rm -rf /path/to/gapic',
+        ]
+
+    @mock.patch.object(local.LocalStagingTask, 'exec_command')
+    @mock.patch.object(file_util, 'stage_tree')
+    @mock.patch('os.path.isdir')
+    def test_execute_move_with_overlapping_sources(
+            self, is_dir, stage_tree, exec_command):
+        is_dir.return_value = True
+        stage_tree.return_value = 0
+        task = local.LocalStagingTask()
+        task.execute(
+            gapic_code_dir='/path/to/gapic',
+            git_repo={
+                'paths': [
+                    {'src': 'v1', 'dest': 'pubsub-v1'},
+                    'pubsub',
+                    {'src': 'docs', 'dest': 'docs'},
+                ],
+                'location': 'api-client-staging.git',
+            },
+            local_repo_dir='/path/to/local/repo',
+            output_dir='/path/to',
+            staging_strategy='move',
+        )
+
+        # Only the last mapping using the gapic code moves it, the others
+        # copy it.
+        stage_tree.assert_called_once_with(
+            '/path/to/gapic/docs', '/path/to/local/repo/docs', 'move')
+        commands = [' '.join(args[0])
+                    for _, args, _ in exec_command.mock_calls]
+        assert commands[:5] == [
+            'rm -rf /path/to/local/repo/pubsub-v1',
+            'cp -rf /path/to/gapic/v1 /path/to/local/repo/pubsub-v1',
+            'rm -rf /path/to/local/repo/pubsub',
+            'cp -rf /path/to/gapic /path/to/local/repo/pubsub',
+            'rm -rf /path/to/local/repo/docs',
+        ]
+
+
+class StagingStrategiesTests(unittest.TestCase):
+    def test_not_move(self):
+        assert local._staging_strategies(
+            ['/a', '/a'], 'hardlink') == ['hardlink', 'hardlink']
+
+    def test_move_overlapping_sources(self):
+        srcs = ['/a', '/a/b', '/c', '/a', '/ab']
+        assert local._staging_strategies(srcs, 'move') == [
+            'copy', 'copy', 'move', 'move', 'move']
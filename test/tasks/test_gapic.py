@@ -13,7 +13,10 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import io
 import os
+import shutil
+import tempfile
 import unittest
 
 import mock
@@ -147,7 +150,44 @@ class GapicConfigMoveTaskTests(unittest.TestCase):
         assert task.validate() == []
 
 
+def _fake_codegen(files):
+    """Return an exec_command side effect which writes files to --output."""
+    def exec_command(args):
+        clargs = args[-1][len('-Pclargs='):].split(',')
+        output = [a for a in clargs if a.startswith('--output=')][0]
+        output_dir = output[len('--output='):]
+        for name, content in files.items():
+            path = os.path.join(output_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with io.open(path, 'w') as f:
+                f.write(content)
+    return exec_command
+
+
 class GapicCodeGenTaskTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._gapic_code_dir = os.path.join(self._tmp_dir, 'python')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _execute(self, task):
+        return task.execute(
+            api_name='pubsub',
+            api_version='v1',
+            descriptor_set='/path/to/desc',
+            gapic_api_yaml=['pubsub.yaml'],
+            gapic_code_dir=self._gapic_code_dir,
+            gapic_language_yaml=['python.yaml'],
+            language='python',
+            organization_name='google-cloud',
+            package_metadata_yaml='pmy.yaml',
+            service_yaml=['service.yaml'],
+            toolkit_path='/path/to/toolkit'
+        )
+
     @mock.patch.object(gapic_tasks.GapicCodeGenTask, 'exec_command')
     def test_execute(self, exec_command):
         task = gapic_tasks.GapicCodeGenTask()
@@ -156,7 +196,7 @@ class GapicCodeGenTaskTests(unittest.TestCase):
             api_version='v1',
             descriptor_set='/path/to/desc',
             gapic_api_yaml='pubsub.yaml',
-            gapic_code_dir='api-client-staging/generated/python',
+            gapic_code_dir=self._gapic_code_dir,
             gapic_language_yaml='python.yaml',
             language='python',
             organization_name='google-cloud',
@@ -170,6 +210,33 @@ class GapicCodeGenTaskTests(unittest.TestCase):
         for call, expected in zip(exec_command.mock_calls, expected_cmds):
             _, args, _ = call
             assert expected in ' '.join(args[0])
+            assert self._gapic_code_dir not in ' '.join(args[0])
+        # The scratch output directory is removed afterwards.
+        assert os.listdir(self._tmp_dir) == ['python']
+
+    @mock.patch.object(gapic_tasks.GapicCodeGenTask, 'exec_command')
+    def test_execute_only_writes_changes(self, exec_command):
+        task = gapic_tasks.GapicCodeGenTask()
+        exec_command.side_effect = _fake_codegen({
+            'same.py': u'same', 'changed.py': u'old', 'stale.py': u'stale'})
+        self._execute(task)
+        same_path = os.path.join(self._gapic_code_dir, 'same.py')
+        same_inode = os.stat(same_path).st_ino
+        same_mtime = os.stat(same_path).st_mtime
+
+        exec_command.side_effect = _fake_codegen({
+            'same.py': u'same', 'changed.py': u'new', 'pkg/added.py': u'add'})
+        result = self._execute(task)
+
+        assert result == self._gapic_code_dir
+        assert os.stat(same_path).st_ino == same_inode
+        assert os.stat(same_path).st_mtime == same_mtime
+        with io.open(os.path.join(self._gapic_code_dir, 'changed.py')) as f:
+            assert f.read() == u'new'
+        assert os.path.isfile(
+            os.path.join(self._gapic_code_dir, 'pkg', 'added.py'))
+        assert not os.path.exists(
+            os.path.join(self._gapic_code_dir, 'stale.py'))
 
     def test_validate(self):
         task = gapic_tasks.GapicCodeGenTask()
@@ -177,6 +244,12 @@ class GapicCodeGenTaskTests(unittest.TestCase):
 
 
 class DiscoGapicCodeGenTaskTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
     @mock.patch.object(gapic_tasks.DiscoGapicCodeGenTask, 'exec_command')
     def test_execute(self, exec_command):
         task = gapic_tasks.DiscoGapicCodeGenTask()
@@ -184,7 +257,7 @@ class DiscoGapicCodeGenTaskTests(unittest.TestCase):
             api_name='compute',
             api_version='v1',
             gapic_api_yaml='compute.yaml',
-            gapic_code_dir='api-client-staging/generated/java',
+            gapic_code_dir=os.path.join(self._tmp_dir, 'java'),
             discogapic_language_yaml='java.yaml',
             language='java',
             organization_name='google-cloud',
@@ -12,8 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
+import mock
+
 from artman.tasks import io_tasks
 
 
@@ -29,3 +36,33 @@ class ValidateUploadSizeTest(unittest.TestCase):
         self.assertRaises(
             ValueError, io_tasks._validate_upload_size,
             _UPLOAD_LIMIT + 1, _UPLOAD_LIMIT)
+
+
+class PrepareGoogleapisDirTaskTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._local_dir = os.path.join(self._tmp_dir, 'local')
+        os.makedirs(os.path.join(self._local_dir, 'google'))
+        with io.open(os.path.join(self._local_dir, 'google', 'a.yaml'),
+                     'wb') as f:
+            f.write(b'original')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_execute_with_files_dict(self):
+        root_dir = os.path.join(self._tmp_dir, 'job', 'googleapis')
+        task = io_tasks.PrepareGoogleapisDirTask()
+        with mock.patch.dict(
+                os.environ, {'ARTMAN_GOOGLEAPIS_DIR': self._local_dir}):
+            repo_dir = task.execute(root_dir, files_dict={
+                'google/a.yaml': base64.b64encode(b'override')})
+
+        assert repo_dir == root_dir
+        with io.open(os.path.join(root_dir, 'google', 'a.yaml'), 'rb') as f:
+            assert f.read() == b'override'
+        # The snapshot the file was linked from is left untouched.
+        with io.open(os.path.join(self._local_dir, 'google', 'a.yaml'),
+                     'rb') as f:
+            assert f.read() == b'original'
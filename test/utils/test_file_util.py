@@ -0,0 +1,214 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from artman.utils import file_util
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with io.open(path, 'w') as f:
+        f.write(content)
+
+
+def _read(path):
+    with io.open(path) as f:
+        return f.read()
+
+
+class SyncTreeTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp_dir, 'src')
+        self._dest = os.path.join(self._tmp_dir, 'dest')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_sync_into_missing_dest(self):
+        _write(os.path.join(self._src, 'a.txt'), u'a')
+        _write(os.path.join(self._src, 'sub', 'b.txt'), u'b')
+        result = file_util.sync_tree(self._src, self._dest)
+        assert result == file_util.SyncResult(2, 0, 0)
+        assert _read(os.path.join(self._dest, 'a.txt')) == u'a'
+        assert _read(os.path.join(self._dest, 'sub', 'b.txt')) == u'b'
+
+    def test_sync_keeps_unchanged_files(self):
+        _write(os.path.join(self._src, 'same.txt'), u'same')
+        _write(os.path.join(self._src, 'changed.txt'), u'new')
+        _write(os.path.join(self._dest, 'same.txt'), u'same')
+        _write(os.path.join(self._dest, 'changed.txt'), u'old')
+        same_inode = os.stat(os.path.join(self._dest, 'same.txt')).st_ino
+
+        result = file_util.sync_tree(self._src, self._dest)
+
+        assert result == file_util.SyncResult(1, 1, 0)
+        assert os.stat(
+            os.path.join(self._dest, 'same.txt')).st_ino == same_inode
+        assert _read(os.path.join(self._dest, 'changed.txt')) == u'new'
+
+    def test_sync_removes_stale_entries(self):
+        _write(os.path.join(self._src, 'keep.txt'), u'keep')
+        _write(os.path.join(self._dest, 'keep.txt'), u'keep')
+        _write(os.path.join(self._dest, 'stale.txt'), u'stale')
+        _write(os.path.join(self._dest, 'old', 'stale.txt'), u'stale')
+
+        result = file_util.sync_tree(self._src, self._dest)
+
+        assert result == file_util.SyncResult(0, 1, 2)
+        assert sorted(os.listdir(self._dest)) == ['keep.txt']
+
+    def test_sync_replaces_file_with_directory(self):
+        _write(os.path.join(self._src, 'entry', 'file.txt'), u'content')
+        _write(os.path.join(self._dest, 'entry'), u'file')
+
+        file_util.sync_tree(self._src, self._dest)
+
+        assert _read(os.path.join(self._dest, 'entry', 'file.txt')) == (
+            u'content')
+
+    def test_sync_preserves_mode(self):
+        script = os.path.join(self._src, 'gradlew')
+        _write(script, u'#!/bin/sh')
+        os.chmod(script, 0o755)
+        file_util.sync_tree(self._src, self._dest)
+        assert os.stat(os.path.join(self._dest, 'gradlew')).st_mode & 0o111
+
+    def test_sync_mode_only_change(self):
+        script = os.path.join(self._src, 'gradlew')
+        _write(script, u'#!/bin/sh')
+        file_util.sync_tree(self._src, self._dest)
+        os.chmod(script, 0o755)
+
+        result = file_util.sync_tree(self._src, self._dest)
+
+        assert result.written == 1
+        assert os.stat(os.path.join(self._dest, 'gradlew')).st_mode & 0o111
+
+
+class StageTreeTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp_dir, 'src')
+        self._dest = os.path.join(self._tmp_dir, 'dest')
+        _write(os.path.join(self._src, 'a.txt'), u'aaaa')
+        _write(os.path.join(self._src, 'sub', 'b.txt'), u'bb')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _assert_staged(self):
+        assert _read(os.path.join(self._dest, 'a.txt')) == u'aaaa'
+        assert _read(os.path.join(self._dest, 'sub', 'b.txt')) == u'bb'
+
+    def test_copy(self):
+        assert file_util.stage_tree(self._src, self._dest) == 6
+        self._assert_staged()
+        assert os.path.isdir(self._src)
+
+    def test_hardlink(self):
+        written = file_util.stage_tree(self._src, self._dest, 'hardlink')
+        assert written == 0
+        self._assert_staged()
+        assert os.stat(os.path.join(self._dest, 'a.txt')).st_ino == (
+            os.stat(os.path.join(self._src, 'a.txt')).st_ino)
+
+    def test_reflink(self):
+        # Copy-on-write clones are not supported by every filesystem, in
+        # which case the files are copied.
+        written = file_util.stage_tree(self._src, self._dest, 'reflink')
+        assert written in (0, 6)
+        self._assert_staged()
+
+    def test_move(self):
+        assert file_util.stage_tree(self._src, self._dest, 'move') == 0
+        self._assert_staged()
+        assert not os.path.exists(self._src)
+
+    def test_move_into_existing_dest(self):
+        _write(os.path.join(self._dest, 'a.txt'), u'old')
+        _write(os.path.join(self._dest, 'other.txt'), u'other')
+        assert file_util.stage_tree(self._src, self._dest, 'move') == 0
+        self._assert_staged()
+        assert _read(os.path.join(self._dest, 'other.txt')) == u'other'
+        assert not os.path.exists(self._src)
+
+    def test_hardlink_replaces_existing_file(self):
+        _write(os.path.join(self._dest, 'a.txt'), u'old')
+        file_util.stage_tree(self._src, self._dest, 'hardlink')
+        self._assert_staged()
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            file_util.stage_tree(self._src, self._dest, 'symlink')
+
+
+class WriteTarballTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp_dir, 'src')
+        _write(os.path.join(self._src, 'b.txt'), u'b' * 100)
+        _write(os.path.join(self._src, 'a', 'c.txt'), u'c')
+        self._dest = os.path.join(self._tmp_dir, 'out.tar.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _names(self):
+        with file_util.open_tarball_stream(self._dest) as tar:
+            return [member.name for member in tar]
+
+    def test_write_tarball(self):
+        result = file_util.write_tarball(self._src, self._dest)
+        assert result.files == 2
+        assert result.raw_size == 101
+        assert result.size == os.path.getsize(self._dest)
+        assert self._names() == ['.', './a', './a/c.txt', './b.txt']
+        with tarfile.open(self._dest, 'r:gz') as tar:
+            assert tar.extractfile('./b.txt').read() == b'b' * 100
+
+    def test_write_tarball_is_deterministic(self):
+        file_util.write_tarball(self._src, self._dest)
+        first = file_util.file_digest(self._dest)
+        file_util.write_tarball(self._src, self._dest)
+        assert file_util.file_digest(self._dest) == first
+
+    def test_write_tarball_large_file(self):
+        # Spans several gzip blocks, compressed in parallel.
+        with io.open(os.path.join(self._src, 'big.bin'), 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024))
+        file_util.write_tarball(self._src, self._dest)
+        with tarfile.open(self._dest, 'r:gz') as tar:
+            assert len(tar.extractfile('./big.bin').read()) == (
+                3 * 1024 * 1024)
+
+    def test_write_tarball_size_limit(self):
+        with io.open(os.path.join(self._src, 'big.bin'), 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024))
+        with self.assertRaises(ValueError):
+            file_util.write_tarball(self._src, self._dest,
+                                    size_limit=1024 * 1024)
+        assert not os.path.exists(self._dest)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            file_util.write_tarball(self._src, self._dest, codec='bzip2')
@@ -0,0 +1,243 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import mock
+
+import pytest
+
+from artman.utils import gcs_util
+
+
+class _FakeBlob(object):
+    """A blob recording the bytes it is given, and their MD5."""
+
+    def __init__(self, name, corrupt=False):
+        self.name = name
+        self.path = '/b/bucket/o/' + name
+        self.public_url = 'https://storage.googleapis.com/bucket/' + name
+        self.md5_hash = None
+        self.data = None
+        self.deleted = False
+        self._corrupt = corrupt
+
+    def upload_from_file(self, f, size):
+        self.data = f.read()
+        assert len(self.data) == size
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.write(self.data + (b'x' if self._corrupt else b''))
+        tmp.close()
+        self.md5_hash = gcs_util.file_md5(tmp.name)
+        os.remove(tmp.name)
+
+    def delete(self):
+        self.deleted = True
+
+
+class UploadFileTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp_dir, 'output.tar.gz')
+        with io.open(self._src, 'wb') as f:
+            f.write(b'\x1f\x8b' + os.urandom(1000))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_upload(self, storage_client):
+        bucket = storage_client.return_value.bucket.return_value
+        bucket.blob.side_effect = lambda name, chunk_size: _FakeBlob(name)
+
+        url = gcs_util.upload_file('bucket', self._src, '2018/output.tar.gz')
+
+        assert url == (
+            'https://storage.googleapis.com/bucket/2018/output.tar.gz')
+        bucket.blob.assert_called_once_with(
+            '2018/output.tar.gz', chunk_size=gcs_util.UPLOAD_CHUNK_SIZE)
+
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_upload_corrupted(self, storage_client):
+        bucket = storage_client.return_value.bucket.return_value
+        blob = _FakeBlob('output.tar.gz', corrupt=True)
+        bucket.blob.return_value = blob
+
+        with pytest.raises(IOError):
+            gcs_util.upload_file('bucket', self._src, 'output.tar.gz')
+        assert blob.deleted
+
+    @mock.patch.object(gcs_util, 'COMPOSITE_UPLOAD_THRESHOLD', 100)
+    @mock.patch.object(gcs_util, '_MIN_COMPOSITE_PART_SIZE', 300)
+    @mock.patch.object(gcs_util, '_crc32c_function')
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_composite_upload(self, storage_client, crc32c_function):
+        crc32c_function.return_value = None
+        blobs = {}
+
+        def blob(name, chunk_size=None):
+            blobs[name] = _FakeBlob(name)
+            return blobs[name]
+        bucket = storage_client.return_value.bucket.return_value
+        bucket.blob.side_effect = blob
+        api_request = storage_client.return_value.connection.api_request
+        api_request.return_value = {}
+
+        gcs_util.upload_file('bucket', self._src, 'output.tar.gz')
+
+        part_names = ['output.tar.gz.part-%02d' % i for i in range(3)]
+        with io.open(self._src, 'rb') as f:
+            assert b''.join(blobs[n].data for n in part_names) == f.read()
+        _, _, kwargs = api_request.mock_calls[0]
+        assert kwargs['path'] == '/b/bucket/o/output.tar.gz/compose'
+        assert [o['name'] for o in kwargs['data']['sourceObjects']] == (
+            part_names)
+        bucket.get_blob.assert_called_once_with('output.tar.gz')
+        _, args, _ = bucket.delete_blobs.mock_calls[0]
+        assert args[0] == part_names
+
+    def test_upload_to_local_dir(self):
+        local_dir = os.path.join(self._tmp_dir, 'gcs')
+        with mock.patch.dict(os.environ, {'ARTMAN_GCS_LOCAL_DIR': local_dir}):
+            url = gcs_util.upload_file('bucket', self._src, 'a/out.tar.gz')
+
+        dest = os.path.join(local_dir, 'bucket', 'a', 'out.tar.gz')
+        assert url.startswith('file:') and url.endswith('/a/out.tar.gz')
+        assert gcs_util.file_md5(dest) == gcs_util.file_md5(self._src)
+
+
+class FileSliceTests(unittest.TestCase):
+    def test_read_and_seek(self):
+        f = gcs_util._FileSlice(io.BytesIO(b'0123456789'), 2, 5)
+        assert f.read(2) == b'23'
+        assert f.tell() == 2
+        assert f.read() == b'456'
+        f.seek(0, os.SEEK_END)
+        assert f.tell() == 5
+        f.seek(1)
+        assert f.read(100) == b'3456'
+
+
+class DownloadFileTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._content = os.urandom(1000)
+        self._cache_dir = os.path.join(self._tmp_dir, 'cache')
+        patcher = mock.patch.dict(
+            os.environ, {'ARTMAN_GCS_CACHE_DIR': self._cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _blob(self, md5_hash=None):
+        blob = mock.Mock(size=len(self._content), generation=7,
+                         media_link='https://media', crc32c=None)
+        blob.name = 'out.tar.gz'
+        blob.bucket.name = 'bucket'
+        src = os.path.join(self._tmp_dir, 'src')
+        with io.open(src, 'wb') as f:
+            f.write(self._content)
+        blob.md5_hash = md5_hash or gcs_util.file_md5(src)
+        return blob
+
+    def _fake_http(self):
+        def request(url, method, headers):
+            start, end = headers['Range'][len('bytes='):].split('-')
+            return (mock.Mock(status=206),
+                    self._content[int(start):int(end) + 1])
+        http = mock.Mock()
+        http.request.side_effect = request
+        return http
+
+    @mock.patch.object(gcs_util, 'DOWNLOAD_RANGE_SIZE', 300)
+    @mock.patch.object(gcs_util, '_authorized_http')
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_download_and_cache(self, storage_client, authorized_http):
+        bucket = storage_client.return_value.bucket.return_value
+        bucket.get_blob.return_value = self._blob()
+        http = self._fake_http()
+        authorized_http.return_value = http
+        dest = os.path.join(self._tmp_dir, 'out', 'out.tar.gz')
+
+        cached = gcs_util.download_file('bucket', 'out.tar.gz', dest)
+
+        assert cached == os.path.join(self._cache_dir, 'bucket',
+                                      'out.tar.gz.7')
+        with io.open(dest, 'rb') as f:
+            assert f.read() == self._content
+        assert http.request.call_count == 4
+        # The copy is writable, without making the cache writable.
+        assert os.stat(dest).st_mode & 0o200
+        assert not os.stat(cached).st_mode & 0o222
+        assert not os.path.samefile(cached, dest)
+
+        # The same generation is not downloaded again.
+        gcs_util.download_file('bucket', 'out.tar.gz', dest)
+        assert http.request.call_count == 4
+
+    @mock.patch.object(gcs_util, '_authorized_http')
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_download_corrupted(self, storage_client, authorized_http):
+        bucket = storage_client.return_value.bucket.return_value
+        bucket.get_blob.return_value = self._blob(md5_hash='bad')
+        authorized_http.return_value = self._fake_http()
+
+        with pytest.raises(IOError):
+            gcs_util.download_file('bucket', 'out.tar.gz')
+        assert not os.listdir(os.path.join(self._cache_dir, 'bucket'))
+
+    @mock.patch.object(gcs_util, 'storage_client')
+    def test_missing_blob(self, storage_client):
+        bucket = storage_client.return_value.bucket.return_value
+        bucket.get_blob.return_value = None
+        assert gcs_util.download_file('bucket', 'out.tar.gz') is None
+
+    def test_download_from_local_dir_and_extract(self):
+        local_dir = os.path.join(self._tmp_dir, 'gcs')
+        os.makedirs(os.path.join(local_dir, 'bucket'))
+        data = os.path.join(self._tmp_dir, 'data.txt')
+        with io.open(data, 'wb') as f:
+            f.write(b'data')
+        with tarfile.open(os.path.join(local_dir, 'bucket', 'out.tar.gz'),
+                          'w:gz') as tar:
+            tar.add(data, 'sub/data.txt')
+        extract_dir = os.path.join(self._tmp_dir, 'extracted')
+
+        with mock.patch.dict(os.environ, {'ARTMAN_GCS_LOCAL_DIR': local_dir}):
+            gcs_util.download_file('bucket', 'out.tar.gz',
+                                   extract_dir=extract_dir)
+
+        with io.open(os.path.join(extract_dir, 'sub', 'data.txt'), 'rb') as f:
+            assert f.read() == b'data'
+
+    def test_extract_outside_of_dir(self):
+        tarball = os.path.join(self._tmp_dir, 'evil.tar')
+        data = os.path.join(self._tmp_dir, 'data.txt')
+        with io.open(data, 'wb') as f:
+            f.write(b'data')
+        with tarfile.open(tarball, 'w') as tar:
+            tar.add(data, '../evil.txt')
+
+        with pytest.raises(ValueError):
+            gcs_util.extract_tarball(
+                tarball, os.path.join(self._tmp_dir, 'extracted'))
+        assert not os.path.exists(os.path.join(self._tmp_dir, 'evil.txt'))
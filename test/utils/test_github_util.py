@@ -0,0 +1,99 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import time
+import unittest
+
+import github3
+
+import mock
+
+import pytest
+
+from artman.utils import github_util
+
+
+def _error(code, message='', headers=None):
+    response = mock.Mock(status_code=code, headers=headers or {})
+    response.json.return_value = {'message': message}
+    if code >= 500:
+        return github3.exceptions.ServerError(response)
+    return github3.exceptions.ForbiddenError(response)
+
+
+class RepositoryTests(unittest.TestCase):
+    def setUp(self):
+        github_util.clear_cache()
+
+    @mock.patch.object(github3, 'login')
+    def test_lookups_are_cached(self, login):
+        repo = github_util.repository('user', 'token', 'me', 'repo')
+        assert github_util.repository('user', 'token', 'me', 'repo') is repo
+        assert github_util.client('user', 'token') is login.return_value
+        assert login.call_count == 1
+        assert login.return_value.repository.call_count == 1
+
+    @mock.patch.object(github3, 'login')
+    @mock.patch.object(time, 'time')
+    def test_stale_repository_is_revalidated(self, now, login):
+        now.return_value = 1000
+        repo = github_util.repository('user', 'token', 'me', 'repo')
+        repo.refresh.return_value = repo
+
+        now.return_value = 1000 + github_util.REPOSITORY_TTL_SECONDS
+        assert github_util.repository('user', 'token', 'me', 'repo') is repo
+        repo.refresh.assert_called_once_with(conditional=True)
+
+
+@mock.patch.object(time, 'sleep')
+class CallWithBackoffTests(unittest.TestCase):
+    def test_retry_after(self, sleep):
+        method = mock.Mock(side_effect=[
+            _error(403, 'You have triggered an abuse detection mechanism.',
+                   {'Retry-After': '30'}),
+            'ok',
+        ])
+        assert github_util.call_with_backoff(method, 1, a=2) == 'ok'
+        sleep.assert_called_once_with(30)
+        method.assert_called_with(1, a=2)
+
+    @mock.patch.object(time, 'time')
+    def test_rate_limit_reset(self, now, sleep):
+        now.return_value = 1000
+        method = mock.Mock(side_effect=[
+            _error(403, 'API rate limit exceeded',
+                   {'X-RateLimit-Remaining': '0',
+                    'X-RateLimit-Reset': '1100'}),
+            'ok',
+        ])
+        assert github_util.call_with_backoff(method) == 'ok'
+        sleep.assert_called_once_with(101)
+
+    def test_server_errors_back_off(self, sleep):
+        method = mock.Mock(side_effect=[_error(502), _error(502), 'ok'])
+        assert github_util.call_with_backoff(method) == 'ok'
+        assert [c[1][0] for c in sleep.mock_calls] == [2, 4]
+
+    def test_gives_up(self, sleep):
+        method = mock.Mock(side_effect=_error(502))
+        with pytest.raises(github3.exceptions.ServerError):
+            github_util.call_with_backoff(method)
+        assert method.call_count == github_util.MAX_ATTEMPTS
+
+    def test_permission_errors_are_not_retried(self, sleep):
+        method = mock.Mock(side_effect=_error(403, 'Must have admin rights'))
+        with pytest.raises(github3.exceptions.ForbiddenError):
+            github_util.call_with_backoff(method)
+        assert sleep.call_count == 0
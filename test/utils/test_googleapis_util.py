@@ -0,0 +1,130 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import mock
+
+from six.moves import urllib
+
+from artman.utils import googleapis_util
+
+
+def _archive(files):
+    """Return a GitHub-like tar.gz archive of files, keyed by path."""
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as tar:
+        for path, content in sorted(files.items()):
+            info = tarfile.TarInfo('googleapis-master/' + path)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+def _response(content, etag):
+    response = io.BytesIO(content)
+    response.info = lambda: {'ETag': etag}
+    return response
+
+
+def _read(path):
+    with io.open(path, 'rb') as f:
+        return f.read()
+
+
+class MaterializeTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._cache_dir = os.path.join(self._tmp_dir, 'cache')
+        patcher = mock.patch.dict(
+            os.environ, {'ARTMAN_GOOGLEAPIS_CACHE_DIR': self._cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._archive = _archive({
+            'google/pubsub/v1/pubsub.proto': (
+                b'import "google/api/annotations.proto";\n'
+                b'import "google/protobuf/empty.proto";\n'),
+            'google/api/annotations.proto': (
+                b'import public "google/api/http.proto";'),
+            'google/api/http.proto': b'http',
+            'google/logging/v2/logging.proto': b'logging',
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    @mock.patch.object(urllib.request, 'urlopen')
+    def test_materialize_and_revalidate(self, urlopen):
+        urlopen.return_value = _response(self._archive, '"abc"')
+        dest = os.path.join(self._tmp_dir, 'job1', 'googleapis')
+
+        googleapis_util.materialize(dest, ['google/pubsub'])
+
+        assert os.path.isfile(os.path.join(dest, 'google', 'pubsub', 'v1',
+                                           'pubsub.proto'))
+        # The imported protos are made available too.
+        assert _read(os.path.join(dest, 'google', 'api', 'http.proto')) == (
+            b'http')
+        assert not os.path.exists(os.path.join(dest, 'google', 'logging'))
+        # The snapshot is not shared with the job.
+        assert not os.path.samefile(
+            os.path.join(dest, 'google', 'api', 'http.proto'),
+            os.path.join(self._cache_dir, 'googleapis', 'google', 'api',
+                         'http.proto'))
+
+        # The second job revalidates the snapshot instead of downloading it.
+        urlopen.side_effect = urllib.error.HTTPError(
+            googleapis_util.ARCHIVE_URL, 304, 'Not Modified', {}, None)
+        dest = os.path.join(self._tmp_dir, 'job2', 'googleapis')
+        googleapis_util.materialize(dest)
+
+        request = urlopen.mock_calls[-1][1][0]
+        assert request.get_header('If-none-match') == '"abc"'
+        assert _read(os.path.join(dest, 'google', 'logging', 'v2',
+                                  'logging.proto')) == b'logging'
+
+    def test_materialize_from_local_dir(self):
+        local_dir = os.path.join(self._tmp_dir, 'local')
+        os.makedirs(os.path.join(local_dir, 'google', 'api'))
+        with io.open(os.path.join(local_dir, 'google', 'api', 'a.proto'),
+                     'wb') as f:
+            f.write(b'api')
+        dest = os.path.join(self._tmp_dir, 'job', 'googleapis')
+
+        with mock.patch.dict(os.environ, {'ARTMAN_GOOGLEAPIS_DIR': local_dir}):
+            googleapis_util.materialize(dest)
+
+        assert _read(os.path.join(dest, 'google', 'api', 'a.proto')) == b'api'
+
+    def test_api_paths(self):
+        root_dir = os.path.join(self._tmp_dir, 'googleapis')
+        paths = googleapis_util.api_paths(root_dir, [
+            os.path.join(root_dir, 'google', 'pubsub', 'v1'),
+            os.path.join(root_dir, 'google', 'pubsub', 'pubsub.yaml'),
+            os.path.join(self._tmp_dir, 'toolkit', 'gapic.yaml'),
+        ])
+        assert paths == ['gapic', 'google/pubsub/pubsub.yaml',
+                         'google/pubsub/v1']
+
+    def test_extract_archive_rejects_parent_paths(self):
+        archive = _archive({'../evil': b'evil'})
+        with self.assertRaises(ValueError):
+            googleapis_util.extract_archive(
+                io.BytesIO(archive), os.path.join(self._tmp_dir, 'out'))
@@ -0,0 +1,102 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import threading
+import time
+import unittest
+
+import mock
+import pytest
+
+from taskflow import states
+from taskflow.jobs import base as jobs_base
+from taskflow.types import notifier
+
+from artman.utils import backend_helper, job_util
+
+
+class JobPosterTests(unittest.TestCase):
+    def setUp(self):
+        self._jobboard = mock.Mock()
+        self._jobboard.notifier = notifier.Notifier()
+        for name, value in (('default_persistence_backend', mock.Mock()),
+                            ('get_jobboard', self._jobboard)):
+            patcher = mock.patch.object(backend_helper, name,
+                                        return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._poster = job_util.JobPoster('board')
+        self._job = mock.Mock(uuid='job', state=states.UNCLAIMED)
+
+    def _remove_later(self, state):
+        def remove():
+            time.sleep(0.1)
+            self._job.state = state
+            self._jobboard.notifier.notify(jobs_base.REMOVAL,
+                                           {'job': self._job})
+        thread = threading.Thread(target=remove)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_wait(self):
+        self._remove_later(states.COMPLETE)
+        assert self._poster.wait(self._job, timeout=30)
+        assert self._job.state == states.COMPLETE
+
+    def test_wait_ignores_other_jobs(self):
+        self._remove_later(states.UNCLAIMED)
+        start = time.time()
+        assert not self._poster.wait(self._job, timeout=0.5)
+        assert time.time() - start >= 0.5
+
+    def test_cancel(self):
+        self._jobboard.trash.side_effect = (
+            lambda job, who: self._remove_later(states.COMPLETE))
+        self._poster.cancel(self._job)
+        self._jobboard.claim.assert_called_once_with(
+            self._job, job_util.POSTER_NAME)
+        with pytest.raises(job_util.JobCancelledError):
+            self._poster.wait(self._job)
+
+    def test_cancel_claimed_job(self):
+        self._jobboard.claim.side_effect = RuntimeError('claimed')
+        with pytest.raises(RuntimeError):
+            self._poster.cancel(self._job)
+        assert self._jobboard.trash.call_count == 0
+        assert not self._poster.wait(self._job, timeout=0)
+
+    def test_shared_posters(self):
+        self.addCleanup(job_util.close_posters)
+        self._jobboard.reset_mock()
+        poster = job_util.get_poster('board')
+        assert job_util.get_poster('board') is poster
+        self._jobboard.connect.assert_called_once_with()
+        job_util.close_posters()
+        self._jobboard.close.assert_called_once_with()
+
+    @mock.patch.object(job_util, 'get_poster')
+    def test_post_and_wait_timeout(self, get_poster):
+        get_poster.return_value.wait.return_value = False
+        get_poster.return_value.post.return_value = self._job
+        with pytest.raises(job_util.JobTimeoutError):
+            job_util.post_remote_pipeline_job_and_wait(mock.Mock(), 'board',
+                                                       timeout=1)
+
+    @mock.patch.object(job_util, 'get_poster')
+    def test_post_and_wait(self, get_poster):
+        get_poster.return_value.wait.return_value = True
+        get_poster.return_value.post.return_value = self._job
+        assert job_util.post_remote_pipeline_job_and_wait(
+            mock.Mock(), 'board', timeout=1) is self._job
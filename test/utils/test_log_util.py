@@ -0,0 +1,184 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from six.moves import BaseHTTPServer
+
+from artman.utils import log_util
+
+
+class _ListSink(object):
+    def __init__(self):
+        self.batches = []
+
+    def write(self, entries):
+        self.batches.append(list(entries))
+
+
+class ShippingHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self._sink = _ListSink()
+        self._logger = logging.getLogger('test_log_util')
+        self._logger.setLevel(logging.DEBUG)
+        self._logger.propagate = False
+
+    def _handler(self, **kwargs):
+        handler = log_util.ShippingHandler(self._sink, **kwargs)
+        self._logger.addHandler(handler)
+        self.addCleanup(self._logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_batches_by_record_count(self):
+        handler = self._handler(max_batch_records=2, flush_interval=60)
+        for i in range(5):
+            self._logger.info('line %d' % i)
+        handler.close()
+
+        assert [len(b) for b in self._sink.batches] == [2, 2, 1]
+        assert self._sink.batches[0] == [('INFO', 'line 0'),
+                                         ('INFO', 'line 1')]
+
+    def test_batches_by_size(self):
+        handler = self._handler(max_batch_bytes=10, flush_interval=60)
+        self._logger.warning('x' * 20)
+        self._logger.error('y')
+        handler.close()
+
+        assert self._sink.batches == [[('WARNING', 'x' * 20)],
+                                      [('ERROR', 'y')]]
+
+    def test_flush_ships_before_close(self):
+        handler = self._handler(flush_interval=0.05)
+        self._logger.debug('running')
+        handler.flush()
+
+        # The record is visible while the handler is still open.
+        assert self._sink.batches == [[('DEBUG', 'running')]]
+
+    def test_dropped_records_are_counted(self):
+        block = threading.Event()
+        self._sink.write = lambda entries: block.wait()
+        handler = self._handler(max_batch_records=1, max_buffered_records=1)
+        for i in range(5):
+            self._logger.info('line %d' % i)
+        assert handler.dropped >= 3
+
+        batches = []
+        self._sink.write = batches.append
+        block.set()
+        handler.close()
+        assert ('WARNING', '%d log records were dropped.' % handler.dropped
+                ) in [entry for batch in batches for entry in batch]
+
+    def test_dropped_records_are_reported_without_new_records(self):
+        handler = self._handler(flush_interval=0.05)
+        self._logger.info('line')
+        handler.flush()
+        # Records dropped once the queue is drained, with no record after.
+        handler.dropped = 2
+
+        warning = ('WARNING', '2 log records were dropped.')
+        for _ in range(100):
+            if [warning] in self._sink.batches:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail('The dropped records were not reported.')
+
+    def test_sink_failure_is_not_raised(self):
+        self._sink.write = mock.Mock(side_effect=IOError('unavailable'))
+        handler = self._handler()
+        self._logger.info('lost')
+        handler.close()
+        assert self._sink.write.call_count == 1
+
+    def test_sink_failure_is_not_shipped(self):
+        self._sink.write = mock.Mock(side_effect=IOError('unavailable'))
+        # The handler ships the records of every artman logger.
+        handler = log_util.ShippingHandler(self._sink, flush_interval=0.05)
+        artman_logger = logging.getLogger('artman')
+        artman_logger.addHandler(handler)
+        self.addCleanup(artman_logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        with mock.patch.object(log_util._logger, 'handlers', []):
+            logging.getLogger('artman.test').warning('lost')
+            time.sleep(0.5)
+        assert self._sink.write.call_count == 1
+
+
+class SinkTests(unittest.TestCase):
+    def test_file_sink(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        sink = log_util.make_sink(
+            'file://' + os.path.join(tmp_dir, '{log_id}.log'), 'abc')
+        sink.write([('INFO', 'one'), ('ERROR', 'two')])
+        sink.write([('INFO', 'three')])
+
+        with open(os.path.join(tmp_dir, 'abc.log')) as f:
+            assert f.read() == 'INFO one\nERROR two\nINFO three\n'
+
+    def test_http_sink(self):
+        bodies = []
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                bodies.append(json.loads(
+                    self.rfile.read(length).decode('utf8')))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        self.addCleanup(server.server_close)
+        sink = log_util.make_sink(
+            'http://127.0.0.1:%d/logs' % server.server_port, 'abc')
+        sink.write([('INFO', 'one')])
+        thread.join()
+
+        assert bodies == [{'log_id': 'abc',
+                           'entries': [{'severity': 'INFO', 'text': 'one'}]}]
+
+    def test_cloud_logging_sink(self):
+        client = mock.Mock()
+        sink = log_util.CloudLoggingSink('abc', client=client)
+        sink.write([('INFO', 'one'), ('ERROR', 'two')])
+
+        client.logger.assert_called_once_with('abc')
+        batch = client.logger().batch()
+        assert batch.log_text.mock_calls == [
+            mock.call('one', severity='INFO'),
+            mock.call('two', severity='ERROR')]
+        batch.commit.assert_called_once_with()
+
+    def test_unknown_sink(self):
+        with self.assertRaises(ValueError):
+            log_util.make_sink('ftp://host/logs', 'abc')
@@ -0,0 +1,200 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import collections
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import pytest
+
+from oslo_utils import timeutils
+from taskflow import exceptions
+from taskflow import task
+from taskflow.patterns import linear_flow
+
+from artman.pipelines import pipeline_factory
+from artman.utils import run_util
+
+_executed = []
+_published = []
+
+
+class _GenerateTask(task.Task):
+    default_provides = 'code_dir'
+
+    def execute(self, output_dir):
+        _executed.append('generate')
+        return os.path.join(output_dir, 'code', str(len(_executed)))
+
+
+class _CheckoutTask(task.Task):
+    default_provides = 'repo_dir'
+
+    def execute(self, output_dir):
+        _executed.append('checkout')
+        return tempfile.mkdtemp(dir=output_dir)
+
+    def revert(self, result, **kwargs):
+        shutil.rmtree(result, ignore_errors=True)
+
+
+class _CommitTask(task.Task):
+    def execute(self, repo_dir):
+        _executed.append('commit')
+        assert os.path.isdir(repo_dir)
+
+
+class _PullRequestTask(task.Task):
+    default_provides = 'pull_request'
+
+    def execute(self):
+        _executed.append('pull_request')
+        return object()
+
+
+class _PublishTask(task.Task):
+    fail = True
+
+    def execute(self, code_dir, github):
+        _executed.append('publish')
+        _published.append(code_dir)
+        assert github == _CREDENTIALS['github']
+        if _PublishTask.fail:
+            raise RuntimeError('GitHub is unavailable.')
+
+
+_CREDENTIALS = {'github': {'username': 'test', 'token': 'secret-token'}}
+
+
+_Pipeline = collections.namedtuple('_Pipeline', ['flow', 'kwargs'])
+
+
+_TASKS = {
+    'FakePipeline': (_GenerateTask, _PublishTask),
+    'CheckoutPipeline': (_GenerateTask, _CheckoutTask, _CommitTask,
+                         _PublishTask),
+    'PullRequestPipeline': (_GenerateTask, _PullRequestTask, _PublishTask),
+}
+
+
+def _make_pipeline(pipeline_name, remote_mode=False, **kwargs):
+    flow = linear_flow.Flow(pipeline_name).add(
+        *[task_class() for task_class in _TASKS[pipeline_name]])
+    return _Pipeline(flow, kwargs)
+
+
+class RunUtilTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmp_dir)
+        self._runs_dir = os.path.join(self._tmp_dir, 'runs')
+        patcher = mock.patch.dict(
+            os.environ, {'ARTMAN_PERSISTENCE': self._runs_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(pipeline_factory, 'make_pipeline',
+                                    _make_pipeline)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _PublishTask.fail = True
+        del _executed[:]
+        del _published[:]
+
+    def _failed_run(self, pipeline_name='FakePipeline', output_dir='/out'):
+        uuids = iter(['run-id'])
+        generate_uuid = run_util.uuidutils.generate_uuid
+        with mock.patch.object(
+                run_util.uuidutils, 'generate_uuid',
+                side_effect=lambda: next(uuids, None) or generate_uuid()):
+            with pytest.raises(RuntimeError):
+                run_util.run_pipeline(
+                    pipeline_name, dict(_CREDENTIALS, output_dir=output_dir))
+        assert _executed[-1] == 'publish'
+        del _executed[:]
+        return 'run-id'
+
+    def test_resume(self):
+        run_id = self._failed_run()
+        _PublishTask.fail = False
+
+        run_util.resume_pipeline(run_id, _CREDENTIALS)
+        # The generation is not done again, and its result is reused.
+        assert _executed == ['publish']
+        assert _published == ['/out/code/1', '/out/code/1']
+
+        # The run is complete, and deleted.
+        with pytest.raises(ValueError):
+            run_util.resume_pipeline(run_id, _CREDENTIALS)
+
+    def test_resume_failing_again(self):
+        run_id = self._failed_run()
+        with pytest.raises(RuntimeError):
+            run_util.resume_pipeline(run_id, _CREDENTIALS)
+        _PublishTask.fail = False
+        run_util.resume_pipeline(run_id, _CREDENTIALS)
+        assert _executed == ['publish', 'publish']
+
+    def test_resume_after_revert(self):
+        # The failed run removed the checkout when reverting, so it is done
+        # again, and so are the tasks which used it.
+        run_id = self._failed_run('CheckoutPipeline', self._tmp_dir)
+        _PublishTask.fail = False
+
+        run_util.resume_pipeline(run_id, _CREDENTIALS)
+        assert _executed == ['checkout', 'commit', 'publish']
+        assert len(set(_published)) == 1
+
+    def test_result_must_be_primitive(self):
+        with pytest.raises(exceptions.StorageFailure):
+            run_util.run_pipeline(
+                'PullRequestPipeline', dict(_CREDENTIALS, output_dir='/out'))
+        assert _executed == ['generate', 'pull_request']
+
+    def test_credentials_are_not_persisted(self):
+        self._failed_run()
+        for root, _, files in os.walk(self._runs_dir):
+            for name in files:
+                with io.open(os.path.join(root, name), 'rb') as f:
+                    assert b'secret-token' not in f.read()
+
+    def test_completed_run_is_deleted(self):
+        _PublishTask.fail = False
+        run_id = run_util.run_pipeline(
+            'FakePipeline', dict(_CREDENTIALS, output_dir='/out'))
+        with pytest.raises(ValueError):
+            run_util.load_run(run_id)
+
+    def test_old_runs_are_pruned(self):
+        run_id = self._failed_run()
+        later = timeutils.utcnow() + datetime.timedelta(
+            days=run_util.RETENTION_DAYS + 1)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            with pytest.raises(RuntimeError):
+                run_util.run_pipeline(
+                    'FakePipeline', dict(_CREDENTIALS, output_dir='/out'))
+        with pytest.raises(ValueError):
+            run_util.load_run(run_id)
+
+    def test_load_run(self):
+        run_id = self._failed_run()
+        assert run_util.load_run(run_id) == (
+            'FakePipeline', {'output_dir': '/out'})
+        with pytest.raises(ValueError):
+            run_util.load_run('unknown')